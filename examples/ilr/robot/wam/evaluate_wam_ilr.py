@@ -3,6 +3,7 @@ import os
 os.environ["OMP_NUM_THREADS"] = "1"
 
 import argparse
+import time
 
 import numpy as np
 import numpy.random as npr
@@ -21,6 +22,8 @@ from mimo.distributions import Dirichlet
 from mimo.distributions import CategoricalWithDirichlet
 
 from mimo.mixtures import BayesianMixtureOfLinearGaussians
+from mimo.mixtures import CompressedMixtureOfLinearGaussians
+from mimo.mixtures import TrajectoryPredictor
 
 from tqdm import tqdm
 
@@ -122,9 +125,33 @@ def _job(kwargs):
                 ilr.basis[i].prior = ilr.basis[i].posterior
                 ilr.models[i].prior = ilr.models[i].posterior
 
+    ilr.close_pool()
+
     return ilr
 
 
+def step_latencies(predict, input):
+    # wall-clock time of single-step predictions along a trajectory
+    latencies = np.zeros((len(input), ))
+    for t, x in enumerate(input):
+        start = time.perf_counter()
+        predict(x)
+        latencies[t] = time.perf_counter() - start
+    return latencies
+
+
+def print_latencies(name, latencies, bins):
+    usecs = 1e6 * latencies
+    print(name, '- LATENCY [us] p50:', np.percentile(usecs, 50),
+          'p90:', np.percentile(usecs, 90), 'p99:', np.percentile(usecs, 99),
+          'max:', np.max(usecs))
+
+    counts, _ = np.histogram(usecs, bins=bins)
+    for lo, hi, count in zip(bins[:-1], bins[1:], counts):
+        print('  {:8.1f} - {:8.1f} us: {:6d} '.format(lo, hi, count)
+              + '#' * int(50 * count / len(usecs)))
+
+
 def parallel_dpglm_inference(nb_jobs=50, **kwargs):
     kwargs_list = []
     for n in range(nb_jobs):
@@ -162,6 +189,9 @@ if __name__ == "__main__":
     parser.add_argument('--svi_stepsize', help='SVI step size', default=1e-3, type=float)
     parser.add_argument('--svi_batchsize', help='SVI batch size', default=1024, type=int)
     parser.add_argument('--prediction', help='prediction w/ mode or average', default='average')
+    parser.add_argument('--latency', help='report single-step prediction latencies', action='store_true', default=False)
+    parser.add_argument('--tracking_tol', help='gating mass bound of the trajectory predictor', default=1e-6, type=float)
+    parser.add_argument('--tracking_radius', help='active set radius of the trajectory predictor', default=0.5, type=float)
     parser.add_argument('--verbose', help='show learning progress', action='store_true', default=True)
     parser.add_argument('--mute', help='show no output', dest='verbose', action='store_false')
     parser.add_argument('--seed', help='choose seed', default=1337, type=int)
@@ -225,6 +255,22 @@ if __name__ == "__main__":
         print('TEST - MSE:', _test_mse, 'SMSE:', _test_smse,
               'NLPD:', _test_nlpd.mean(), 'Compnents:', _nb_models)
 
+        if args.latency:
+            # test inputs are consecutive states of the robot, as seen
+            # by a controller that predicts once per control tick
+            compressed = CompressedMixtureOfLinearGaussians(ilr)
+            tracker = TrajectoryPredictor(compressed, tol=args.tracking_tol,
+                                          radius=args.tracking_radius)
+
+            _full = step_latencies(compressed.prediction, test_input)
+            _tracked = step_latencies(tracker.predict, test_input)
+
+            bins = np.linspace(0., np.percentile(1e6 * _full, 99), 21)
+            print_latencies('FULL SCAN', _full, bins)
+            print_latencies('TRACKED', _tracked, bins)
+            print('TRACKED - Scans:', tracker.nb_scans, 'Steps:', tracker.nb_steps,
+                  'Active:', len(tracker.active), 'of', compressed.size)
+
         test_mse.append(_test_mse)
         test_smse.append(_test_smse)
         test_nlpd.append(_test_nlpd.mean())
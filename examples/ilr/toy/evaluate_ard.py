@@ -132,6 +132,8 @@ def _job(kwargs):
             ilr.basis[i].prior = ilr.basis[i].posterior
             ilr.models[i].prior = ilr.models[i].posterior
 
+    ilr.close_pool()
+
     return ilr
 
 
@@ -220,6 +220,8 @@ if __name__ == "__main__":
         tikzplotlib.save(dataset + '_' + str(n) + '.tex')
         plt.savefig(dataset + '_' + str(n) + '.pdf')
 
+    ilr.close_pool()
+
     from moviepy.editor import VideoClip
     from moviepy.video.io.bindings import mplfig_to_npimage
 
@@ -1,7 +1,8 @@
 import abc
 import copy
+
+import numpy as np
 from operator import add, sub
-from functools import reduce
 
 from future.utils import with_metaclass
 from mimo.util.data import islist
@@ -187,21 +188,94 @@ class BayesianConditional(with_metaclass(abc.ABCMeta, Conditional)):
         pass
 
 
+def _add(x, y):
+    return list(map(add, x, y)) if islist(x, y) else x + y
+
+
+def _sub(x, y):
+    return list(map(sub, x, y)) if islist(x, y) else x - y
+
+
+def _buffers(x, ids=None):
+    # ids of all arrays within (nested) statistics
+    ids = [] if ids is None else ids
+    if isinstance(x, (tuple, list)):
+        for _x in x:
+            _buffers(_x, ids)
+    elif isinstance(x, np.ndarray):
+        ids.append(id(x))
+    return ids
+
+
+def _shared(x):
+    # arrays repeated within the same statistics (e.g. counts)
+    # must not be overwritten when visiting their first entry
+    ids = _buffers(x)
+    return set(_id for _id in ids if ids.count(_id) > 1)
+
+
+def _owned(x, shared):
+    return isinstance(x, np.ndarray) and x.dtype.kind == 'f'\
+        and x.flags.writeable and id(x) not in shared
+
+
+def _axpy(x, a, y, shared):
+    if isinstance(x, Statistics):
+        return Statistics(_axpy(_x, a, _y, shared) for _x, _y in zip(x, y))
+    elif islist(x, y):
+        return [_axpy(_x, a, _y, shared) for _x, _y in zip(x, y)]
+    elif _owned(x, shared) and np.broadcast_shapes(x.shape, np.shape(y)) == x.shape:
+        if a == 1.:
+            x += y
+        else:
+            x += a * y
+        return x
+    else:
+        return x + a * y
+
+
+def _scale(x, a, shared):
+    if isinstance(x, Statistics):
+        return Statistics(_scale(_x, a, shared) for _x in x)
+    elif isinstance(x, list):
+        return [_scale(_x, a, shared) for _x in x]
+    elif _owned(x, shared):
+        x *= a
+        return x
+    else:
+        return a * x
+
+
 class Statistics(tuple):
 
+    __slots__ = ()
+
     def __new__(cls, x):
         return tuple.__new__(Statistics, x)
 
     def __add__(self, y):
-        gsum = lambda x, y: reduce(lambda a, b: list(map(add, a, b)) if islist(x, y) else a + b, [x, y])
-        return Statistics(tuple(map(gsum, self, y)))
+        return Statistics(map(_add, self, y))
 
     def __sub__(self, y):
-        gsub = lambda x, y: reduce(lambda a, b: list(map(sub, a, b)) if islist(x, y) else a - b, [x, y])
-        return Statistics(tuple(map(gsub, self, y)))
+        return Statistics(map(_sub, self, y))
 
     def __mul__(self, a):
         return Statistics(a * e for e in self)
 
     def __rmul__(self, a):
         return Statistics(a * e for e in self)
+
+    # In-place arithmetic, the array buffers of self are
+    # overwritten and only immutable entries are rebound.
+    # The result has to be reassigned, s = s.axpy(a, y)
+    def axpy(self, a, y):
+        # self + a * y
+        return _axpy(self, a, y, _shared(self))
+
+    def accumulate(self, y):
+        # self + y
+        return _axpy(self, 1., y, _shared(self))
+
+    def scale(self, a):
+        # a * self
+        return _scale(self, a, _shared(self))
@@ -10,4 +10,5 @@ from .categorical import *
 from .lingauss import *
 
 from .composite import *
+from .stacked import *
 from .bayesian import *
@@ -1,6 +1,7 @@
 import copy
 
 import numpy as np
+from scipy.special import gammaln
 
 from mimo.distributions import Categorical
 from mimo.distributions import GaussianWithDiagonalPrecision
@@ -79,6 +80,23 @@ class CategoricalWithDirichlet:
         qp_cross_entropy = self.posterior.cross_entropy(self.prior)
         return q_entropy - qp_cross_entropy
 
+    # Pruning
+    def prune(self, keep):
+        # restrict to the components in keep, a Dirichlet
+        # marginalizes to the Dirichlet over the kept entries
+        # slice before assigning, prior and posterior may be
+        # the same object after an empirical Bayes step
+        prior_alphas = self.prior.alphas[keep]
+        posterior_alphas = self.posterior.alphas[keep]
+
+        self.prior.K, self.posterior.K = len(keep), len(keep)
+        self.prior.alphas = prior_alphas
+        self.posterior.alphas = posterior_alphas
+
+        probs = self.likelihood.probs[keep]
+        self.likelihood = Categorical(K=len(keep), probs=probs / np.sum(probs))
+        return self
+
 
 class CategoricalWithStickBreaking:
     """
@@ -160,6 +178,51 @@ class CategoricalWithStickBreaking:
         qp_cross_entropy = self.posterior.cross_entropy(self.prior)
         return q_entropy - qp_cross_entropy
 
+    # Pruning
+    def prune(self, keep):
+        if self.prior is self.posterior:
+            return self._prune_shared(keep)
+
+        # restrict to the components in keep, the sticks are rebuilt
+        # from the counts of the kept components only
+        counts = (self.posterior.gammas - self.prior.gammas)[keep]
+        cumcounts = np.hstack((np.cumsum(counts[::-1])[-2::-1], 0))
+
+        # slice before assigning, prior and posterior may be
+        # the same object after an empirical Bayes step
+        gammas, deltas = self.prior.gammas[keep], self.prior.deltas[keep]
+
+        self.prior.K, self.posterior.K = len(keep), len(keep)
+        self.prior.gammas, self.prior.deltas = gammas, deltas
+        self.posterior.gammas, self.posterior.deltas = gammas + counts, deltas + cumcounts
+
+        probs = self.likelihood.probs[keep]
+        self.likelihood = Categorical(K=len(keep), probs=probs / np.sum(probs))
+        return self
+
+    def _prune_shared(self, keep):
+        # after an empirical Bayes step the counts are part of the prior
+        # and cannot be separated. The sticks are renormalized instead,
+        # such that the kept components keep the proportions of their
+        # mean weights, the mass beyond the last stick and the
+        # concentrations gammas + deltas of their sticks
+        gammas, deltas = self.posterior.gammas, self.posterior.deltas
+        sticks = gammas / (gammas + deltas)
+        rest = np.hstack((1., np.cumprod(1. - sticks)))
+
+        weights = (sticks * rest[:-1])[keep]
+        weights *= (1. - rest[-1]) / np.sum(weights)
+
+        sticks = weights / (1. - np.hstack((0., np.cumsum(weights)[:-1])))
+        scales = (gammas + deltas)[keep]
+
+        self.posterior.K = len(keep)
+        self.posterior.gammas, self.posterior.deltas = sticks * scales, (1. - sticks) * scales
+
+        probs = self.likelihood.probs[keep]
+        self.likelihood = Categorical(K=len(keep), probs=probs / np.sum(probs))
+        return self
+
 
 class GaussianWithNormalWishart:
     """
@@ -189,10 +252,11 @@ class GaussianWithNormalWishart:
         return self
 
     # Max a posteriori
-    def max_aposteriori(self, data, weights=None):
-        stats = self.likelihood.statistics(data) if weights is None\
-            else self.likelihood.weighted_statistics(data, weights)
-        self.posterior.nat_param = self.prior.nat_param + stats
+    def max_aposteriori(self, data, weights=None, stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(data) if weights is None\
+                else self.likelihood.weighted_statistics(data, weights)
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.mode()  # mode of wishart might not exist
         return self
@@ -200,25 +264,29 @@ class GaussianWithNormalWishart:
     # Gibbs sampling
     def resample(self, data=[]):
         stats = self.likelihood.statistics(data)
-        self.posterior.nat_param = self.prior.nat_param + stats
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
 
     # Mean field
-    def meanfield_update(self, data, weights=None):
-        stats = self.likelihood.statistics(data) if weights is None\
-            else self.likelihood.weighted_statistics(data, weights)
-        self.posterior.nat_param = self.prior.nat_param + stats
+    def meanfield_update(self, data, weights=None, stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(data) if weights is None\
+                else self.likelihood.weighted_statistics(data, weights)
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
 
-    def meanfield_sgdstep(self, data, weights, prob, stepsize):
-        stats = self.likelihood.statistics(data) if weights is None\
-            else self.likelihood.weighted_statistics(data, weights)
-        self.posterior.nat_param = (1. - stepsize) * self.posterior.nat_param\
-                                   + stepsize * (self.prior.nat_param + 1. / prob * stats)
+    def meanfield_sgdstep(self, data, weights, prob, stepsize, stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(data) if weights is None\
+                else self.likelihood.weighted_statistics(data, weights)
+        # (1 - stepsize) * posterior + stepsize * (prior + stats / prob)
+        self.posterior.nat_param = stats.scale(stepsize / prob)\
+            .axpy(stepsize, self.prior.nat_param)\
+            .axpy(1. - stepsize, self.posterior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
@@ -284,10 +352,11 @@ class GaussianWithNormalGamma:
         return self
 
     # Max a posteriori
-    def max_aposteriori(self, data, weights=None):
-        stats = self.likelihood.statistics(data) if weights is None\
-            else self.likelihood.weighted_statistics(data, weights)
-        self.posterior.nat_param = self.prior.nat_param + stats
+    def max_aposteriori(self, data, weights=None, stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(data) if weights is None\
+                else self.likelihood.weighted_statistics(data, weights)
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.mode()  # mode of gamma might not exist
         return self
@@ -295,25 +364,29 @@ class GaussianWithNormalGamma:
     # Gibbs sampling
     def resample(self, data=[]):
         stats = self.likelihood.statistics(data)
-        self.posterior.nat_param = self.prior.nat_param + stats
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
 
     # Mean field
-    def meanfield_update(self, data, weights=None):
-        stats = self.likelihood.statistics(data) if weights is None\
-            else self.likelihood.weighted_statistics(data, weights)
-        self.posterior.nat_param = self.prior.nat_param + stats
+    def meanfield_update(self, data, weights=None, stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(data) if weights is None\
+                else self.likelihood.weighted_statistics(data, weights)
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
 
-    def meanfield_sgdstep(self, data, weights, prob, stepsize):
-        stats = self.likelihood.statistics(data) if weights is None\
-            else self.likelihood.weighted_statistics(data, weights)
-        self.posterior.nat_param = (1. - stepsize) * self.posterior.nat_param\
-                                   + stepsize * (self.prior.nat_param + 1. / prob * stats)
+    def meanfield_sgdstep(self, data, weights, prob, stepsize, stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(data) if weights is None\
+                else self.likelihood.weighted_statistics(data, weights)
+        # (1 - stepsize) * posterior + stepsize * (prior + stats / prob)
+        self.posterior.nat_param = stats.scale(stepsize / prob)\
+            .axpy(stepsize, self.prior.nat_param)\
+            .axpy(1. - stepsize, self.posterior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
@@ -376,33 +449,39 @@ class TiedGaussiansWithNormalWishart:
         raise NotImplementedError
 
     # Max a posteriori
-    def max_aposteriori(self, data, weights):
-        stats = self.likelihood.weighted_statistics(data, weights)
-        self.posterior.nat_param = self.prior.nat_param + stats
+    def max_aposteriori(self, data, weights, stats=None):
+        if stats is None:
+            stats = self.likelihood.weighted_statistics(data, weights)
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
 
     # Gibbs sampling
-    def resample(self, data=[], labels=[]):
-        stats = self.likelihood.statistics(data, labels)
-        self.posterior.nat_param = self.prior.nat_param + stats
+    def resample(self, data=[], labels=[], stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(data, labels)
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
 
     # Mean field
-    def meanfield_update(self, data, weights):
-        stats = self.likelihood.weighted_statistics(data, weights)
-        self.posterior.nat_param = self.prior.nat_param + stats
+    def meanfield_update(self, data, weights, stats=None):
+        if stats is None:
+            stats = self.likelihood.weighted_statistics(data, weights)
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
 
-    def meanfield_sgdstep(self, data, weights, prob, stepsize):
-        stats = self.likelihood.weighted_statistics(data, weights)
-        self.posterior.nat_param = (1. - stepsize) * self.posterior.nat_param\
-                                   + stepsize * (self.prior.nat_param + 1. / prob * stats)
+    def meanfield_sgdstep(self, data, weights, prob, stepsize, stats=None):
+        if stats is None:
+            stats = self.likelihood.weighted_statistics(data, weights)
+        # (1 - stepsize) * posterior + stepsize * (prior + stats / prob)
+        self.posterior.nat_param = stats.scale(stepsize / prob)\
+            .axpy(stepsize, self.prior.nat_param)\
+            .axpy(1. - stepsize, self.posterior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
@@ -442,10 +521,11 @@ class LinearGaussianWithMatrixNormalWishart:
         return self
 
     # Max a posteriori
-    def max_aposteriori(self, y, x, weights=None):
-        stats = self.likelihood.statistics(y, x) if weights is None\
-            else self.likelihood.weighted_statistics(y, x, weights)
-        self.posterior.nat_param = self.prior.nat_param + stats
+    def max_aposteriori(self, y, x, weights=None, stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(y, x) if weights is None\
+                else self.likelihood.weighted_statistics(y, x, weights)
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.mode()
         return self
@@ -453,25 +533,29 @@ class LinearGaussianWithMatrixNormalWishart:
     # Gibbs sampling
     def resample(self, y=[], x=[]):
         stats = self.likelihood.statistics(y, x)
-        self.posterior.nat_param = self.prior.nat_param + stats
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
 
     # Mean field
-    def meanfield_update(self, y, x, weights=None):
-        stats = self.likelihood.statistics(y, x) if weights is None\
-            else self.likelihood.weighted_statistics(y, x, weights)
-        self.posterior.nat_param = self.prior.nat_param + stats
+    def meanfield_update(self, y, x, weights=None, stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(y, x) if weights is None\
+                else self.likelihood.weighted_statistics(y, x, weights)
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
 
-    def meanfield_sgdstep(self, y, x, weights, prob, stepsize):
-        stats = self.likelihood.statistics(y, x) if weights is None\
-            else self.likelihood.weighted_statistics(y, x, weights)
-        self.posterior.nat_param = (1. - stepsize) * self.posterior.nat_param\
-                                   + stepsize * (self.prior.nat_param + 1. / prob * stats)
+    def meanfield_sgdstep(self, y, x, weights, prob, stepsize, stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(y, x) if weights is None\
+                else self.likelihood.weighted_statistics(y, x, weights)
+        # (1 - stepsize) * posterior + stepsize * (prior + stats / prob)
+        self.posterior.nat_param = stats.scale(stepsize / prob)\
+            .axpy(stepsize, self.prior.nat_param)\
+            .axpy(1. - stepsize, self.posterior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
@@ -481,49 +565,60 @@ class LinearGaussianWithMatrixNormalWishart:
         qp_cross_entropy = self.posterior.cross_entropy(self.prior)
         return q_entropy - qp_cross_entropy
 
-    def posterior_predictive_gaussian(self, x, aleatoric_only=False):
+    def _posterior_predictive(self, x, aleatoric_only=False):
+        # predictive means and per-query scales c = 1 + x^T K^-1 x,
+        # from the factors cached on the posterior
         x = np.reshape(x, (-1, self.likelihood.dcol))
 
-        if self.likelihood.affine:
-            x = np.hstack((x, np.ones((len(x), 1))))
-
-        M, K, psi, nu = self.posterior.params
-
-        df = nu - self.likelihood.drow + 1
-        mus = np.einsum('kh,...h->...k', M, x)
+        A, b, L, l, df, lmbda, sigma, logdet_lmbda =\
+            self.posterior.posterior_predictive_params(self.likelihood.affine)
 
+        mus = x @ A.T + b
         if aleatoric_only:
-            lmbdas = np.tile(psi * df, (len(x), 1, 1))
+            c = np.ones((len(x), ))
         else:
-            c = 1. + np.einsum('...k,...kh,...h->...', x, np.linalg.inv(K), x)
-            lmbdas = np.einsum('kh,...->...kh', psi, df / c)
+            c = 1. + np.sum(np.square(x @ L + l), axis=1)
+        return mus, c, df, lmbda, sigma, logdet_lmbda
+
+    def posterior_predictive_gaussian(self, x, aleatoric_only=False):
+        mus, c, df, lmbda, _, _ = self._posterior_predictive(x, aleatoric_only)
+        lmbdas = np.einsum('kh,n->nkh', lmbda, 1. / c)
         return mus, lmbdas
 
     def log_posterior_predictive_gaussian(self, y, x):
-        mus, lmbdas = self.posterior_predictive_gaussian(x)
-        return mvn_logpdf(y, mus, lmbdas)
+        mus, c, df, lmbda, _, logdet_lmbda = self._posterior_predictive(x)
+
+        d = self.likelihood.drow
+        yc = np.nan_to_num(y) - mus
+        delta = np.einsum('nk,kh,nh->n', yc, lmbda, yc) / c
+        return - 0.5 * d * np.log(2. * np.pi)\
+               + 0.5 * (logdet_lmbda - d * np.log(c)) - 0.5 * delta
 
     def posterior_predictive_studentt(self, x, aleatoric_only=False):
-        x = np.reshape(x, (-1, self.likelihood.dcol))
+        mus, c, df, lmbda, _, _ = self._posterior_predictive(x, aleatoric_only)
+        lmbdas = np.einsum('kh,n->nkh', lmbda, 1. / c)
+        return mus, lmbdas, df
 
-        if self.likelihood.affine:
-            x = np.hstack((x, np.ones((len(x), 1))))
+    def log_posterior_predictive_studentt(self, y, x):
+        mus, c, df, lmbda, _, logdet_lmbda = self._posterior_predictive(x)
 
-        M, K, psi, nu = self.posterior.params
+        d = self.likelihood.drow
+        yc = np.nan_to_num(y) - mus
+        delta = np.einsum('nk,kh,nh->n', yc, lmbda, yc) / c
+        return gammaln((df + d) / 2.) - gammaln(df / 2.)\
+               + 0.5 * (logdet_lmbda - d * np.log(c)) - (d / 2.) * np.log(df * np.pi)\
+               - 0.5 * (df + d) * np.log1p(delta / df)
 
-        df = nu - self.likelihood.drow + 1
-        mus = np.einsum('kh,...h->...k', M, x)
+    def posterior_predictive_moments(self, x, dist='gaussian', aleatoric_only=False):
+        # predictive means and covariances, the query precisions
+        # psi * df / c are inverted in closed form as inv(psi) * c / df
+        mus, c, df, _, sigma, _ = self._posterior_predictive(x, aleatoric_only)
 
-        if aleatoric_only:
-            lmbdas = np.tile(psi * df, (len(x), 1, 1))
-        else:
-            c = 1. + np.einsum('...k,...kh,...h->...', x, np.linalg.inv(K), x)
-            lmbdas = np.einsum('kh,...->...kh', psi, df / c)
-        return mus, lmbdas, df
+        if dist == 'studentt':
+            c = c * df / (df - 2)
 
-    def log_posterior_predictive_studentt(self, y, x):
-        mus, lmbdas, df = self.posterior_predictive_studentt(x)
-        return mvt_logpdf(y, mu=mus, lmbda=lmbdas, df=df)
+        sigmas = np.einsum('kh,n->nkh', sigma, c)
+        return mus, sigmas
 
 
 class LinearGaussianWithMatrixNormalWishartAndAutomaticRelevance:
@@ -561,28 +656,32 @@ class LinearGaussianWithMatrixNormalWishartAndAutomaticRelevance:
             hyperstats = self.prior.statistics(A, lmbda)
             self.hypposterior.nat_param = self.hypprior.nat_param + hyperstats
 
-            self.prior.matnorm.K = np.diag(self.hypposterior.rvs())
+            self.prior.K = np.diag(self.hypposterior.rvs())
 
             stats = self.likelihood.statistics(y, x)
-            self.posterior.nat_param = self.prior.nat_param + stats
+            self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
             self.likelihood.params = self.posterior.rvs()
         return self
 
     # Mean field
-    def meanfield_update(self, y, x, weights=None):
-        stats = self.likelihood.statistics(y, x) if weights is None\
-            else self.likelihood.weighted_statistics(y, x, weights)
-        self.posterior.nat_param = self.prior.nat_param + stats
+    def meanfield_update(self, y, x, weights=None, stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(y, x) if weights is None\
+                else self.likelihood.weighted_statistics(y, x, weights)
+        self.posterior.nat_param = stats.accumulate(self.prior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
 
-    def meanfield_sgdstep(self, y, x, weights, prob, stepsize):
-        stats = self.likelihood.statistics(y, x) if weights is None\
-            else self.likelihood.weighted_statistics(y, x, weights)
-        self.posterior.nat_param = (1. - stepsize) * self.posterior.nat_param\
-                                   + stepsize * (self.prior.nat_param + 1. / prob * stats)
+    def meanfield_sgdstep(self, y, x, weights, prob, stepsize, stats=None):
+        if stats is None:
+            stats = self.likelihood.statistics(y, x) if weights is None\
+                else self.likelihood.weighted_statistics(y, x, weights)
+        # (1 - stepsize) * posterior + stepsize * (prior + stats / prob)
+        self.posterior.nat_param = stats.scale(stepsize / prob)\
+            .axpy(stepsize, self.prior.nat_param)\
+            .axpy(1. - stepsize, self.posterior.nat_param)
 
         self.likelihood.params = self.posterior.rvs()
         return self
@@ -592,6 +691,20 @@ class LinearGaussianWithMatrixNormalWishartAndAutomaticRelevance:
         qp_cross_entropy = self.posterior.cross_entropy(self.prior)
         return q_entropy - qp_cross_entropy
 
+    def _posterior_predictive(self, x, aleatoric_only=False):
+        # see LinearGaussianWithMatrixNormalWishart._posterior_predictive
+        x = np.reshape(x, (-1, self.likelihood.dcol))
+
+        A, b, L, l, df, lmbda, sigma, logdet_lmbda =\
+            self.posterior.posterior_predictive_params(self.likelihood.affine)
+
+        mus = x @ A.T + b
+        if aleatoric_only:
+            c = np.ones((len(x), ))
+        else:
+            c = 1. + np.sum(np.square(x @ L + l), axis=1)
+        return mus, c, df, lmbda, sigma, logdet_lmbda
+
     def posterior_predictive_gaussian(self, x, aleatoric_only=False):
         x = np.reshape(x, (-1, self.likelihood.dcol))
 
@@ -606,7 +719,7 @@ class LinearGaussianWithMatrixNormalWishartAndAutomaticRelevance:
         if aleatoric_only:
             lmbdas = np.tile(psi * df, (len(x), 1, 1))
         else:
-            c = 1. + np.einsum('...k,...kh,...h->...', x, np.linalg.inv(K), x)
+            c = 1. + np.sum(np.square(x @ self.posterior.matnorm.K_chol_inv), axis=1)
             lmbdas = np.einsum('kh,...->...kh', psi, df / c)
         return mus, lmbdas
 
@@ -628,7 +741,7 @@ class LinearGaussianWithMatrixNormalWishartAndAutomaticRelevance:
         if aleatoric_only:
             lmbdas = np.tile(psi * df, (len(x), 1, 1))
         else:
-            c = 1. + np.einsum('...k,...kh,...h->...', x, np.linalg.inv(K), x)
+            c = 1. + np.sum(np.square(x @ self.posterior.matnorm.K_chol_inv), axis=1)
             lmbdas = np.einsum('kh,...->...kh', psi, df / c)
         return mus, lmbdas, df
 
@@ -636,3 +749,13 @@ class LinearGaussianWithMatrixNormalWishartAndAutomaticRelevance:
         mus, lmbdas, df = self.posterior_predictive_studentt(x)
         return mvt_logpdf(y, mu=mus, lmbda=lmbdas, df=df)
 
+    def posterior_predictive_moments(self, x, dist='gaussian', aleatoric_only=False):
+        # see LinearGaussianWithMatrixNormalWishart.posterior_predictive_moments
+        mus, c, df, _, sigma, _ = self._posterior_predictive(x, aleatoric_only)
+
+        if dist == 'studentt':
+            c = c * df / (df - 2)
+
+        sigmas = np.einsum('kh,n->nkh', sigma, c)
+        return mus, sigmas
+
@@ -1,6 +1,9 @@
 import numpy as np
 import numpy.random as npr
 
+import scipy as sc
+import scipy.sparse
+
 from mimo.abstraction import Distribution
 
 
@@ -61,7 +64,10 @@ class Categorical(Distribution):
 
     def weighted_statistics(self, data, weights):
         # Stats are reduced
-        if isinstance(weights, np.ndarray):
+        if sc.sparse.issparse(weights):
+            # sparse responsibilities, see truncate_responsibilities
+            return np.asarray(weights.sum(axis=0)).ravel()
+        elif isinstance(weights, np.ndarray):
             assert weights.ndim in (1, 2)
             if data is None or weights.ndim == 2:
                 # when weights is 2D or data is None, the weights are expected
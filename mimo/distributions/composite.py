@@ -19,14 +19,94 @@ from mimo.distributions import MatrixNormalWithDiagonalPrecision
 
 from mimo.util.matrix import invpd, blockarray
 from mimo.util.data import extendlists
+from mimo.util.decorate import cached_by_version
 
 
 class NormalWishart(Distribution):
 
     def __init__(self, mu, kappa, psi, nu):
-        self.gaussian = GaussianWithPrecision(mu=mu)
-        self.wishart = Wishart(psi=psi, nu=nu)
-        self.kappa = kappa
+        self._gaussian = GaussianWithPrecision(mu=mu)
+        self._wishart = Wishart(psi=psi, nu=nu)
+        self._kappa = kappa
+
+        # natural parameters are the source of truth after posterior
+        # updates, standard parameters are only materialized on access
+        self._nat_param = None
+        self._params_version = 0
+
+        # bumped on every parameter update,
+        # invalidates the cached expectations
+        self.version = 0
+
+    @property
+    def pending(self):
+        # natural parameters not yet converted to standard ones
+        return self._nat_param is not None and self._nat_param[0] > self._params_version
+
+    def _materialize(self, params=None):
+        # params may be converted by the caller, e.g. by a component bank
+        if self.pending:
+            params = self.nat_to_std(self._nat_param[1]) if params is None else params
+            self._gaussian.mu, self._kappa, self._wishart.psi, self._wishart.nu = params
+            self._params_version = self._nat_param[0]
+
+    def _bump(self):
+        # standard parameters were set, they are now the source of truth
+        self.version += 1
+        self._params_version = self.version
+
+    @property
+    def gaussian(self):
+        self._materialize()
+        return self._gaussian
+
+    @property
+    def wishart(self):
+        self._materialize()
+        return self._wishart
+
+    @property
+    def kappa(self):
+        self._materialize()
+        return self._kappa
+
+    @kappa.setter
+    def kappa(self, value):
+        self._materialize()
+        self._kappa = value
+        self._bump()
+
+    # parameter setters bump the version, the sub-distributions
+    # must not be modified directly, e.g. via self.gaussian.mu
+    @property
+    def mu(self):
+        return self.gaussian.mu
+
+    @mu.setter
+    def mu(self, value):
+        self._materialize()
+        self._gaussian.mu = value
+        self._bump()
+
+    @property
+    def psi(self):
+        return self.wishart.psi
+
+    @psi.setter
+    def psi(self, value):
+        self._materialize()
+        self._wishart.psi = value
+        self._bump()
+
+    @property
+    def nu(self):
+        return self.wishart.nu
+
+    @nu.setter
+    def nu(self, value):
+        self._materialize()
+        self._wishart.nu = value
+        self._bump()
 
     @property
     def dim(self):
@@ -38,7 +118,8 @@ class NormalWishart(Distribution):
 
     @params.setter
     def params(self, values):
-        self.gaussian.mu, self.kappa, self.wishart.psi, self.wishart.nu = values
+        self._gaussian.mu, self._kappa, self._wishart.psi, self._wishart.nu = values
+        self._bump()
 
     def rvs(self, size=1):
         lmbda = self.wishart.rvs()
@@ -67,11 +148,15 @@ class NormalWishart(Distribution):
 
     @property
     def nat_param(self):
-        return self.std_to_nat(self.params)
+        if self._nat_param is None or self._nat_param[0] != self.version:
+            self._nat_param = (self.version, self.std_to_nat(self.params))
+            self._params_version = self.version
+        return self._nat_param[1]
 
     @nat_param.setter
     def nat_param(self, natparam):
-        self.params = self.nat_to_std(natparam)
+        self.version += 1
+        self._nat_param = (self.version, natparam)
 
     @staticmethod
     def std_to_nat(params):
@@ -105,6 +190,7 @@ class NormalWishart(Distribution):
         return - 0.5 * dim * np.log(kappa)\
                + Wishart(psi=psi, nu=nu).log_partition()
 
+    @cached_by_version
     def expected_statistics(self):
         # stats = [lmbda @ x,
         #          -0.5 * lmbda @ xxT,
@@ -164,9 +250,44 @@ class NormalWishart(Distribution):
 class NormalGamma(Distribution):
 
     def __init__(self, mu, kappas, alphas, betas):
-        self.gaussian = GaussianWithDiagonalPrecision(mu=mu)
-        self.gamma = Gamma(alphas=alphas, betas=betas)
-        self.kappas = kappas
+        self._gaussian = GaussianWithDiagonalPrecision(mu=mu)
+        self._gamma = Gamma(alphas=alphas, betas=betas)
+        self._kappas = kappas
+
+        # natural parameters are the source of truth after posterior
+        # updates, standard parameters are only materialized on access
+        self._nat_param = None
+        self._params_version = 0
+
+        self.version = 0
+
+    def _materialize(self):
+        if self._nat_param is not None and self._nat_param[0] > self._params_version:
+            self._gaussian.mu, self._kappas, self._gamma.alphas, self._gamma.betas =\
+                self.nat_to_std(self._nat_param[1])
+            self._params_version = self._nat_param[0]
+
+    @property
+    def gaussian(self):
+        self._materialize()
+        return self._gaussian
+
+    @property
+    def gamma(self):
+        self._materialize()
+        return self._gamma
+
+    @property
+    def kappas(self):
+        self._materialize()
+        return self._kappas
+
+    @kappas.setter
+    def kappas(self, value):
+        self._materialize()
+        self._kappas = value
+        self.version += 1
+        self._params_version = self.version
 
     @property
     def dim(self):
@@ -178,7 +299,9 @@ class NormalGamma(Distribution):
 
     @params.setter
     def params(self, values):
-        self.gaussian.mu, self.kappas, self.gamma.alphas, self.gamma.betas = values
+        self._gaussian.mu, self._kappas, self._gamma.alphas, self._gamma.betas = values
+        self.version += 1
+        self._params_version = self.version
 
     def rvs(self, size=1):
         lmbdas = self.gamma.rvs()
@@ -207,11 +330,15 @@ class NormalGamma(Distribution):
 
     @property
     def nat_param(self):
-        return self.std_to_nat(self.params)
+        if self._nat_param is None or self._nat_param[0] != self.version:
+            self._nat_param = (self.version, self.std_to_nat(self.params))
+            self._params_version = self.version
+        return self._nat_param[1]
 
     @nat_param.setter
     def nat_param(self, natparam):
-        self.params = self.nat_to_std(natparam)
+        self.version += 1
+        self._nat_param = (self.version, natparam)
 
     @staticmethod
     def std_to_nat(params):
@@ -329,7 +456,7 @@ class TiedNormalWisharts:
     @mus.setter
     def mus(self, values):
         for idx, c in enumerate(self.components):
-            c.gaussian.mu = values[idx]
+            c.mu = values[idx]
 
     @property
     def kappas(self):
@@ -348,7 +475,7 @@ class TiedNormalWisharts:
     def psi(self, value):
         self.wishart.psi = value
         for c in self.components:
-            c.wishart.psi = value
+            c.psi = value
 
     @property
     def nu(self):
@@ -358,7 +485,7 @@ class TiedNormalWisharts:
     def nu(self, value):
         self.wishart.nu = value
         for c in self.components:
-            c.wishart.nu = value
+            c.nu = value
 
     def mean(self):
         mus = [c.gaussian.mean() for c in self.components]
@@ -412,8 +539,42 @@ class TiedNormalWisharts:
 class MatrixNormalWishart(Distribution):
 
     def __init__(self, M, K, psi, nu):
-        self.matnorm = MatrixNormalWithPrecision(M=M, K=K)
-        self.wishart = Wishart(psi=psi, nu=nu)
+        self._matnorm = MatrixNormalWithPrecision(M=M, K=K)
+        self._wishart = Wishart(psi=psi, nu=nu)
+
+        # natural parameters are the source of truth after posterior
+        # updates, standard parameters are only materialized on access
+        self._nat_param = None
+        self._params_version = 0
+
+        # bumped on every parameter update,
+        # invalidates the cached expectations
+        self.version = 0
+
+    @property
+    def pending(self):
+        return self._nat_param is not None and self._nat_param[0] > self._params_version
+
+    def _materialize(self, params=None):
+        if self.pending:
+            params = self.nat_to_std(self._nat_param[1]) if params is None else params
+            self._matnorm.M, self._matnorm.K, self._wishart.psi, self._wishart.nu = params
+            self._params_version = self._nat_param[0]
+
+    def _bump(self):
+        # standard parameters were set, they are now the source of truth
+        self.version += 1
+        self._params_version = self.version
+
+    @property
+    def matnorm(self):
+        self._materialize()
+        return self._matnorm
+
+    @property
+    def wishart(self):
+        self._materialize()
+        return self._wishart
 
     @property
     def dcol(self):
@@ -423,13 +584,56 @@ class MatrixNormalWishart(Distribution):
     def drow(self):
         return self.matnorm.drow
 
+    # parameter setters bump the version, the sub-distributions
+    # must not be modified directly, e.g. via self.matnorm.K
+    @property
+    def M(self):
+        return self.matnorm.M
+
+    @M.setter
+    def M(self, value):
+        self._materialize()
+        self._matnorm.M = value
+        self._bump()
+
+    @property
+    def K(self):
+        return self.matnorm.K
+
+    @K.setter
+    def K(self, value):
+        self._materialize()
+        self._matnorm.K = value
+        self._bump()
+
+    @property
+    def psi(self):
+        return self.wishart.psi
+
+    @psi.setter
+    def psi(self, value):
+        self._materialize()
+        self._wishart.psi = value
+        self._bump()
+
+    @property
+    def nu(self):
+        return self.wishart.nu
+
+    @nu.setter
+    def nu(self, value):
+        self._materialize()
+        self._wishart.nu = value
+        self._bump()
+
     @property
     def params(self):
         return self.matnorm.M, self.matnorm.K, self.wishart.psi, self.wishart.nu
 
     @params.setter
     def params(self, values):
-        self.matnorm.M, self.matnorm.K, self.wishart.psi, self.wishart.nu = values
+        self._matnorm.M, self._matnorm.K, self._wishart.psi, self._wishart.nu = values
+        self._bump()
 
     def rvs(self, size=1):
         lmbda = self.wishart.rvs()
@@ -465,11 +669,15 @@ class MatrixNormalWishart(Distribution):
 
     @property
     def nat_param(self):
-        return self.std_to_nat(self.params)
+        if self._nat_param is None or self._nat_param[0] != self.version:
+            self._nat_param = (self.version, self.std_to_nat(self.params))
+            self._params_version = self.version
+        return self._nat_param[1]
 
     @nat_param.setter
     def nat_param(self, natparam):
-        self.params = self.nat_to_std(natparam)
+        self.version += 1
+        self._nat_param = (self.version, natparam)
 
     @staticmethod
     def std_to_nat(params):
@@ -503,6 +711,7 @@ class MatrixNormalWishart(Distribution):
         return - 0.5 * drow * np.linalg.slogdet(K)[1]\
                + Wishart(psi=psi, nu=nu).log_partition()
 
+    @cached_by_version
     def expected_statistics(self):
         # stats = [lmbda @ A,
         #          -0.5 * lmbda @ AAT,
@@ -551,23 +760,52 @@ class MatrixNormalWishart(Distribution):
                + np.einsum('kh,nkh->n', nat_param[2], stats[2])\
                + nat_param[3] * stats[3]
 
-    def expected_log_likelihood(self, y, x, affine=True):
+    @cached_by_version
+    def expected_log_likelihood_params(self, affine=True):
         E_Lmbda_A, _E_AT_Lmbda_A, _E_lmbda, _E_logdet_lmbda = self.expected_statistics()
         E_AT_Lmbda_A, E_lmbda, E_logdet_lmbda = -2. * _E_AT_Lmbda_A, -2. * _E_lmbda, 2. * _E_logdet_lmbda
 
-        res = 0.
+        E_Lmbda_b, E_AT_Lmbda_b, E_bT_Lmbda_b = None, None, None
         if affine:
             E_Lmbda_A, E_Lmbda_b = E_Lmbda_A[:, :-1], E_Lmbda_A[:, -1]
             E_AT_Lmbda_A, E_AT_Lmbda_b, E_bT_Lmbda_b = E_AT_Lmbda_A[:-1, :-1],\
                                                        E_AT_Lmbda_A[:-1, -1],\
                                                        E_AT_Lmbda_A[-1, -1]
-            res += y.dot(E_Lmbda_b)
-            res -= x.dot(E_AT_Lmbda_b)
-            res -= 1. / 2 * E_bT_Lmbda_b
 
         parammat = -1. / 2 * blockarray([[E_AT_Lmbda_A, - E_Lmbda_A.T],
                                          [- E_Lmbda_A,    E_lmbda]])
 
+        return parammat, E_Lmbda_b, E_AT_Lmbda_b, E_bT_Lmbda_b, E_logdet_lmbda
+
+    @cached_by_version
+    def posterior_predictive_params(self, affine=True):
+        # factors of the matrix-t posterior predictive, the intercept
+        # is split off such that queries are not padded with ones
+        M, K_chol_inv = self.matnorm.M, self.matnorm.K_chol_inv
+
+        b, K_chol_inv_b = np.zeros((self.drow, )), np.zeros((self.dcol, ))
+        if affine:
+            M, b = M[:, :-1], M[:, -1]
+            K_chol_inv, K_chol_inv_b = K_chol_inv[:-1], K_chol_inv[-1]
+
+        df = self.wishart.nu - self.drow + 1
+        lmbda = self.wishart.psi * df
+        sigma = self.wishart.psi_inv / df
+        logdet_lmbda = 2. * np.sum(np.log(np.diag(self.wishart.psi_chol)))\
+                       + self.drow * np.log(df)
+
+        return M, b, K_chol_inv, K_chol_inv_b, df, lmbda, sigma, logdet_lmbda
+
+    def expected_log_likelihood(self, y, x, affine=True):
+        parammat, E_Lmbda_b, E_AT_Lmbda_b, E_bT_Lmbda_b, E_logdet_lmbda =\
+            self.expected_log_likelihood_params(affine)
+
+        res = 0.
+        if affine:
+            res += y.dot(E_Lmbda_b)
+            res -= x.dot(E_AT_Lmbda_b)
+            res -= 1. / 2 * E_bT_Lmbda_b
+
         xy = np.hstack((x, y))
 
         res += np.einsum('ni,ni->n', xy.dot(parammat), xy, optimize=True)
@@ -1,7 +1,6 @@
 import numpy as np
 import numpy.random as npr
 
-from operator import add
 from functools import reduce, partial
 
 from mimo.abstraction import Distribution
@@ -75,20 +74,25 @@ class GaussianWithDiagonalCovariance(Distribution):
     def mode(self):
         return self.mu
 
-    def log_likelihood(self, x):
-        bads = np.isnan(np.atleast_2d(x)).any(axis=1)
-        x = np.nan_to_num(x, copy=False).reshape((-1, self.dim))
+    def log_likelihood(self, x, clean=False):
+        # clean data, e.g. the stored data of a mixture, skips the nan scan
+        if not clean:
+            bads = np.isnan(np.atleast_2d(x)).any(axis=1)
+            x = np.nan_to_num(x, copy=False)
+        x = x.reshape((-1, self.dim))
 
         log_lik = np.einsum('k,kh,nh->n', self.mu, self.lmbda, x)\
                   - 0.5 * np.einsum('nk,kh,nh->n', x, self.lmbda, x)
 
-        log_lik[bads] = 0
+        if not clean:
+            log_lik[bads] = 0
         return - self.log_partition() + self.log_base() + log_lik
 
-    def statistics(self, data, vectorize=False):
+    def statistics(self, data, vectorize=False, clean=False):
         if isinstance(data, np.ndarray):
-            idx = ~np.isnan(data).any(axis=1)
-            data = data[idx]
+            if not clean:
+                idx = ~np.isnan(data).any(axis=1)
+                data = data[idx]
 
             x = data
             xx = np.einsum('nk,nk->nk', data, data)
@@ -101,15 +105,16 @@ class GaussianWithDiagonalCovariance(Distribution):
 
             return Stats([x, n, n, xx])
         else:
-            func = partial(self.statistics, vectorize=vectorize)
+            func = partial(self.statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, data))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
-    def weighted_statistics(self, data, weights, vectorize=False):
+    def weighted_statistics(self, data, weights, vectorize=False, clean=False):
         if isinstance(data, np.ndarray):
-            idx = ~np.isnan(data).any(axis=1)
-            data = data[idx]
-            weights = weights[idx]
+            if not clean:
+                idx = ~np.isnan(data).any(axis=1)
+                data = data[idx]
+                weights = weights[idx]
 
             x = np.einsum('n,nk->nk', weights, data)
             xx = np.einsum('nk,n,nk->nk', data, weights, data)
@@ -122,9 +127,9 @@ class GaussianWithDiagonalCovariance(Distribution):
 
             return Stats([x, n, n, xx])
         else:
-            func = partial(self.weighted_statistics, vectorize=vectorize)
+            func = partial(self.weighted_statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, data, weights))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
     @property
     def base(self):
@@ -278,20 +283,24 @@ class GaussianWithDiagonalPrecision(Distribution):
     def mode(self):
         return self.mu
 
-    def log_likelihood(self, x):
-        bads = np.isnan(np.atleast_2d(x)).any(axis=1)
-        x = np.nan_to_num(x, copy=False).reshape((-1, self.dim))
+    def log_likelihood(self, x, clean=False):
+        if not clean:
+            bads = np.isnan(np.atleast_2d(x)).any(axis=1)
+            x = np.nan_to_num(x, copy=False)
+        x = x.reshape((-1, self.dim))
 
         log_lik = np.einsum('k,kh,nh->n', self.mu, self.lmbda, x)\
                   - 0.5 * np.einsum('nk,kh,nh->n', x, self.lmbda, x)
 
-        log_lik[bads] = 0
+        if not clean:
+            log_lik[bads] = 0
         return - self.log_partition() + self.log_base() + log_lik
 
-    def statistics(self, data, vectorize=False):
+    def statistics(self, data, vectorize=False, clean=False):
         if isinstance(data, np.ndarray):
-            idx = ~np.isnan(data).any(axis=1)
-            data = data[idx]
+            if not clean:
+                idx = ~np.isnan(data).any(axis=1)
+                data = data[idx]
 
             x = data
             xx = np.einsum('nk,nk->nk', data, data)
@@ -304,15 +313,16 @@ class GaussianWithDiagonalPrecision(Distribution):
 
             return Stats([x, n, n, xx])
         else:
-            func = partial(self.statistics, vectorize=vectorize)
+            func = partial(self.statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, data))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
-    def weighted_statistics(self, data, weights, vectorize=False):
+    def weighted_statistics(self, data, weights, vectorize=False, clean=False):
         if isinstance(data, np.ndarray):
-            idx = ~np.isnan(data).any(axis=1)
-            data = data[idx]
-            weights = weights[idx]
+            if not clean:
+                idx = ~np.isnan(data).any(axis=1)
+                data = data[idx]
+                weights = weights[idx]
 
             x = np.einsum('n,nk->nk', weights, data)
             xx = np.einsum('nk,n,nk->nk', data, weights, data)
@@ -325,9 +335,9 @@ class GaussianWithDiagonalPrecision(Distribution):
 
             return Stats([x, n, n, xx])
         else:
-            func = partial(self.weighted_statistics, vectorize=vectorize)
+            func = partial(self.weighted_statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, data, weights))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
     @property
     def base(self):
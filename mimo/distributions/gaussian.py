@@ -4,7 +4,6 @@ import numpy.random as npr
 import scipy as sc
 from scipy import linalg
 
-from operator import add
 from functools import reduce, partial
 
 from mimo.abstraction import Distribution
@@ -78,20 +77,25 @@ class GaussianWithCovariance(Distribution):
     def mode(self):
         return self.mu
 
-    def log_likelihood(self, x):
-        bads = np.isnan(np.atleast_2d(x)).any(axis=1)
-        x = np.nan_to_num(x, copy=False).reshape((-1, self.dim))
+    def log_likelihood(self, x, clean=False):
+        # clean data is known to be free of nans and is not rescanned
+        if not clean:
+            bads = np.isnan(np.atleast_2d(x)).any(axis=1)
+            x = np.nan_to_num(x, copy=False)
+        x = x.reshape((-1, self.dim))
 
         log_lik = np.einsum('k,kh,nh->n', self.mu, self.lmbda, x, optimize=True)\
                   - 0.5 * np.einsum('nk,kh,nh->n', x, self.lmbda, x, optimize=True)
 
-        log_lik[bads] = 0
+        if not clean:
+            log_lik[bads] = 0
         return - self.log_partition() + self.log_base() + log_lik
 
-    def statistics(self, data, vectorize=False):
+    def statistics(self, data, vectorize=False, clean=False):
         if isinstance(data, np.ndarray):
-            idx = ~np.isnan(data).any(axis=1)
-            data = data[idx]
+            if not clean:
+                idx = ~np.isnan(data).any(axis=1)
+                data = data[idx]
 
             if vectorize:
                 c0, c1 = 'nk->nk', 'nk,nh->nkh'
@@ -105,15 +109,16 @@ class GaussianWithCovariance(Distribution):
 
             return Stats([x, n, xxT, n])
         else:
-            func = partial(self.statistics, vectorize=vectorize)
+            func = partial(self.statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, data))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
-    def weighted_statistics(self, data, weights, vectorize=False):
+    def weighted_statistics(self, data, weights, vectorize=False, clean=False):
         if isinstance(data, np.ndarray):
-            idx = ~np.isnan(data).any(axis=1)
-            data = data[idx]
-            weights = weights[idx]
+            if not clean:
+                idx = ~np.isnan(data).any(axis=1)
+                data = data[idx]
+                weights = weights[idx]
 
             if vectorize:
                 c0, c1 = 'n,nk->nk', 'nk,n,nh->nkh'
@@ -127,9 +132,9 @@ class GaussianWithCovariance(Distribution):
 
             return Stats([x, n, xxT, n])
         else:
-            func = partial(self.weighted_statistics, vectorize=vectorize)
+            func = partial(self.weighted_statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, data, weights))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
     @property
     def base(self):
@@ -279,20 +284,24 @@ class GaussianWithPrecision(Distribution):
     def mode(self):
         return self.mu
 
-    def log_likelihood(self, x):
-        bads = np.isnan(np.atleast_2d(x)).any(axis=1)
-        x = np.nan_to_num(x, copy=False).reshape((-1, self.dim))
+    def log_likelihood(self, x, clean=False):
+        if not clean:
+            bads = np.isnan(np.atleast_2d(x)).any(axis=1)
+            x = np.nan_to_num(x, copy=False)
+        x = x.reshape((-1, self.dim))
 
         log_lik = np.einsum('k,kh,nh->n', self.mu, self.lmbda, x, optimize=True)\
                   - 0.5 * np.einsum('nk,kh,nh->n', x, self.lmbda, x, optimize=True)
 
-        log_lik[bads] = 0
+        if not clean:
+            log_lik[bads] = 0
         return - self.log_partition() + self.log_base() + log_lik
 
-    def statistics(self, data, vectorize=False):
+    def statistics(self, data, vectorize=False, clean=False):
         if isinstance(data, np.ndarray):
-            idx = ~np.isnan(data).any(axis=1)
-            data = data[idx]
+            if not clean:
+                idx = ~np.isnan(data).any(axis=1)
+                data = data[idx]
 
             if vectorize:
                 c0, c1 = 'nk->nk', 'nk,nh->nkh'
@@ -306,15 +315,16 @@ class GaussianWithPrecision(Distribution):
 
             return Stats([x, n, xxT, n])
         else:
-            func = partial(self.statistics, vectorize=vectorize)
+            func = partial(self.statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, data))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
-    def weighted_statistics(self, data, weights, vectorize=False):
+    def weighted_statistics(self, data, weights, vectorize=False, clean=False):
         if isinstance(data, np.ndarray):
-            idx = ~np.isnan(data).any(axis=1)
-            data = data[idx]
-            weights = weights[idx]
+            if not clean:
+                idx = ~np.isnan(data).any(axis=1)
+                data = data[idx]
+                weights = weights[idx]
 
             if vectorize:
                 c0, c1 = 'n,nk->nk', 'nk,n,nh->nkh'
@@ -328,9 +338,9 @@ class GaussianWithPrecision(Distribution):
 
             return Stats([x, n, xxT, n])
         else:
-            func = partial(self.weighted_statistics, vectorize=vectorize)
+            func = partial(self.weighted_statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, data, weights))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
     @property
     def base(self):
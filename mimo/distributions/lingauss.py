@@ -3,7 +3,6 @@ import numpy.random as npr
 
 import scipy as sc
 
-from operator import add
 from functools import reduce, partial
 
 from mimo.abstraction import Conditional
@@ -105,28 +104,35 @@ class LinearGaussianWithPrecision(Conditional):
     def mode(self, x):
         return self.predict(x)
 
-    def log_likelihood(self, y, x):
+    def log_likelihood(self, y, x, clean=False):
         assert x is not None
 
-        bads = np.logical_and(np.isnan(np.atleast_2d(x)).any(axis=1),
-                              np.isnan(np.atleast_2d(y)).any(axis=1))
+        # clean data, without any missing values, is not rescanned
+        if not clean:
+            bads = np.logical_and(np.isnan(np.atleast_2d(x)).any(axis=1),
+                                  np.isnan(np.atleast_2d(y)).any(axis=1))
 
-        x = np.nan_to_num(x, copy=False).reshape((-1, self.dcol))
-        y = np.nan_to_num(y, copy=False).reshape((-1, self.drow))
+            x = np.nan_to_num(x, copy=False)
+            y = np.nan_to_num(y, copy=False)
+
+        x = x.reshape((-1, self.dcol))
+        y = y.reshape((-1, self.drow))
 
         mu = self.mean(x)
         log_lik = np.einsum('nk,kh,nh->n', mu, self.lmbda, y, optimize=True)\
                   - 0.5 * np.einsum('nk,kh,nh->n', mu, self.lmbda, mu)\
                   - 0.5 * np.einsum('nk,kh,nh->n', y, self.lmbda, y, optimize=True)
 
-        log_lik[bads] = 0
+        if not clean:
+            log_lik[bads] = 0
         return - self.log_partition() + self.log_base() + log_lik
 
-    def statistics(self, y, x, vectorize=False):
+    def statistics(self, y, x, vectorize=False, clean=False):
         if isinstance(y, np.ndarray) and isinstance(x, np.ndarray):
-            idx = np.logical_and(~np.isnan(y).any(axis=1),
-                                 ~np.isnan(x).any(axis=1))
-            y, x = y[idx], x[idx]
+            if not clean:
+                idx = np.logical_and(~np.isnan(y).any(axis=1),
+                                     ~np.isnan(x).any(axis=1))
+                y, x = y[idx], x[idx]
 
             if self.affine:
                 x = np.hstack((x, np.ones((x.shape[0], 1))))
@@ -144,15 +150,16 @@ class LinearGaussianWithPrecision(Conditional):
 
             return Stats([yxT, xxT, yyT, n])
         else:
-            func = partial(self.statistics, vectorize=vectorize)
+            func = partial(self.statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, y, x))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
-    def weighted_statistics(self, y, x, weights, vectorize=False):
+    def weighted_statistics(self, y, x, weights, vectorize=False, clean=False):
         if isinstance(y, np.ndarray) and isinstance(x, np.ndarray):
-            idx = np.logical_and(~np.isnan(y).any(axis=1),
-                                 ~np.isnan(x).any(axis=1))
-            y, x, weights = y[idx], x[idx], weights[idx]
+            if not clean:
+                idx = np.logical_and(~np.isnan(y).any(axis=1),
+                                     ~np.isnan(x).any(axis=1))
+                y, x, weights = y[idx], x[idx], weights[idx]
 
             if self.affine:
                 x = np.hstack((x, np.ones((x.shape[0], 1))))
@@ -170,9 +177,9 @@ class LinearGaussianWithPrecision(Conditional):
 
             return Stats([yxT, xxT, yyT, n])
         else:
-            func = partial(self.weighted_statistics, vectorize=vectorize)
+            func = partial(self.weighted_statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, y, x, weights))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
     @property
     def base(self):
@@ -302,28 +309,34 @@ class LinearGaussianWithDiagonalPrecision(Conditional):
     def mode(self, x):
         return self.predict(x)
 
-    def log_likelihood(self, y, x):
+    def log_likelihood(self, y, x, clean=False):
         assert x is not None
 
-        bads = np.logical_and(np.isnan(np.atleast_2d(x)).any(axis=1),
-                              np.isnan(np.atleast_2d(y)).any(axis=1))
+        if not clean:
+            bads = np.logical_and(np.isnan(np.atleast_2d(x)).any(axis=1),
+                                  np.isnan(np.atleast_2d(y)).any(axis=1))
+
+            x = np.nan_to_num(x, copy=False)
+            y = np.nan_to_num(y, copy=False)
 
-        x = np.nan_to_num(x, copy=False).reshape((-1, self.dcol))
-        y = np.nan_to_num(y, copy=False).reshape((-1, self.drow))
+        x = x.reshape((-1, self.dcol))
+        y = y.reshape((-1, self.drow))
 
         mu = self.mean(x)
         log_lik = np.einsum('nk,kh,nh->n', mu, self.lmbda, y, optimize=True)\
                   - 0.5 * np.einsum('nk,kh,nh->n', mu, self.lmbda, mu)\
                   - 0.5 * np.einsum('nk,kh,nh->n', y, self.lmbda, y, optimize=True)
 
-        log_lik[bads] = 0
+        if not clean:
+            log_lik[bads] = 0
         return - self.log_partition() + self.log_base() + log_lik
 
-    def statistics(self, y, x, vectorize=False):
+    def statistics(self, y, x, vectorize=False, clean=False):
         if isinstance(y, np.ndarray) and isinstance(x, np.ndarray):
-            idx = np.logical_and(~np.isnan(y).any(axis=1),
-                                 ~np.isnan(x).any(axis=1))
-            y, x = y[idx], x[idx]
+            if not clean:
+                idx = np.logical_and(~np.isnan(y).any(axis=1),
+                                     ~np.isnan(x).any(axis=1))
+                y, x = y[idx], x[idx]
 
             if self.affine:
                 x = np.hstack((x, np.ones((x.shape[0], 1))))
@@ -341,15 +354,16 @@ class LinearGaussianWithDiagonalPrecision(Conditional):
 
             return Stats([yxT, xxT, yy, n])
         else:
-            func = partial(self.statistics, vectorize=vectorize)
+            func = partial(self.statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, y, x))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
-    def weighted_statistics(self, y, x, weights, vectorize=False):
+    def weighted_statistics(self, y, x, weights, vectorize=False, clean=False):
         if isinstance(y, np.ndarray) and isinstance(x, np.ndarray):
-            idx = np.logical_and(~np.isnan(y).any(axis=1),
-                                 ~np.isnan(x).any(axis=1))
-            y, x, weights = y[idx], x[idx], weights[idx]
+            if not clean:
+                idx = np.logical_and(~np.isnan(y).any(axis=1),
+                                     ~np.isnan(x).any(axis=1))
+                y, x, weights = y[idx], x[idx], weights[idx]
 
             if self.affine:
                 x = np.hstack((x, np.ones((x.shape[0], 1))))
@@ -367,9 +381,9 @@ class LinearGaussianWithDiagonalPrecision(Conditional):
 
             return Stats([yxT, xxT, yy, n])
         else:
-            func = partial(self.weighted_statistics, vectorize=vectorize)
+            func = partial(self.weighted_statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, y, x, weights))
-            return stats if vectorize else reduce(add, stats)
+            return stats if vectorize else reduce(Stats.accumulate, stats)
 
     @property
     def base(self):
@@ -17,6 +17,9 @@ class MatrixNormalWithPrecision(Distribution):
         self._V_chol = None
         self._K_chol = None
 
+        self._V_chol_inv = None
+        self._K_chol_inv = None
+
         self._lmbda_chol = None
         self._lmbda_chol_inv = None
 
@@ -49,6 +52,7 @@ class MatrixNormalWithPrecision(Distribution):
     def V(self, value):
         self._V = value
         self._V_chol = None
+        self._V_chol_inv = None
 
         self._lmbda_chol = None
         self._lmbda_chol_inv = None
@@ -60,6 +64,12 @@ class MatrixNormalWithPrecision(Distribution):
             self._V_chol = sc.linalg.cholesky(self.V, lower=False)
         return self._V_chol
 
+    @property
+    def V_chol_inv(self):
+        if self._V_chol_inv is None:
+            self._V_chol_inv = sc.linalg.solve_triangular(self.V_chol, np.eye(self.drow))
+        return self._V_chol_inv
+
     @property
     def K(self):
         return self._K
@@ -68,6 +78,7 @@ class MatrixNormalWithPrecision(Distribution):
     def K(self, value):
         self._K = value
         self._K_chol = None
+        self._K_chol_inv = None
 
         self._lmbda_chol = None
         self._lmbda_chol_inv = None
@@ -79,6 +90,12 @@ class MatrixNormalWithPrecision(Distribution):
             self._K_chol = sc.linalg.cholesky(self.K, lower=False)
         return self._K_chol
 
+    @property
+    def K_chol_inv(self):
+        if self._K_chol_inv is None:
+            self._K_chol_inv = sc.linalg.solve_triangular(self.K_chol, np.eye(self.dcol))
+        return self._K_chol_inv
+
     @property
     def lmbda(self):
         return np.kron(self.K, self.V)
@@ -97,13 +114,13 @@ class MatrixNormalWithPrecision(Distribution):
         return self._lmbda_chol_inv
 
     def rvs(self, size=1):
+        # M + V_chol^-1 Z K_chol^-T has precision kron(K, V)
+        # on vec(A), without forming the kronecker product
         if size == 1:
-            aux = npr.normal(size=self.drow * self.dcol).dot(self.lmbda_chol_inv.T)
-            return self.M + np.reshape(aux, (self.drow, self.dcol), order='F')
+            aux = npr.normal(size=(self.drow, self.dcol))
         else:
-            size = tuple([size, self.drow * self.dcol])
-            aux = npr.normal(size=size).dot(self.lmbda_chol_inv.T)
-            return self.M + np.reshape(aux, (size, self.drow, self.dcol), order='F')
+            aux = npr.normal(size=(size, self.drow, self.dcol))
+        return self.M + self.V_chol_inv @ aux @ self.K_chol_inv.T
 
     def mean(self):
         return self.M
@@ -112,19 +129,16 @@ class MatrixNormalWithPrecision(Distribution):
         return self.M
 
     def log_likelihood(self, x):
-        # apply vector operator with Fortran convention
-        xr = np.reshape(x, (-1, self.drow * self.dcol), order='F')
-        mu = np.reshape(self.M, (self.drow * self.dcol), order='F')
+        # trace form tr(K (x - M)^T V (x - M)) = |V_chol (x - M) K_chol^T|^2
+        x = np.reshape(x, (-1, self.drow, self.dcol))
 
-        # Gaussian likelihood on vector dist.
-        bads = np.isnan(np.atleast_2d(xr)).any(axis=1)
-        xr = np.nan_to_num(xr, copy=False).reshape((-1, self.drow * self.dcol))
+        bads = np.isnan(x).any(axis=(1, 2))
+        xc = np.nan_to_num(x) - self.M
 
-        log_lik = np.einsum('k,kh,nh->n', mu, self.lmbda, xr)\
-                  - 0.5 * np.einsum('nk,kh,nh->n', xr, self.lmbda, xr)
+        log_lik = - 0.5 * np.sum(np.square(self.V_chol @ xc @ self.K_chol.T), axis=(1, 2))
 
         log_lik[bads] = 0
-        return - self.log_partition() + self.log_base() + log_lik
+        return 0.5 * self.logdet() + self.log_base() + log_lik
 
     @property
     def base(self):
@@ -133,10 +147,14 @@ class MatrixNormalWithPrecision(Distribution):
     def log_base(self):
         return np.log(self.base)
 
+    def logdet(self):
+        # log det of kron(K, V)
+        return 2. * self.dcol * np.sum(np.log(np.diag(self.V_chol)))\
+               + 2. * self.drow * np.sum(np.log(np.diag(self.K_chol)))
+
     def log_partition(self):
-        mu = np.reshape(self.M, (self.drow * self.dcol), order='F')
-        return 0.5 * np.einsum('k,kh,h->', mu, self.lmbda, mu)\
-               - np.sum(np.log(np.diag(self.lmbda_chol)))
+        return 0.5 * np.sum(np.square(self.V_chol @ self.M @ self.K_chol.T))\
+               - 0.5 * self.logdet()
 
     def entropy(self):
         raise NotImplementedError
@@ -152,6 +170,9 @@ class MatrixNormalWithDiagonalPrecision(Distribution):
         self._V_chol = None
         self._K_chol = None
 
+        self._V_chol_inv = None
+        self._K_chol_inv = None
+
         self._lmbda_chol = None
         self._lmbda_chol_inv = None
 
@@ -184,6 +205,7 @@ class MatrixNormalWithDiagonalPrecision(Distribution):
     def vs(self, value):
         self._vs = value
         self._V_chol = None
+        self._V_chol_inv = None
 
         self._lmbda_chol = None
         self._lmbda_chol_inv = None
@@ -191,7 +213,7 @@ class MatrixNormalWithDiagonalPrecision(Distribution):
     @property
     def V(self):
         assert self._vs is not None
-        return np.diag(self._vss)
+        return np.diag(self._vs)
 
     @property
     def V_chol(self):
@@ -199,6 +221,12 @@ class MatrixNormalWithDiagonalPrecision(Distribution):
             self._V_chol = np.diag(np.sqrt(self._vs))
         return self._V_chol
 
+    @property
+    def V_chol_inv(self):
+        if self._V_chol_inv is None:
+            self._V_chol_inv = np.diag(1. / np.sqrt(self._vs))
+        return self._V_chol_inv
+
     @property
     def K(self):
         return self._K
@@ -207,6 +235,7 @@ class MatrixNormalWithDiagonalPrecision(Distribution):
     def K(self, value):
         self._K = value
         self._K_chol = None
+        self._K_chol_inv = None
 
         self._lmbda_chol = None
         self._lmbda_chol_inv = None
@@ -216,6 +245,13 @@ class MatrixNormalWithDiagonalPrecision(Distribution):
         # upper cholesky triangle
         if self._K_chol is None:
             self._K_chol = sc.linalg.cholesky(self.K, lower=False)
+        return self._K_chol
+
+    @property
+    def K_chol_inv(self):
+        if self._K_chol_inv is None:
+            self._K_chol_inv = sc.linalg.solve_triangular(self.K_chol, np.eye(self.dcol))
+        return self._K_chol_inv
 
     @property
     def lmbda(self):
@@ -235,13 +271,13 @@ class MatrixNormalWithDiagonalPrecision(Distribution):
         return self._lmbda_chol_inv
 
     def rvs(self, size=1):
+        # M + V_chol^-1 Z K_chol^-T has precision kron(K, V)
+        # on vec(A), without forming the kronecker product
         if size == 1:
-            aux = npr.normal(size=self.drow * self.dcol).dot(self.lmbda_chol_inv.T)
-            return self.M + np.reshape(aux, (self.drow, self.dcol), order='F')
+            aux = npr.normal(size=(self.drow, self.dcol))
         else:
-            size = tuple([size, self.drow * self.dcol])
-            aux = npr.normal(size=size).dot(self.lmbda_chol_inv.T)
-            return self.M + np.reshape(aux, (size, self.drow, self.dcol), order='F')
+            aux = npr.normal(size=(size, self.drow, self.dcol))
+        return self.M + self.V_chol_inv @ aux @ self.K_chol_inv.T
 
     def mean(self):
         return self.M
@@ -250,19 +286,16 @@ class MatrixNormalWithDiagonalPrecision(Distribution):
         return self.M
 
     def log_likelihood(self, x):
-        # apply vector operator with Fortran convention
-        xr = np.reshape(x, (-1, self.drow * self.dcol), order='F')
-        mu = np.reshape(self.M, (self.drow * self.dcol), order='F')
+        # trace form tr(K (x - M)^T V (x - M)) = |V_chol (x - M) K_chol^T|^2
+        x = np.reshape(x, (-1, self.drow, self.dcol))
 
-        # Gaussian likelihood on vector dist.
-        bads = np.isnan(np.atleast_2d(xr)).any(axis=1)
-        xr = np.nan_to_num(xr, copy=False).reshape((-1, self.drow * self.dcol))
+        bads = np.isnan(x).any(axis=(1, 2))
+        xc = np.nan_to_num(x) - self.M
 
-        log_lik = np.einsum('k,kh,nh->n', mu, self.omega, xr)\
-                  - 0.5 * np.einsum('nk,kh,nh->n', xr, self.omega, xr)
+        log_lik = - 0.5 * np.sum(np.square(self.V_chol @ xc @ self.K_chol.T), axis=(1, 2))
 
         log_lik[bads] = 0
-        return - self.log_partition() + self.log_base() + log_lik
+        return 0.5 * self.logdet() + self.log_base() + log_lik
 
     @property
     def base(self):
@@ -271,10 +304,14 @@ class MatrixNormalWithDiagonalPrecision(Distribution):
     def log_base(self):
         return np.log(self.base)
 
+    def logdet(self):
+        # log det of kron(K, V)
+        return self.dcol * np.sum(np.log(self.vs))\
+               + 2. * self.drow * np.sum(np.log(np.diag(self.K_chol)))
+
     def log_partition(self):
-        mu = np.reshape(self.M, (self.drow * self.dcol), order='F')
-        return 0.5 * np.einsum('k,kh,h->', mu, self.omega, mu)\
-               - np.sum(np.log(np.diag(self.omega_chol)))
+        return 0.5 * np.sum(np.square(self.V_chol @ self.M @ self.K_chol.T))\
+               - 0.5 * self.logdet()
 
     def entropy(self):
         raise NotImplementedError
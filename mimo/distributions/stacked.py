@@ -0,0 +1,367 @@
+import numpy as np
+import numpy.random as npr
+
+from scipy.special import digamma, gammaln
+
+from mimo.abstraction import Statistics as Stats
+
+from mimo.util.matrix import quadratic_features, quadratic_weights
+from mimo.util.matrix import triu_to_symmetric
+from mimo.util.matrix import invpds
+
+
+def _wishart_factors(psi_chols, nus):
+    # Bartlett decomposition for K Wisharts at once, returns
+    # lower factors T such that lmbda = T T^T, see Wishart.rvs
+    K, dim = psi_chols.shape[:2]
+
+    A = np.zeros((K, dim, dim))
+    A[:, np.tril_indices(dim, k=-1)[0], np.tril_indices(dim, k=-1)[1]] =\
+        npr.normal(size=(K, dim * (dim - 1) // 2))
+    A[:, np.arange(dim), np.arange(dim)] =\
+        np.sqrt(npr.chisquare(nus[:, None] - np.arange(dim)))
+
+    return psi_chols @ A
+
+
+class StackedNormalWisharts:
+    """
+    Component bank of Normal-Wishart distributions.
+    Stacks the parameters of K distributions into (K, ...)
+    arrays to evaluate all components with batched contractions.
+    Parameters are stacked as:
+        mus, kappas, psis, nus
+    """
+
+    def __init__(self, dists):
+        self.dists = dists
+        self.refresh()
+
+    @property
+    def size(self):
+        return len(self.dists)
+
+    def stacks(self, dists):
+        # whether the bank holds exactly these distributions
+        return len(dists) == self.size\
+               and all(d is _d for d, _d in zip(dists, self.dists))
+
+    @property
+    def stale(self):
+        # parameters were updated since the last refresh
+        return any(d.version != v for d, v in zip(self.dists, self.versions))
+
+    @property
+    def dim(self):
+        return self.mus.shape[-1]
+
+    @property
+    def params(self):
+        return self.mus, self.kappas, self.psis, self.nus
+
+    def _materialize(self):
+        # pending natural parameters of all components are converted
+        # at once instead of one by one, see NormalWishart.nat_to_std
+        pending = [d for d in self.dists if d.pending]
+        if len(pending) > 0:
+            natparams = [d.nat_param for d in pending]
+            x, kappas, xxT, nus = (np.stack(_n, axis=0) for _n in zip(*natparams))
+            mus = x / kappas[:, None]
+            psis = invpds(xxT - np.einsum('k,kd,kh->kdh', kappas, mus, mus))
+            for d, params in zip(pending, zip(mus, kappas, psis, nus + xxT.shape[-1])):
+                d._materialize(params)
+
+    def refresh(self):
+        self._materialize()
+        self.mus = np.stack([d.gaussian.mu for d in self.dists], axis=0)
+        self.kappas = np.hstack([d.kappa for d in self.dists])
+        self.psis = np.stack([d.wishart.psi for d in self.dists], axis=0)
+        self.nus = np.hstack([d.wishart.nu for d in self.dists])
+        self.psi_chols = np.linalg.cholesky(self.psis)
+        self._predictive = None
+
+        # versions of the stacked parameters, see stale
+        self.versions = [d.version for d in self.dists]
+        return self
+
+    def rvs(self):
+        # one draw per component, returns stacked mus and lmbdas
+        T = _wishart_factors(self.psi_chols, self.nus)
+        lmbdas = T @ np.swapaxes(T, 1, 2)
+
+        # mu ~ N(mu, (kappa * lmbda)^-1), with kappa * lmbda = (sqrt(kappa) T) (sqrt(kappa) T)^T
+        aux = npr.normal(size=(self.size, self.dim, 1))
+        aux = np.linalg.solve(np.sqrt(self.kappas)[:, None, None] * np.swapaxes(T, 1, 2), aux)
+        return self.mus + aux[..., 0], lmbdas
+
+    def expected_logdet(self):
+        aux = digamma((self.nus[:, None] - np.arange(self.dim)) / 2.)
+        return np.sum(aux, axis=1) + self.dim * np.log(2.)\
+               + 2. * np.sum(np.log(np.diagonal(self.psi_chols, axis1=1, axis2=2)), axis=1)
+
+    def expected_log_likelihood(self, x, out=None):
+        # returns a (N, K) array, see NormalWishart.expected_log_likelihood,
+        # quadratic and linear terms are contracted in a single product
+        psi_mus = np.einsum('kdh,kh->kd', self.psis, self.mus)
+
+        weights = np.hstack((quadratic_weights(self.psis), - 2. * psi_mus))
+        out = np.matmul(np.hstack((quadratic_features(x), x)), weights.T, out=out)
+        out += np.einsum('kd,kd->k', self.mus, psi_mus)
+
+        out *= - 0.5 * self.nus
+        out += 0.5 * self.expected_logdet() - 0.5 * self.dim / self.kappas\
+               - 0.5 * self.dim * np.log(2. * np.pi)
+        return out
+
+    def posterior_predictive_params(self):
+        # factors of the student-t posterior predictives of all components,
+        # built once per refresh, see GaussianWithNormalWishart.posterior_predictive_studentt
+        if self._predictive is None:
+            dfs = self.nus - self.dim + 1
+            scales = dfs / (1. + 1. / self.kappas)
+            lmbdas = np.einsum('kdh,k->kdh', self.psis, scales)
+            logdets = 2. * np.sum(np.log(np.diagonal(self.psi_chols, axis1=1, axis2=2)), axis=1)\
+                      + self.dim * np.log(scales)
+
+            # (x - mu)^T lmbda (x - mu), as one product over [quadratic_features(x), x]
+            lmbda_mus = np.einsum('kdh,kh->kd', lmbdas, self.mus)
+            qweights = np.hstack((quadratic_weights(lmbdas), - 2. * lmbda_mus))
+            q0 = np.einsum('kd,kd->k', self.mus, lmbda_mus)
+
+            self._predictive = dfs, logdets, qweights, q0
+        return self._predictive
+
+    def log_posterior_predictive(self, x, dist='gaussian'):
+        # returns a (N, K) array, see GaussianWithNormalWishart.
+        # log_posterior_predictive_gaussian and log_posterior_predictive_studentt
+        dfs, logdets, qweights, q0 = self.posterior_predictive_params()
+
+        delta = np.hstack((quadratic_features(x), x)) @ qweights.T + q0
+
+        d = self.dim
+        if dist == 'gaussian':
+            return - 0.5 * d * np.log(2. * np.pi) + 0.5 * logdets - 0.5 * delta
+        else:
+            return gammaln((dfs + d) / 2.) - gammaln(dfs / 2.)\
+                   + 0.5 * logdets - (d / 2.) * np.log(dfs * np.pi)\
+                   - 0.5 * (dfs + d) * np.log1p(delta / dfs)
+
+    def _weighted_statistics(self, data, weights):
+        # the mixtures only pass rows without nans, stored data
+        # is compacted on add_data and caller data on entry
+        if isinstance(data, np.ndarray):
+            # weights may be dense or sparse (csr) responsibilities
+            x = weights.T @ data
+            n = np.asarray(weights.sum(axis=0)).ravel()
+            xxT = weights.T @ quadratic_features(data)
+            return x, n, xxT
+        else:
+            stats = list(map(self._weighted_statistics, data, weights))
+            return tuple(map(sum, zip(*stats)))
+
+    def weighted_statistics(self, data, weights):
+        # statistics of all components in one pass over the data,
+        # see GaussianWithPrecision.weighted_statistics
+        x, n, xxT = self._weighted_statistics(data, weights)
+        xxT = triu_to_symmetric(xxT, x.shape[-1])
+        return [Stats([x[k], n[k], xxT[k], n[k]]) for k in range(self.size)]
+
+
+class StackedMatrixNormalWisharts:
+    """
+    Component bank of Matrix-Normal-Wishart distributions.
+    Stacks the parameters of K distributions into (K, ...)
+    arrays to evaluate all components with batched contractions.
+    Parameters are stacked as:
+        Ms, Ks, psis, nus
+    """
+
+    def __init__(self, dists, affine=True):
+        self.dists = dists
+        self.affine = affine
+        self.refresh()
+
+    @property
+    def size(self):
+        return len(self.dists)
+
+    def stacks(self, dists):
+        return len(dists) == self.size\
+               and all(d is _d for d, _d in zip(dists, self.dists))
+
+    @property
+    def stale(self):
+        return any(d.version != v for d, v in zip(self.dists, self.versions))
+
+    @property
+    def drow(self):
+        return self.Ms.shape[1]
+
+    @property
+    def dcol(self):
+        return self.Ms.shape[2]
+
+    @property
+    def params(self):
+        return self.Ms, self.Ks, self.psis, self.nus
+
+    def _materialize(self):
+        # see StackedNormalWisharts._materialize and MatrixNormalWishart.nat_to_std
+        pending = [d for d in self.dists if d.pending]
+        if len(pending) > 0:
+            natparams = [d.nat_param for d in pending]
+            MK, Ks, psis, nus = (np.stack(_n, axis=0) for _n in zip(*natparams))
+            Ms = np.swapaxes(np.linalg.solve(Ks, np.swapaxes(MK, 1, 2)), 1, 2)
+            psis = invpds(psis - Ms @ Ks @ np.swapaxes(Ms, 1, 2))
+            for d, params in zip(pending, zip(Ms, Ks, psis, nus + MK.shape[1])):
+                d._materialize(params)
+
+    def refresh(self):
+        self._materialize()
+        self.Ms = np.stack([d.matnorm.M for d in self.dists], axis=0)
+        self.Ks = np.stack([d.matnorm.K for d in self.dists], axis=0)
+        self.psis = np.stack([d.wishart.psi for d in self.dists], axis=0)
+        self.nus = np.hstack([d.wishart.nu for d in self.dists])
+        self.psi_chols = np.linalg.cholesky(self.psis)
+        self.K_chols = np.linalg.cholesky(self.Ks)
+        self._predictive = None
+        self.versions = [d.version for d in self.dists]
+        return self
+
+    def rvs(self):
+        # one draw per component, returns stacked As and lmbdas
+        T = _wishart_factors(self.psi_chols, self.nus)
+        lmbdas = T @ np.swapaxes(T, 1, 2)
+
+        # A = M + T^-T Z K_chol^-1, see MatrixNormalWithPrecision.rvs
+        aux = npr.normal(size=(self.size, self.drow, self.dcol))
+        aux = np.linalg.solve(np.swapaxes(T, 1, 2), aux)
+        aux = np.linalg.solve(np.swapaxes(self.K_chols, 1, 2), np.swapaxes(aux, 1, 2))
+        return self.Ms + np.swapaxes(aux, 1, 2), lmbdas
+
+    def expected_logdet(self):
+        aux = digamma((self.nus[:, None] - np.arange(self.drow)) / 2.)
+        return np.sum(aux, axis=1) + self.drow * np.log(2.)\
+               + 2. * np.sum(np.log(np.diagonal(self.psi_chols, axis1=1, axis2=2)), axis=1)
+
+    def expected_parammat(self):
+        # stacked quadratic form over [x, y] such that the expected
+        # log-likelihood is - 0.5 * [x, y]^T parammat [x, y] + const
+        E_lmbda = np.einsum('k,kdh->kdh', self.nus, self.psis)
+        E_Lmbda_A = E_lmbda @ self.Ms
+        E_AT_Lmbda_A = self.drow * np.linalg.inv(self.Ks)\
+                       + np.einsum('kdh,kdl->khl', self.Ms, E_Lmbda_A)
+
+        return np.concatenate((np.concatenate((E_AT_Lmbda_A, - np.swapaxes(E_Lmbda_A, 1, 2)), axis=2),
+                               np.concatenate((- E_Lmbda_A, E_lmbda), axis=2)), axis=1)
+
+    def expected_log_likelihood(self, y, x, out=None):
+        # returns a (N, K) array, see MatrixNormalWishart.expected_log_likelihood
+        if self.affine:
+            x = np.hstack((x, np.ones((x.shape[0], 1))))
+
+        xy = np.hstack((x, y))
+        out = np.matmul(quadratic_features(xy), quadratic_weights(self.expected_parammat()).T, out=out)
+
+        out *= - 0.5
+        out += - self.drow / 2. * np.log(2 * np.pi) + 0.5 * self.expected_logdet()
+        return out
+
+    def posterior_predictive_params(self):
+        # factors of the matrix-t posterior predictives of all components,
+        # built once per refresh, see MatrixNormalWishart.posterior_predictive_params
+        if self._predictive is None:
+            Ms, bs = self.Ms, np.zeros((self.size, self.drow))
+            K_invs = np.linalg.inv(self.Ks)
+            kxx, kx, k0 = K_invs, np.zeros((self.size, self.dcol)), np.zeros((self.size, ))
+            if self.affine:
+                Ms, bs = self.Ms[..., :-1], self.Ms[..., -1]
+                kxx, kx, k0 = K_invs[:, :-1, :-1], K_invs[:, :-1, -1], K_invs[:, -1, -1]
+
+            dfs = self.nus - self.drow + 1
+            lmbdas = np.einsum('kdh,k->kdh', self.psis, dfs)
+            sigmas = np.einsum('kdh,k->kdh', np.linalg.inv(self.psis), 1. / dfs)
+            logdets = 2. * np.sum(np.log(np.diagonal(self.psi_chols, axis1=1, axis2=2)), axis=1)\
+                      + self.drow * np.log(dfs)
+
+            # c = 1 + x^T K^-1 x, as one product over [quadratic_features(x), x]
+            cweights = np.hstack((quadratic_weights(kxx), 2. * kx))
+
+            # (y - A x - b)^T lmbda (y - A x - b), as one product
+            # over [quadratic_features(xy), xy] with r = [-A, I] xy - b
+            R = np.concatenate((- Ms, np.broadcast_to(np.eye(self.drow),
+                                                      (self.size, self.drow, self.drow))), axis=2)
+            lmbda_bs = np.einsum('kdh,kh->kd', lmbdas, bs)
+            qweights = np.hstack((quadratic_weights(np.swapaxes(R, 1, 2) @ lmbdas @ R),
+                                  - 2. * np.einsum('kd,kdh->kh', lmbda_bs, R)))
+            q0 = np.einsum('kd,kd->k', bs, lmbda_bs)
+
+            self._predictive = Ms, bs, cweights, k0, dfs, sigmas, logdets, qweights, q0
+        return self._predictive
+
+    def _posterior_predictive_params(self, labels=None):
+        # predictive factors restricted to the components in labels
+        params = self.posterior_predictive_params()
+        return params if labels is None else tuple(_p[labels] for _p in params)
+
+    @staticmethod
+    def _predictive_scales(x, cweights, k0):
+        return 1. + np.hstack((quadratic_features(x), x)) @ cweights.T + k0
+
+    def posterior_predictive_moments(self, x, dist='gaussian',
+                                     aleatoric_only=False, labels=None):
+        # returns (N, drow, K) means and (N, drow, drow, K) covariances,
+        # see LinearGaussianWithMatrixNormalWishart.posterior_predictive_moments
+        Ms, bs, cweights, k0, dfs, sigmas = self._posterior_predictive_params(labels)[:6]
+
+        mus = np.einsum('kdh,nh->ndk', Ms, x) + bs.T
+        c = np.ones((len(x), len(k0))) if aleatoric_only\
+            else self._predictive_scales(x, cweights, k0)
+
+        if dist == 'studentt':
+            c = c * dfs / (dfs - 2)
+
+        return mus, np.einsum('kdh,nk->ndhk', sigmas, c)
+
+    def log_posterior_predictive(self, y, x, dist='gaussian', labels=None):
+        # returns a (N, K) array, see LinearGaussianWithMatrixNormalWishart.
+        # log_posterior_predictive_gaussian and log_posterior_predictive_studentt
+        _, _, cweights, k0, dfs, _, logdets, qweights, q0 = self._posterior_predictive_params(labels)
+
+        c = self._predictive_scales(x, cweights, k0)
+        xy = np.hstack((x, np.nan_to_num(y)))
+        delta = (np.hstack((quadratic_features(xy), xy)) @ qweights.T + q0) / c
+
+        d = self.drow
+        if dist == 'gaussian':
+            return - 0.5 * d * np.log(2. * np.pi)\
+                   + 0.5 * (logdets - d * np.log(c)) - 0.5 * delta
+        else:
+            return gammaln((dfs + d) / 2.) - gammaln(dfs / 2.)\
+                   + 0.5 * (logdets - d * np.log(c)) - (d / 2.) * np.log(dfs * np.pi)\
+                   - 0.5 * (dfs + d) * np.log1p(delta / dfs)
+
+    def _weighted_statistics(self, y, x, weights):
+        # nan rows are dropped before, see dropnans in the mixtures
+        if isinstance(y, np.ndarray) and isinstance(x, np.ndarray):
+            if self.affine:
+                x = np.hstack((x, np.ones((x.shape[0], 1))))
+
+            n = np.asarray(weights.sum(axis=0)).ravel()
+            xyxyT = weights.T @ quadratic_features(np.hstack((x, y)))
+            return n, xyxyT
+        else:
+            stats = list(map(self._weighted_statistics, y, x, weights))
+            return tuple(map(sum, zip(*stats)))
+
+    def weighted_statistics(self, y, x, weights):
+        # statistics of all components in one pass over the data,
+        # see LinearGaussianWithPrecision.weighted_statistics
+        n, xyxyT = self._weighted_statistics(y, x, weights)
+        xyxyT = triu_to_symmetric(xyxyT, self.dcol + self.drow)
+
+        dcol = self.dcol
+        yxT = xyxyT[:, dcol:, :dcol]
+        xxT = xyxyT[:, :dcol, :dcol]
+        yyT = xyxyT[:, dcol:, dcol:]
+        return [Stats([yxT[k], xxT[k], yyT[k], n[k]]) for k in range(self.size)]
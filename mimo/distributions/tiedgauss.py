@@ -1,4 +1,3 @@
-from operator import add
 from functools import reduce, partial
 
 import numpy as np
@@ -56,35 +55,38 @@ class TiedGaussiansWithPrecision:
         for c in self.components:
             c.lmbda = value
 
-    def statistics(self, data, labels, vectorize=False):
+    def statistics(self, data, labels, vectorize=False, clean=False):
         if isinstance(data, np.ndarray):
-            idx = ~np.isnan(data).any(axis=1)
-            data = data[idx]
-            labels = labels[idx]
+            if not clean:
+                idx = ~np.isnan(data).any(axis=1)
+                data = data[idx]
+                labels = labels[idx]
 
-            stats = [c.statistics(data[labels == idx, :], vectorize)
+            # the components get the already scanned rows
+            stats = [c.statistics(data[labels == idx, :], vectorize, clean=True)
                      for idx, c in enumerate(self.components)]
 
             return Stats(stats)
         else:
-            func = partial(self.statistics, vectorize=vectorize)
+            func = partial(self.statistics, vectorize=vectorize, clean=clean)
             stats = list(map(func, data, labels))
-            return list(stats) if vectorize else reduce(add, stats)
+            return list(stats) if vectorize else reduce(Stats.accumulate, stats)
 
-    def weighted_statistics(self, data, weights, vectorize=False):
+    def weighted_statistics(self, data, weights, vectorize=False, clean=False):
         if isinstance(data, np.ndarray):
-            idx = ~np.isnan(data).any(axis=1)
-            data = data[idx]
-            weights = weights[idx]
+            if not clean:
+                idx = ~np.isnan(data).any(axis=1)
+                data = data[idx]
+                weights = weights[idx]
 
-            stats = [c.weighted_statistics(data, weights[:, idx], vectorize)
+            stats = [c.weighted_statistics(data, weights[:, idx], vectorize, clean=True)
                      for idx, c in enumerate(self.components)]
 
             return Stats(stats)
         else:
-            func = partial(self.weighted_statistics, vectorize=vectorize)
+            func = partial(self.weighted_statistics, vectorize=vectorize, clean=clean)
             stats = map(func, data, weights)
-            return list(stats) if vectorize else reduce(add, stats)
+            return list(stats) if vectorize else reduce(Stats.accumulate, stats)
 
     # Max likelihood
     def max_likelihood(self, data, weights):
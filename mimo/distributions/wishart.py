@@ -16,6 +16,7 @@ class Wishart(Distribution):
 
         self._psi = psi
         self._psi_chol = None
+        self._psi_inv = None
 
     @property
     def params(self):
@@ -37,6 +38,7 @@ class Wishart(Distribution):
     def psi(self, value):
         self._psi = value
         self._psi_chol = None
+        self._psi_inv = None
 
     @property
     def psi_chol(self):
@@ -45,6 +47,12 @@ class Wishart(Distribution):
 
         return self._psi_chol
 
+    @property
+    def psi_inv(self):
+        if self._psi_inv is None:
+            self._psi_inv = sc.linalg.cho_solve((self.psi_chol, True), np.eye(self.dim))
+        return self._psi_inv
+
     # copied from scipy
     def rvs(self, size=1):
         # Random normal variates for off-diagonal elements
@@ -52,8 +60,7 @@ class Wishart(Distribution):
         covariances = npr.normal(size=n_tril).reshape((n_tril,))
 
         # Random chi-square variates for diagonal elements
-        variances = (np.r_[[npr.chisquare(self.nu - (i + 1) + 1, size=1)**0.5
-                            for i in range(self.dim)]].reshape((self.dim,)).T)
+        variances = npr.chisquare(self.nu - np.arange(self.dim))**0.5
 
         A = np.zeros((self.dim, self.dim))
 
@@ -200,8 +207,7 @@ class InverseWishart(Distribution):
         covariances = npr.normal(size=n_tril).reshape((n_tril,))
 
         # Random chi-square variates for diagonal elements
-        variances = (np.r_[[npr.chisquare(self.nu - (i + 1) + 1, size=1)**0.5
-                            for i in range(self.dim)]].reshape((self.dim,)).T)
+        variances = npr.chisquare(self.nu - np.arange(self.dim))**0.5
 
         A = np.zeros((self.dim, self.dim))
 
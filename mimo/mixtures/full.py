@@ -1,15 +1,25 @@
 import numpy as np
+import scipy as sc
+import scipy.sparse
 from scipy import special as special
-from scipy.special import logsumexp
 
 from mimo.abstraction import Distribution
 
 from mimo.distributions.bayesian import CategoricalWithDirichlet
 from mimo.distributions.bayesian import CategoricalWithStickBreaking
+from mimo.distributions.bayesian import GaussianWithNormalWishart
+
+from mimo.distributions import NormalWishart
+from mimo.distributions import StackedNormalWisharts
 
 from mimo.util.decorate import pass_obs_arg, pass_obs_and_labels_arg
-from mimo.util.stats import sample_discrete_from_log
-from mimo.util.data import batches
+from mimo.util.stats import sample_labels_from_log
+from mimo.util.stats import normalize_log_scores
+from mimo.util.data import minibatches
+from mimo.util.data import nanmask
+from mimo.util.data import dropnans
+from mimo.util.data import groupby
+from mimo.util.data import BufferMixin
 
 from sklearn.decomposition import PCA
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
@@ -60,8 +70,8 @@ class MixtureOfGaussians(Distribution):
         if isinstance(obs, list):
             return sum(self.log_likelihood(_obs) for _obs in obs)
         else:
-            scores = self.log_scores(obs)
-            return np.sum(logsumexp(scores[~np.isnan(obs).any(axis=1)], axis=1))
+            lognorms = normalize_log_scores(self.log_scores(obs))[1]
+            return np.sum(lognorms[~np.isnan(obs).any(axis=1)])
 
     def mean(self):
         raise NotImplementedError
@@ -86,14 +96,11 @@ class MixtureOfGaussians(Distribution):
         component_scores = np.nan_to_num(component_scores, copy=False)
 
         gating_scores = self.gating.log_likelihood(np.arange(K))
-        score = gating_scores + component_scores
-        return score
+        component_scores += gating_scores
+        return component_scores
 
     def scores(self, obs):
-        logr = self.log_scores(obs)
-        score = np.exp(logr - np.max(logr, axis=1, keepdims=True))
-        score /= np.sum(score, axis=1, keepdims=True)
-        return score
+        return normalize_log_scores(self.log_scores(obs))[0]
 
     def max_likelihood(self, obs, maxiter=1, progprint=True):
 
@@ -166,7 +173,7 @@ class MixtureOfGaussians(Distribution):
         return artists
 
 
-class BayesianMixtureOfGaussians(Distribution):
+class BayesianMixtureOfGaussians(BufferMixin, Distribution):
     """
     This class is for a Bayesian mixtures of Gaussians.
     """
@@ -177,12 +184,19 @@ class BayesianMixtureOfGaussians(Distribution):
         self.gating = gating
         self.components = components
 
+        # obs only holds the rows without nans,
+        # labels index these compacted rows, see add_data
         self.obs = []
         self.labels = []
 
         self.whitend = False
         self.transform = None
 
+        self._bank = None
+
+        # score buffers of the datasets, reused across sweeps
+        self._buffers = {}
+
     @property
     def nb_params(self):
         return self.gating.likelihood.nb_params\
@@ -192,10 +206,38 @@ class BayesianMixtureOfGaussians(Distribution):
     def size(self):
         return len(self.components)
 
+
     @property
     def dim(self):
         return self.components[0].likelihood.dim
 
+    @property
+    def stackable(self):
+        # the bank bypasses the components' own resample and update
+        # methods, see BayesianMixtureOfLinearGaussians.stackable
+        return all(type(c) is GaussianWithNormalWishart for c in self.components)\
+               and all(isinstance(c.posterior, NormalWishart) for c in self.components)
+
+    @property
+    def bank(self):
+        # stacked posteriors of all components, used for batched
+        # draws, see BayesianMixtureOfLinearGaussians.bank
+        if not self.stackable:
+            self._bank = None
+            return self._bank
+
+        posteriors = [c.posterior for c in self.components]
+        if self._bank is None or not self._bank.stacks(posteriors):
+            self._bank = StackedNormalWisharts(posteriors)
+        elif self._bank.stale:
+            self._bank.refresh()
+        return self._bank
+
+    def _bank_rvs(self):
+        # one batched draw for all components from their updated posteriors
+        for c, params in zip(self.components, zip(*self.bank.rvs())):
+            c.likelihood.params = params
+
     @property
     def used_labels(self):
         assert self.has_data()
@@ -210,6 +252,10 @@ class BayesianMixtureOfGaussians(Distribution):
 
         obs = obs if isinstance(obs, list) else [obs]
 
+        # scan for missing values once and keep compacted copies
+        masks = [nanmask(_obs) for _obs in obs]
+        obs = [_obs[_mask] for _obs, _mask in zip(obs, masks)]
+
         if whiten:
             self.whitend = True
 
@@ -228,7 +274,7 @@ class BayesianMixtureOfGaussians(Distribution):
             for _obs in obs:
                 self.obs.append(self.transform.transform(_obs))
         else:
-            self.obs = obs
+            self.obs.extend(obs)
 
         if labels_from_prior:
             for _obs in self.obs:
@@ -239,6 +285,7 @@ class BayesianMixtureOfGaussians(Distribution):
     def clear_data(self):
         self.obs.clear()
         self.labels.clear()
+        self._buffers.clear()
 
     def clear_transform(self):
         self.whitend = False
@@ -265,8 +312,8 @@ class BayesianMixtureOfGaussians(Distribution):
         if isinstance(obs, list):
             return sum(self.log_likelihood(_obs) for _obs in obs)
         else:
-            scores = self.log_scores(obs)
-            return np.sum(logsumexp(scores[~np.isnan(obs).any(axis=1)], axis=1))
+            lognorms = normalize_log_scores(self.log_scores(obs))[1]
+            return np.sum(lognorms[~np.isnan(obs).any(axis=1)])
 
     def mean(self):
         raise NotImplementedError
@@ -280,24 +327,24 @@ class BayesianMixtureOfGaussians(Distribution):
     def entropy(self):
         raise NotImplementedError
 
-    def log_scores(self, obs):
+    def log_scores(self, obs, clean=False):
         N, K = obs.shape[0], self.size
 
         # update, see Eq. 10.67 in Bishop
         component_scores = np.empty((N, K))
         for idx, c in enumerate(self.components):
-            component_scores[:, idx] = c.likelihood.log_likelihood(obs)
-        component_scores = np.nan_to_num(component_scores, copy=False)
+            component_scores[:, idx] = c.likelihood.log_likelihood(obs, clean=clean)
+
+        # clean data has no missing values to be zeroed
+        if not clean:
+            component_scores = np.nan_to_num(component_scores, copy=False)
 
         gating_scores = self.gating.likelihood.log_likelihood(np.arange(K))
-        score = gating_scores + component_scores
-        return score
+        component_scores += gating_scores
+        return component_scores
 
-    def scores(self, obs):
-        logr = self.log_scores(obs)
-        score = np.exp(logr - np.max(logr, axis=1, keepdims=True))
-        score /= np.sum(score, axis=1, keepdims=True)
-        return score
+    def scores(self, obs, clean=False):
+        return normalize_log_scores(self.log_scores(obs, clean))[0]
 
     # Expectation-Maximization
     @pass_obs_arg
@@ -317,12 +364,13 @@ class BayesianMixtureOfGaussians(Distribution):
                 # Expectation step
                 scores = []
                 for _obs in obs:
-                    scores.append(self.scores(_obs))
+                    scores.append(self.scores(_obs, clean=True))
 
                 # Maximization step
                 for idx, c in enumerate(self.components):
-                    c.max_aposteriori([_obs for _obs in obs],
-                                      [_score[:, idx] for _score in scores])
+                    weights = [_score[:, idx] for _score in scores]
+                    c.max_aposteriori(obs, weights,
+                                      stats=c.likelihood.weighted_statistics(obs, weights, clean=True))
 
                 # mixture weights
                 self.gating.max_aposteriori(None, scores)
@@ -332,7 +380,7 @@ class BayesianMixtureOfGaussians(Distribution):
     # Gibbs sampling
     @pass_obs_and_labels_arg
     def resample(self, obs=None, labels=None,
-                 maxiter=1, progprint=True):
+                 maxiter=1, progprint=True, rng=None):
 
         current = mp.current_process()
         if len(current._identity) > 0:
@@ -345,7 +393,7 @@ class BayesianMixtureOfGaussians(Distribution):
             for _ in range(maxiter):
                 self._resample_components(obs, labels)
                 self._resample_gating(labels)
-                labels = self._resample_labels(obs)
+                labels = self._resample_labels(obs, rng)
 
                 if self.has_data():
                     self.labels = labels
@@ -353,29 +401,42 @@ class BayesianMixtureOfGaussians(Distribution):
                 pbar.update(1)
 
     def _resample_components(self, obs, labels):
+        if self.bank is not None:
+            # statistics of all components from one-hot weights
+            weights = [sc.sparse.csr_matrix((np.ones(len(_label)), (np.arange(len(_label)), _label)),
+                                            shape=(len(_label), self.size)) for _label in labels]
+            for c, stats in zip(self.components, self.bank.weighted_statistics(obs, weights)):
+                c.posterior.nat_param = stats.accumulate(c.prior.nat_param)
+            self._bank_rvs()
+            return
+
+        # per dataset, group the data by label once
+        obs = [groupby(_label, self.size, _obs)[0]
+               for _obs, _label in zip(obs, labels)]
         for idx, c in enumerate(self.components):
-            c.resample(data=[_obs[_label == idx]
-                             for _obs, _label in zip(obs, labels)])
+            c.resample(data=[_obs[idx] for _obs in obs])
 
     def _resample_gating(self, labels):
         self.gating.resample([_label for _label in labels])
 
-    def _resample_labels(self, obs):
+    def _resample_labels(self, obs, rng=None):
         labels = []
         for _obs in obs:
-            score = self.log_scores(_obs)
-            labels.append(sample_discrete_from_log(score, axis=1))
+            score = self.log_scores(_obs, clean=True)
+            labels.append(sample_labels_from_log(score, rng))
         return labels
 
     # Mean Field
-    def expected_scores(self, obs):
+    def expected_scores(self, obs, out=None, clean=False):
         N, K = obs.shape[0], self.size
 
         # update, see Eq. 10.67 in Bishop
-        component_scores = np.empty((N, K))
+        component_scores = np.empty((N, K)) if out is None else out
         for idx, c in enumerate(self.components):
             component_scores[:, idx] = c.posterior.expected_log_likelihood(obs)
-        component_scores = np.nan_to_num(component_scores, copy=False)
+
+        if not clean:
+            component_scores = np.nan_to_num(component_scores, copy=False)
 
         if isinstance(self.gating, CategoricalWithDirichlet):
             gating_scores = self.gating.posterior.expected_statistics()
@@ -385,12 +446,8 @@ class BayesianMixtureOfGaussians(Distribution):
         else:
             raise NotImplementedError
 
-        logr = gating_scores + component_scores
-
-        r = np.exp(logr - np.max(logr, axis=1, keepdims=True))
-        r /= np.sum(r, axis=1, keepdims=True)
-
-        return r
+        component_scores += gating_scores
+        return normalize_log_scores(component_scores)[0]
 
     def meanfield_coordinate_descent(self, tol=1e-2, maxiter=250, progprint=True):
         elbo = []
@@ -425,10 +482,13 @@ class BayesianMixtureOfGaussians(Distribution):
         self._meanfield_update_parameters(obs, scores)
         return scores, z
 
-    def _meanfield_update_labels(self, obs):
+    def _meanfield_update_labels(self, obs, key='data'):
+        # score buffers are kept per key and dataset, minibatches
+        # use their own key so they do not evict the full-data ones
         scores, labels = [], []
-        for _obs in obs:
-            scores.append(self.expected_scores(_obs))
+        for n, _obs in enumerate(obs):
+            buf = self._buffer((key, n), (len(_obs), self.size))
+            scores.append(self.expected_scores(_obs, out=buf, clean=True))
             labels.append(np.argmax(scores[-1], axis=1))
         return scores, labels
 
@@ -440,13 +500,22 @@ class BayesianMixtureOfGaussians(Distribution):
         self.gating.meanfield_update(None, scores)
 
     def _meanfield_update_components(self, obs, scores):
+        if self.bank is not None:
+            for c, stats in zip(self.components, self.bank.weighted_statistics(obs, scores)):
+                c.posterior.nat_param = stats.accumulate(c.prior.nat_param)
+            self._bank_rvs()
+            return
+
+        # obs is free of nans, the statistics skip the scans
         for idx, c in enumerate(self.components):
-            c.meanfield_update([_obs for _obs in obs],
-                               [_score[:, idx] for _score in scores])
+            weights = [_score[:, idx] for _score in scores]
+            c.meanfield_update(obs, weights,
+                               stats=c.likelihood.weighted_statistics(obs, weights, clean=True))
 
     # SVI
     def meanfield_stochastic_descent(self, stepsize=1e-3, batchsize=128,
-                                     maxiter=500, progprint=True):
+                                     maxiter=500, progprint=True,
+                                     weights=None, replace=False, rng=None):
 
         assert self.has_data()
 
@@ -456,34 +525,60 @@ class BayesianMixtureOfGaussians(Distribution):
         else:
             pos = 0
 
-        prob = batchsize / float(sum(len(_obs) for _obs in self.obs))
+        datasizes = [len(_obs) for _obs in self.obs]
 
         with tqdm(total=maxiter, desc=f'SVI #{pos + 1}',
                   position=pos, disable=not progprint) as pbar:
             for _ in range(maxiter):
-                for _obs in self.obs:
-                    for batch in batches(batchsize, len(_obs)):
-                        self.meanfield_sgdstep(_obs[batch, :], prob, stepsize)
+                for n, batch, prob in minibatches(batchsize, datasizes,
+                                                  weights, replace, rng):
+                    _, _mlabels = self._meanfield_sgdstep([self.obs[n][batch, :]], prob, stepsize)
+                    # only the rows of the minibatch are relabeled
+                    self.labels[n][batch] = _mlabels[0]
+
+                self.refresh_labels()
                 pbar.update(1)
 
     def meanfield_sgdstep(self, obs, prob, stepsize):
         obs = obs if isinstance(obs, list) else [obs]
 
-        scores, _ = self._meanfield_update_labels(obs)
+        # caller data is compacted to the rows without nans,
+        # the returned scores and labels index those rows
+        obs = [dropnans(_obs)[0] for _obs in obs]
+
+        # scores are copied out of the reused minibatch buffers
+        scores, labels = self._meanfield_sgdstep(obs, prob, stepsize)
+        return [_score.copy() for _score in scores], labels
+
+    def _meanfield_sgdstep(self, obs, prob, stepsize):
+        scores, labels = self._meanfield_update_labels(obs, key='batch')
         self._meanfield_sgdstep_parameters(obs, scores, prob, stepsize)
+        return scores, labels
 
-        if self.has_data():
-            for _obs in self.obs:
-                self.labels.append(np.argmax(self.expected_scores(_obs), axis=1))
+    def refresh_labels(self):
+        # rescore all stored data, labels are only updated
+        # lazily for the minibatches during stochastic descent
+        assert self.has_data()
+        _, self.labels = self._meanfield_update_labels(self.obs)
 
     def _meanfield_sgdstep_parameters(self, obs, scores, prob, stepsize):
         self._meanfield_sgdstep_components(obs, scores, prob, stepsize)
         self._meanfield_sgdstep_gating(scores, prob, stepsize)
 
     def _meanfield_sgdstep_components(self, obs, scores, prob, stepsize):
+        if self.bank is not None:
+            # (1 - stepsize) * posterior + stepsize * (prior + stats / prob)
+            for c, stats in zip(self.components, self.bank.weighted_statistics(obs, scores)):
+                c.posterior.nat_param = stats.scale(stepsize / prob)\
+                    .axpy(stepsize, c.prior.nat_param)\
+                    .axpy(1. - stepsize, c.posterior.nat_param)
+            self._bank_rvs()
+            return
+
         for idx, c in enumerate(self.components):
-            c.meanfield_sgdstep([_obs for _obs in obs],
-                                [_score[:, idx] for _score in scores], prob, stepsize)
+            weights = [_score[:, idx] for _score in scores]
+            c.meanfield_sgdstep(obs, weights, prob, stepsize,
+                                stats=c.likelihood.weighted_statistics(obs, weights, clean=True))
 
     def _meanfield_sgdstep_gating(self, scores, prob, stepsize):
         self.gating.meanfield_sgdstep(None, scores, prob, stepsize)
@@ -499,9 +594,7 @@ class BayesianMixtureOfGaussians(Distribution):
             E_log_stick, E_log_rest = self.gating.posterior.expected_log_likelihood()
             vlb += np.sum(scores * E_log_stick + cumscores * E_log_rest)
 
-        errs = np.seterr(invalid='ignore', divide='ignore')
-        vlb -= np.nansum(scores * np.log(scores))  # treats nans as zeros
-        np.seterr(**errs)
+        vlb += np.sum(special.entr(scores))
 
         return vlb
 
@@ -523,6 +616,24 @@ class BayesianMixtureOfGaussians(Distribution):
 
         return vlb
 
+    # Pruning
+    def prune(self, threshold=1e-3):
+        # drop components with negligible posterior mass,
+        # later sweeps scale with the kept ones
+        weights = self.gating.posterior.mean()
+        keep, = np.where(weights > threshold)
+        if len(keep) == 0:
+            keep = np.array([np.argmax(weights)])
+
+        self.gating.prune(keep)
+        self.components = [self.components[k] for k in keep]
+        self._bank = None
+
+        # data of dropped components is reassigned
+        if self.has_data():
+            self.refresh_labels()
+        return self
+
     # Misc
     def bic(self, obs=None):
         assert obs is not None
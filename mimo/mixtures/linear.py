@@ -1,4 +1,7 @@
 import numpy as np
+from itertools import chain
+import scipy as sc
+import scipy.sparse
 from scipy import special as special
 from scipy.special import logsumexp
 
@@ -6,12 +9,28 @@ from mimo.abstraction import Conditional
 
 from mimo.distributions.bayesian import CategoricalWithDirichlet
 from mimo.distributions.bayesian import CategoricalWithStickBreaking
+from mimo.distributions.bayesian import GaussianWithNormalWishart
+from mimo.distributions.bayesian import LinearGaussianWithMatrixNormalWishart
+
+from mimo.distributions import StickBreaking
+from mimo.distributions import NormalWishart
+from mimo.distributions import MatrixNormalWishart
+from mimo.distributions import StackedNormalWisharts
+from mimo.distributions import StackedMatrixNormalWisharts
 
 from mimo.util.decorate import pass_target_and_input_arg
 from mimo.util.decorate import pass_target_input_and_labels_arg
 
-from mimo.util.stats import sample_discrete_from_log
-from mimo.util.data import batches
+from mimo.util.stats import sample_labels_from_log
+from mimo.util.stats import truncate_responsibilities
+from mimo.util.stats import normalize_log_scores
+from mimo.util.data import minibatches
+from mimo.util.data import nanmask
+from mimo.util.data import dropnans
+from mimo.util.data import groupby
+from mimo.util.data import BufferMixin
+from mimo.util.data import save_arrays, load_arrays
+from mimo.util.matrix import quadratic_features, quadratic_weights
 
 from sklearn.decomposition import PCA
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
@@ -20,25 +39,129 @@ from tqdm import tqdm
 from pathos.helpers import mp
 
 import pathos
-from pathos.pools import ThreadPool as Pool
+from pathos.pools import ThreadPool, ProcessPool
 nb_cores = pathos.multiprocessing.cpu_count()
 
 eps = np.finfo(np.float64).tiny
 
 
-class BayesianMixtureOfLinearGaussians(Conditional):
+# Module-level component updates, so that
+# they can be shipped to a process pool
+def _expected_component_scores(b, m, y, x):
+    return b.posterior.expected_log_likelihood(x)\
+           + m.posterior.expected_log_likelihood(y, x, m.likelihood.affine)
+
+
+def _component_statistics(b, m, y, x, weights):
+    # the mixture only passes data without nans, which is not rescanned
+    return b.likelihood.weighted_statistics(x, weights, clean=True),\
+           m.likelihood.weighted_statistics(y, x, weights, clean=True)
+
+
+def _meanfield_update_component(b, m, y, x, weights):
+    bs, ms = _component_statistics(b, m, y, x, weights)
+    b.meanfield_update(x, weights, stats=bs)
+    m.meanfield_update(y, x, weights, stats=ms)
+    return b, m
+
+
+def _meanfield_sgdstep_component(b, m, y, x, weights, prob, stepsize):
+    bs, ms = _component_statistics(b, m, y, x, weights)
+    b.meanfield_sgdstep(x, weights, prob, stepsize, stats=bs)
+    m.meanfield_sgdstep(y, x, weights, prob, stepsize, stats=ms)
+    return b, m
+
+
+def _gating_index(mus, log_weights_max, lmbda_mins, tol,
+                  nb_groups=8, leafsize=16, nb_neighbors=4):
+    # kd-trees over the means of gaussian gating densities, such that only
+    # components whose normalized weight can exceed tol are evaluated, the
+    # remaining ones are pruned by the Mahalanobis bounds
+    #   log w_k(z) <= u_k - 0.5 * lmbda_min_k * |z - mu_k|^2
+    # with u_k = log_weights_max the log weight attained at the mean mu_k.
+    # Components are grouped by u_k, so that negligible ones are skipped as a whole
+    from scipy.spatial import cKDTree
+
+    groups = []
+    order = np.argsort(- log_weights_max)
+    for idx in np.array_split(order, min(nb_groups, len(mus))):
+        groups.append({'idx': idx, 'tree': cKDTree(mus[idx], leafsize=leafsize),
+                       'log_weight_max': np.max(log_weights_max[idx]),
+                       'lmbda_min': np.min(lmbda_mins[idx])})
+
+    return {'groups': groups, 'tol': tol, 'mus': mus,
+            'nb_neighbors': min(nb_neighbors, len(groups[0]['idx'])),
+            'lmbda_mins': lmbda_mins,
+            'log_weights_max': log_weights_max}
+
+
+def _query_gating_index(index, z, log_weights):
+    # sparse gating of queries z through the index, log_weights(n, k) returns
+    # the exact unnormalized log weights of the (query, component) pairs
+    # (z[n], k). Returns the pairs sorted by query and their normalized weights
+    N = len(z)
+
+    # reference log weight of each query from its nearest means among
+    # the heaviest components, a lower bound of the log normalizer
+    top = index['groups'][0]
+    _, near = top['tree'].query(z, k=index['nb_neighbors'])
+    near = top['idx'][np.reshape(near, (N, -1))]
+    ref = np.max(np.reshape(log_weights(np.repeat(np.arange(N), near.shape[1]),
+                                        near.ravel()), near.shape), axis=1)
+    bound = ref + np.log(index['tol'])
+
+    # candidates within the radius of the loosest bound of each group
+    qi, ci = [], []
+    for group in index['groups']:
+        radius = 2. * (group['log_weight_max'] - bound) / group['lmbda_min']
+        active = np.flatnonzero(radius > 0.)
+        if len(active) == 0:
+            continue
+
+        candidates = group['tree'].query_ball_point(z[active], np.sqrt(radius[active]))
+        counts = np.fromiter(map(len, candidates), dtype=int, count=len(active))
+        qi.append(np.repeat(active, counts))
+        ci.append(group['idx'][np.fromiter(chain.from_iterable(candidates),
+                                           dtype=int, count=np.sum(counts))])
+
+    qi, ci = np.concatenate(qi), np.concatenate(ci)
+    order = np.argsort(qi, kind='stable')
+    qi, ci = qi[order], ci[order]
+
+    # per-component bounds, then exact weights of the remaining pairs
+    dist = np.sum(np.square(z[qi] - index['mus'][ci]), axis=1)
+    keep = index['log_weights_max'][ci] - 0.5 * index['lmbda_mins'][ci] * dist >= bound[qi]
+    qi, ci = qi[keep], ci[keep]
+
+    _log_weights = log_weights(qi, ci)
+    keep = _log_weights >= bound[qi]
+    qi, ci, _log_weights = qi[keep], ci[keep], _log_weights[keep]
+
+    # every query keeps at least its reference component
+    starts = np.searchsorted(qi, np.arange(N))
+    weights = np.exp(_log_weights - np.maximum.reduceat(_log_weights, starts)[qi])
+    weights /= np.add.reduceat(weights, starts)[qi]
+    return qi, ci, weights
+
+
+class BayesianMixtureOfLinearGaussians(BufferMixin, Conditional):
     """
     This class is for mixtures of other distributions.
     """
 
-    def __init__(self, gating, basis, models):
+    def __init__(self, gating, basis, models,
+                 nb_workers=4, executor='threads',
+                 topk=None, threshold=None):
         assert len(basis) > 0 and len(models) > 0
         assert len(basis) == len(models)
+        assert executor in ('threads', 'processes')
 
         self.gating = gating
         self.basis = basis  # input density
         self.models = models  # output density
 
+        # input and target only hold the rows without nans,
+        # labels index these compacted rows, see add_data
         self.input = []
         self.target = []
         self.labels = []
@@ -47,6 +170,57 @@ class BayesianMixtureOfLinearGaussians(Conditional):
         self.input_transform = None
         self.target_transform = None
 
+        self._bank = None
+
+        # long-lived worker pool, shared by all sweeps
+        self.nb_workers = nb_workers
+        self.executor = executor
+        self._pool = None
+
+        # optional sparse responsibilities, keeping the topk and/or
+        # entries above threshold per row, see truncate_responsibilities
+        self.topk = topk
+        self.threshold = threshold
+
+        # score buffers of the datasets, reused across sweeps
+        self._buffers = {}
+
+    def __getstate__(self):
+        # live pools can neither be pickled nor copied
+        state = super().__getstate__()
+        state['_pool'] = None
+        return state
+
+    @property
+    def pool(self):
+        if self._pool is None and self.nb_workers > 1:
+            if self.executor == 'threads':
+                self._pool = ThreadPool(nodes=self.nb_workers)
+            else:
+                self._pool = ProcessPool(nodes=self.nb_workers)
+        return self._pool
+
+    def close_pool(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool.clear()
+            self._pool = None
+
+    def _component_arguments(self, y, x, scores):
+        # per-component data and weights, when there is no bank
+        scores = [_score.toarray() if sc.sparse.issparse(_score) else _score
+                  for _score in scores]
+        weights = [[_score[:, idx] for _score in scores] for idx in range(self.size)]
+        return [y] * self.size, [x] * self.size, weights
+
+    def _map_components(self, func, *args):
+        # maps func over all (basis, model) pairs, args are per component
+        if self.pool is None:
+            return list(map(func, self.basis, self.models, *args))
+        else:
+            return self.pool.map(func, self.basis, self.models, *args)
+
     @property
     def nb_params(self):
         return self.gating.likelihood.nb_params\
@@ -73,6 +247,47 @@ class BayesianMixtureOfLinearGaussians(Conditional):
         used_labels, = np.where(label_usages > 0)
         return used_labels
 
+    @property
+    def sparse(self):
+        return self.topk is not None or self.threshold is not None
+
+    def truncate(self, scores):
+        if self.sparse:
+            return truncate_responsibilities(scores, self.topk, self.threshold)
+        return scores
+
+    @property
+    def stackable(self):
+        # the bank bypasses the components' own resample and update
+        # methods, so only the plain conjugate components qualify,
+        # variants such as automatic relevance extend those methods
+        return all(type(b) is GaussianWithNormalWishart for b in self.basis)\
+               and all(type(m) is LinearGaussianWithMatrixNormalWishart for m in self.models)\
+               and all(isinstance(b.posterior, NormalWishart) for b in self.basis)\
+               and all(isinstance(m.posterior, MatrixNormalWishart) for m in self.models)\
+               and len(set(m.likelihood.affine for m in self.models)) == 1
+
+    @property
+    def bank(self):
+        # stacked posteriors of all basis and models, rebuilt once
+        # posteriors are replaced and refreshed once they are updated
+        if not self.stackable:
+            self._bank = None
+            return self._bank
+
+        affine = self.models[0].likelihood.affine
+        basis = [b.posterior for b in self.basis]
+        models = [m.posterior for m in self.models]
+        if self._bank is None or not self._bank[0].stacks(basis)\
+                or not self._bank[1].stacks(models) or self._bank[1].affine != affine:
+            self._bank = (StackedNormalWisharts(basis),
+                          StackedMatrixNormalWisharts(models, affine))
+        else:
+            for _bank in self._bank:
+                if _bank.stale:
+                    _bank.refresh()
+        return self._bank
+
     def add_data(self, y, x, whiten=False,
                  target_transform=False,
                  input_transform=False,
@@ -82,6 +297,11 @@ class BayesianMixtureOfLinearGaussians(Conditional):
         y = y if isinstance(y, list) else [y]
         x = x if isinstance(x, list) else [x]
 
+        # scan for missing values once and keep compacted copies
+        masks = [nanmask(_y, _x) for _y, _x in zip(y, x)]
+        y = [_y[_mask] for _y, _mask in zip(y, masks)]
+        x = [_x[_mask] for _x, _mask in zip(x, masks)]
+
         if whiten:
             self.whitend = True
 
@@ -112,8 +332,8 @@ class BayesianMixtureOfLinearGaussians(Conditional):
                 self.target.append(self.target_transform.transform(_y))
                 self.input.append(self.input_transform.transform(_x))
         else:
-            self.target = y
-            self.input = x
+            self.target.extend(y)
+            self.input.extend(x)
 
         if labels_from_prior:
             for _y, _x in zip(self.target, self.input):
@@ -125,6 +345,7 @@ class BayesianMixtureOfLinearGaussians(Conditional):
         self.input.clear()
         self.target.clear()
         self.labels.clear()
+        self._buffers.clear()
 
     def clear_transform(self):
         self.whitend = False
@@ -154,10 +375,10 @@ class BayesianMixtureOfLinearGaussians(Conditional):
         if isinstance(x, list) and isinstance(y, list):
             return sum(self.log_likelihood(_y, _x) for (_y, _x) in zip(y, x))
         else:
-            scores = self.log_scores(y, x)
+            lognorms = normalize_log_scores(self.log_scores(y, x))[1]
             idx = np.logical_and(~np.isnan(y).any(axis=1),
                                  ~np.isnan(x).any(axis=1))
-            return np.sum(logsumexp(scores[idx], axis=1))
+            return np.sum(lognorms[idx])
 
     def mean(self, x):
         raise NotImplementedError
@@ -171,26 +392,26 @@ class BayesianMixtureOfLinearGaussians(Conditional):
     def entropy(self):
         raise NotImplementedError
 
-    def log_scores(self, y, x):
+    def log_scores(self, y, x, clean=False):
         N, K = y.shape[0], self.size
 
         # update, see Eq. 10.67 in Bishop
         component_scores = np.empty((N, K))
         for idx, (b, m) in enumerate(zip(self.basis, self.models)):
-            component_scores[:, idx] = b.likelihood.log_likelihood(x)
-            component_scores[:, idx] += m.likelihood.log_likelihood(y, x)
-        component_scores = np.nan_to_num(component_scores, copy=False)
+            component_scores[:, idx] = b.likelihood.log_likelihood(x, clean=clean)
+            component_scores[:, idx] += m.likelihood.log_likelihood(y, x, clean=clean)
+
+        # clean data has no missing values to be zeroed
+        if not clean:
+            component_scores = np.nan_to_num(component_scores, copy=False)
 
         gating_scores = self.gating.likelihood.log_likelihood(np.arange(K))
-        score = gating_scores + component_scores
-        return score
+        component_scores += gating_scores
+        return component_scores
 
     # Expectation-Maximization
-    def scores(self, y, x):
-        logr = self.log_scores(y, x)
-        score = np.exp(logr - np.max(logr, axis=1, keepdims=True))
-        score /= np.sum(score, axis=1, keepdims=True)
-        return score
+    def scores(self, y, x, clean=False):
+        return normalize_log_scores(self.log_scores(y, x, clean))[0]
 
     @pass_target_and_input_arg
     def max_aposteriori(self, y=None, x=None, maxiter=1, progprint=True):
@@ -207,12 +428,20 @@ class BayesianMixtureOfLinearGaussians(Conditional):
                 # Expectation step
                 scores = []
                 for _y, _x in zip(y, x):
-                    scores.append(self.scores(_y, _x))
+                    scores.append(self.truncate(self.scores(_y, _x, clean=True)))
 
                 # Maximization step
-                for idx, (b, m) in enumerate(zip(self.basis, self.models)):
-                    b.max_aposteriori([_x for _x in x], [_score[:, idx] for _score in scores])
-                    m.max_aposteriori([_y for _y in y], [_score[:, idx] for _score in scores])
+                if self.bank is not None:
+                    for b, m, bs, ms in self._bank_statistics(y, x, scores):
+                        b.max_aposteriori(None, stats=bs)
+                        m.max_aposteriori(None, None, stats=ms)
+                else:
+                    for b, m, _y, _x, _weights in\
+                            zip(self.basis, self.models, *self._component_arguments(y, x, scores)):
+                        bs, ms = _component_statistics(b, m, _y, _x, _weights)
+                        b.max_aposteriori(_x, _weights, stats=bs)
+                        m.max_aposteriori(_y, _x, _weights, stats=ms)
+                self._bank = None
 
                 # mixture weights
                 self.gating.max_aposteriori(None, scores)
@@ -222,7 +451,7 @@ class BayesianMixtureOfLinearGaussians(Conditional):
     # Gibbs sampling
     @pass_target_input_and_labels_arg
     def resample(self, y=None, x=None, z=None,
-                 maxiter=1, progprint=True):
+                 maxiter=1, progprint=True, rng=None):
 
         current = mp.current_process()
         if len(current._identity) > 0:
@@ -235,50 +464,70 @@ class BayesianMixtureOfLinearGaussians(Conditional):
             for _ in range(maxiter):
                 self._resample_components(y, x, z)
                 self._resample_gating(z)
-                z = self._resample_labels(y, x)
+                z = self._resample_labels(y, x, rng)
 
                 if self.has_data():
                     self.labels = z
 
                 pbar.update(1)
 
+    def _bank_statistics(self, y, x, weights):
+        # statistics of all components in one pass through the bank
+        basis, models = self.bank
+        return zip(self.basis, self.models,
+                   basis.weighted_statistics(x, weights),
+                   models.weighted_statistics(y, x, weights))
+
+    def _bank_rvs(self):
+        # one batched draw for all components from their updated posteriors
+        basis, models = self.bank
+        for b, m, bparams, mparams in zip(self.basis, self.models,
+                                          zip(*basis.rvs()), zip(*models.rvs())):
+            b.likelihood.params = bparams
+            m.likelihood.params = mparams
+
     def _resample_components(self, y, x, z):
+        if self.bank is not None:
+            # statistics of all components from one-hot weights
+            weights = [sc.sparse.csr_matrix((np.ones(len(_z)), (np.arange(len(_z)), _z)),
+                                            shape=(len(_z), self.size)) for _z in z]
+            for b, m, bs, ms in self._bank_statistics(y, x, weights):
+                b.posterior.nat_param = bs.accumulate(b.prior.nat_param)
+                m.posterior.nat_param = ms.accumulate(m.prior.nat_param)
+            self._bank_rvs()
+            return
+
+        # per dataset, group the data by label once
+        groups = [groupby(_z, self.size, _y, _x) for _y, _x, _z in zip(y, x, z)]
         for idx, (b, m) in enumerate(zip(self.basis, self.models)):
-            b.resample(data=[_x[_z == idx] for _x, _z in zip(x, z)])
-            m.resample(y=[_y[_z == idx] for _y, _z in zip(y, z)],
-                       x=[_x[_z == idx] for _x, _z in zip(x, z)])
+            b.resample(data=[_xs[idx] for _, _xs in groups])
+            m.resample(y=[_ys[idx] for _ys, _ in groups],
+                       x=[_xs[idx] for _, _xs in groups])
+        self._bank = None
 
     def _resample_gating(self, z):
         self.gating.resample([_z for _z in z])
 
-    def _resample_labels(self, y, x):
+    def _resample_labels(self, y, x, rng=None):
         z = []
         for _y, _x in zip(y, x):
-            score = self.log_scores(_y, _x)
-            z.append(sample_discrete_from_log(score, axis=1))
+            score = self.log_scores(_y, _x, clean=True)
+            z.append(sample_labels_from_log(score, rng))
         return z
 
     # Mean Field
-    def expected_scores(self, y, x, nb_threads=4):
-        N, K = y.shape[0], self.size
-
-        component_scores = np.empty((N, K))
-
-        if nb_threads == 1:
-            for idx, (b, m) in enumerate(zip(self.basis, self.models)):
-                _affine = m.likelihood.affine
-                component_scores[:, idx] = b.posterior.expected_log_likelihood(x)
-                component_scores[:, idx] += m.posterior.expected_log_likelihood(y, x, _affine)
+    def expected_scores(self, y, x, out=None, clean=False):
+        if self.bank is not None:
+            basis, models = self.bank
+            component_scores = basis.expected_log_likelihood(x, out=out)
+            component_scores += models.expected_log_likelihood(y, x)
         else:
-            def _loop(idx):
-                _affine = self.models[idx].likelihood.affine
-                component_scores[:, idx] = self.basis[idx].posterior.expected_log_likelihood(x)
-                component_scores[:, idx] += self.models[idx].posterior.expected_log_likelihood(y, x, _affine)
-
-            with Pool(threads=nb_threads) as p:
-                p.map(_loop, range(self.size))
+            component_scores = np.stack(self._map_components(_expected_component_scores,
+                                                             [y] * self.size, [x] * self.size),
+                                        axis=1, out=out)
 
-        component_scores = np.nan_to_num(component_scores, copy=False)
+        if not clean:
+            component_scores = np.nan_to_num(component_scores, copy=False)
 
         if isinstance(self.gating, CategoricalWithDirichlet):
             gating_scores = self.gating.posterior.expected_statistics()
@@ -288,12 +537,8 @@ class BayesianMixtureOfLinearGaussians(Conditional):
         else:
             raise NotImplementedError
 
-        logr = gating_scores + component_scores
-
-        r = np.exp(logr - np.max(logr, axis=1, keepdims=True))
-        r /= np.sum(r, axis=1, keepdims=True)
-
-        return r
+        component_scores += gating_scores
+        return normalize_log_scores(component_scores)[0]
 
     def meanfield_coordinate_descent(self, tol=1e-2, maxiter=250, progprint=True):
         elbo = []
@@ -328,11 +573,15 @@ class BayesianMixtureOfLinearGaussians(Conditional):
         self._meanfield_update_parameters(y, x, scores)
         return scores, z
 
-    def _meanfield_update_labels(self, y, x):
+    def _meanfield_update_labels(self, y, x, key='data'):
+        # score buffers are kept per key and dataset, minibatches
+        # use their own key so they do not evict the full-data ones
         scores, z = [], []
-        for _y, _x in zip(y, x):
-            scores.append(self.expected_scores(_y, _x))
-            z.append(np.argmax(scores[-1], axis=1))
+        for n, (_y, _x) in enumerate(zip(y, x)):
+            buf = self._buffer((key, n), (len(_y), self.size))
+            _score = self.expected_scores(_y, _x, out=buf, clean=True)
+            z.append(np.argmax(_score, axis=1))
+            scores.append(self.truncate(_score))
         return scores, z
 
     def _meanfield_update_parameters(self, y, x, scores):
@@ -342,23 +591,26 @@ class BayesianMixtureOfLinearGaussians(Conditional):
     def _meanfield_update_gating(self, scores):
         self.gating.meanfield_update(None, scores)
 
-    def _meanfield_update_components(self, y, x, scores,
-                                     nb_threads=4):
-        if nb_threads == 1:
-            for idx, (b, m) in enumerate(zip(self.basis, self.models)):
-                b.meanfield_update(x, [_score[:, idx] for _score in scores])
-                m.meanfield_update(y, x, [_score[:, idx] for _score in scores])
-        else:
-            def _loop(idx):
-                self.basis[idx].meanfield_update(x, [_score[:, idx] for _score in scores])
-                self.models[idx].meanfield_update(y, x, [_score[:, idx] for _score in scores])
+    def _meanfield_update_components(self, y, x, scores):
+        if self.bank is not None:
+            # see _resample_components, weighted by the scores
+            for b, m, bs, ms in self._bank_statistics(y, x, scores):
+                b.posterior.nat_param = bs.accumulate(b.prior.nat_param)
+                m.posterior.nat_param = ms.accumulate(m.prior.nat_param)
+            self._bank_rvs()
+            return
+
+        res = self._map_components(_meanfield_update_component,
+                                   *self._component_arguments(y, x, scores))
 
-            with Pool(threads=nb_threads) as p:
-                p.map(_loop, range(self.size))
+        # processes return updated copies of the components
+        self.basis, self.models = map(list, zip(*res))
+        self._bank = None
 
     # SVI
     def meanfield_stochastic_descent(self, stepsize=1e-3, batchsize=128,
-                                     maxiter=500, progprint=True):
+                                     maxiter=500, progprint=True,
+                                     weights=None, replace=False, rng=None):
 
         assert self.has_data()
 
@@ -369,46 +621,67 @@ class BayesianMixtureOfLinearGaussians(Conditional):
             pos = 0
 
         x, y = self.input, self.target
-        prob = batchsize / float(sum(len(_x) for _x in x))
+        datasizes = [len(_x) for _x in x]
 
         with tqdm(total=maxiter, desc=f'SVI #{pos + 1}',
                   position=pos, disable=not progprint) as pbar:
             for _ in range(maxiter):
-                for _x, _y in zip(x, y):
-                    for batch in batches(batchsize, len(_x)):
-                        _mx, _my = _x[batch, :], _y[batch, :]
-                        self.meanfield_sgdstep(_my, _mx, prob, stepsize)
+                for n, batch, prob in minibatches(batchsize, datasizes,
+                                                  weights, replace, rng):
+                    _mx, _my = x[n][batch, :], y[n][batch, :]
+                    _, _mz = self._meanfield_sgdstep([_my], [_mx], prob, stepsize)
+                    # only the rows of the minibatch are relabeled
+                    self.labels[n][batch] = _mz[0]
+
+                self.refresh_labels()
                 pbar.update(1)
 
     def meanfield_sgdstep(self, y, x, prob, stepsize):
         y = y if isinstance(y, list) else [y]
         x = x if isinstance(x, list) else [x]
 
-        scores, _ = self._meanfield_update_labels(y, x)
+        # caller data is compacted to the rows without nans,
+        # the returned scores and labels index those rows
+        data = [dropnans(_y, _x) for _y, _x in zip(y, x)]
+        y, x = [_d[0] for _d in data], [_d[1] for _d in data]
+
+        # scores are copied out of the reused minibatch buffers
+        scores, z = self._meanfield_sgdstep(y, x, prob, stepsize)
+        return [_score.copy() for _score in scores], z
+
+    def _meanfield_sgdstep(self, y, x, prob, stepsize):
+        scores, z = self._meanfield_update_labels(y, x, key='batch')
         self._meanfield_sgdstep_parameters(y, x, scores, prob, stepsize)
+        return scores, z
 
-        if self.has_data():
-            for _y, _x in zip(self.target, self.input):
-                self.labels.append(np.argmax(self.expected_scores(_y, _x), axis=1))
+    def refresh_labels(self):
+        # rescore all stored data, labels are only updated
+        # lazily for the minibatches during stochastic descent
+        assert self.has_data()
+        _, self.labels = self._meanfield_update_labels(self.target, self.input)
 
     def _meanfield_sgdstep_parameters(self, y, x, scores, prob, stepsize):
         self._meanfield_sgdstep_components(y, x, scores, prob, stepsize)
         self._meanfield_sgdstep_gating(scores, prob, stepsize)
 
-    def _meanfield_sgdstep_components(self, y, x, scores, prob,
-                                      stepsize, nb_threads=4):
-
-        if nb_threads == 1:
-            for idx, (b, m) in enumerate(zip(self.basis, self.models)):
-                b.meanfield_sgdstep(x, [_score[:, idx] for _score in scores], prob, stepsize)
-                m.meanfield_sgdstep(y, x, [_score[:, idx] for _score in scores], prob, stepsize)
-        else:
-            def _loop(idx):
-                self.basis[idx].meanfield_sgdstep(x, [_score[:, idx] for _score in scores], prob, stepsize)
-                self.models[idx].meanfield_sgdstep(y, x, [_score[:, idx] for _score in scores], prob, stepsize)
-
-            with Pool(threads=nb_threads) as p:
-                p.map(_loop, range(self.size))
+    def _meanfield_sgdstep_components(self, y, x, scores, prob, stepsize):
+        if self.bank is not None:
+            # (1 - stepsize) * posterior + stepsize * (prior + stats / prob)
+            for b, m, bs, ms in self._bank_statistics(y, x, scores):
+                for c, stats in ((b, bs), (m, ms)):
+                    c.posterior.nat_param = stats.scale(stepsize / prob)\
+                        .axpy(stepsize, c.prior.nat_param)\
+                        .axpy(1. - stepsize, c.posterior.nat_param)
+            self._bank_rvs()
+            return
+
+        res = self._map_components(_meanfield_sgdstep_component,
+                                   *self._component_arguments(y, x, scores),
+                                   [prob] * self.size, [stepsize] * self.size)
+
+        # processes return updated copies of the components
+        self.basis, self.models = map(list, zip(*res))
+        self._bank = None
 
     def _meanfield_sgdstep_gating(self, scores, prob, stepsize):
         self.gating.meanfield_sgdstep(None, scores, prob, stepsize)
@@ -416,21 +689,33 @@ class BayesianMixtureOfLinearGaussians(Conditional):
     def _variational_lowerbound_labels(self, scores):
         vlb = 0.
 
+        # the gating terms are linear in the scores,
+        # only the reduced counts are needed
+        counts = np.asarray(scores.sum(axis=0)).ravel()
         if isinstance(self.gating, CategoricalWithDirichlet):
-            vlb += np.sum(scores * self.gating.posterior.expected_log_likelihood())
+            vlb += np.sum(counts * self.gating.posterior.expected_log_likelihood())
         elif isinstance(self.gating, CategoricalWithStickBreaking):
-            cumscores = np.hstack((np.cumsum(scores[:, ::-1], axis=1)[:, -2::-1],
-                                   np.zeros((len(scores), 1))))
+            cumcounts = np.hstack((np.cumsum(counts[::-1])[-2::-1], 0))
             E_log_stick, E_log_rest = self.gating.posterior.expected_log_likelihood()
-            vlb += np.sum(scores * E_log_stick + cumscores * E_log_rest)
+            vlb += np.sum(counts * E_log_stick + cumcounts * E_log_rest)
 
-        errs = np.seterr(invalid='ignore', divide='ignore')
-        vlb -= np.nansum(scores * np.log(scores))  # treats nans as zeros
-        np.seterr(**errs)
+        # dropped entries of sparse scores are exact zeros
+        r = scores.data if sc.sparse.issparse(scores) else scores
+        vlb += np.sum(special.entr(r))
 
         return vlb
 
     def _variational_lowerbound_data(self, y, x, scores):
+        if self.bank is not None:
+            basis, models = self.bank
+            loglik = basis.expected_log_likelihood(x)\
+                     + models.expected_log_likelihood(y, x)
+            if sc.sparse.issparse(scores):
+                return scores.multiply(loglik).sum()
+            return np.sum(scores * loglik)
+
+        scores = scores.toarray() if sc.sparse.issparse(scores) else scores
+
         vlb = 0.
         vlb += np.sum([r.dot(b.posterior.expected_log_likelihood(x))
                        for b, r in zip(self.basis, scores.T)])
@@ -452,7 +737,31 @@ class BayesianMixtureOfLinearGaussians(Conditional):
             vlb += special.gammaln(self.size + 1)
         return vlb
 
+    # Pruning
+    def prune(self, threshold=1e-3):
+        # drop components with negligible posterior mass,
+        # later sweeps and predictions scale with the kept ones
+        weights = self.gating.posterior.mean()
+        keep, = np.where(weights > threshold)
+        if len(keep) == 0:
+            keep = np.array([np.argmax(weights)])
+
+        self.gating.prune(keep)
+        self.basis = [self.basis[k] for k in keep]
+        self.models = [self.models[k] for k in keep]
+        self._bank = None
+
+        # data of dropped components is reassigned
+        if self.has_data():
+            self.refresh_labels()
+        return self
+
     # Misc
+    def export(self, path):
+        # compact on-disk format for deployment,
+        # see CompressedMixtureOfLinearGaussians.load
+        CompressedMixtureOfLinearGaussians(self).save(path)
+
     def bic(self, y=None, x=None):
         assert x is not None and y is not None
         return - 2. * self.log_likelihood(y, x) + self.nb_params\
@@ -470,54 +779,82 @@ class BayesianMixtureOfLinearGaussians(Conditional):
         x = x if not self.whitend \
             else self.input_transform.transform(x)
 
-        weights = self.gating.posterior.mean()
+        return self.meanfield_predictive_gating(x, dist)
 
-        labels = range(self.size)
-        activations = np.zeros((len(x), len(labels)))
-
-        for i, idx in enumerate(labels):
-            activations[:, i] = self.basis[idx].log_posterior_predictive_gaussian(x)\
-                if dist == 'gaussian' else self.basis[idx].log_posterior_predictive_studentt(x)
+    def meanfield_log_predictive_gating(self, x, dist='gaussian'):
+        # log posterior mixing weights, normalized in log-space, such that
+        # queries far from all basis functions do not underflow to uniform weights
+        if self.bank is not None:
+            log_weights = self.bank[0].log_posterior_predictive(x, dist)
+        else:
+            log_weights = np.zeros((len(x), self.size))
+            for n, basis in enumerate(self.basis):
+                log_weights[:, n] = basis.log_posterior_predictive_gaussian(x)\
+                    if dist == 'gaussian' else basis.log_posterior_predictive_studentt(x)
 
-        activations = weights[labels] * np.exp(activations) + eps
-        activations = activations / np.sum(activations, axis=1, keepdims=True)
-        return activations
+        log_weights += np.log(self.gating.posterior.mean())
+        log_weights -= logsumexp(log_weights, axis=1, keepdims=True)
+        return log_weights
 
     def meanfield_predictive_gating(self, x, dist='gaussian'):
         # compute posterior mixing weights
-        weights = self.gating.posterior.mean()
+        return np.exp(self.meanfield_log_predictive_gating(x, dist))
 
-        labels = range(self.size)
-        log_posterior_predictive = np.zeros((len(x), len(labels)))
+    def _meanfield_gating_index(self, tol):
+        # kd-tree index over the gaussian posterior predictives
+        # of the basis bank, see _gating_index
+        basis = self.bank[0]
+        dfs, logdets = basis.posterior_predictive_params()[:2]
 
-        for i, idx in enumerate(labels):
-            log_posterior_predictive[:, i] = self.basis[idx].log_posterior_predictive_gaussian(x)\
-                if dist == 'gaussian' else self.basis[idx].log_posterior_predictive_studentt(x)
+        lmbda_mins = dfs / (1. + 1. / basis.kappas) * np.linalg.eigvalsh(basis.psis)[:, 0]
+        log_weights_max = np.log(self.gating.posterior.mean())\
+                          + 0.5 * logdets - 0.5 * basis.dim * np.log(2. * np.pi)
 
-        effective_weights = weights[labels] * np.exp(log_posterior_predictive) + eps
-        effective_weights = effective_weights / np.sum(effective_weights, axis=1, keepdims=True)
-        return effective_weights
+        return _gating_index(basis.mus, log_weights_max, lmbda_mins, tol)
 
-    def meanfield_predictive_moments(self, x, dist='gaussian', aleatoric_only=False):
-        mu, var = np.zeros((len(x), self.drow, self.size)),\
-                  np.zeros((len(x), self.drow, self.drow, self.size))
+    def _meanfield_indexed_gating(self, x, index):
+        # sparse (csr) gaussian gating of whitened queries through
+        # the index, see StackedNormalWisharts.log_posterior_predictive
+        basis = self.bank[0]
+        _, logdets, qweights, q0 = basis.posterior_predictive_params()
 
-        for n, model in enumerate(self.models):
-            if dist == 'gaussian':
-                mu[..., n], _lmbda = model.posterior_predictive_gaussian(x, aleatoric_only)
-                var[..., n] = np.linalg.inv(_lmbda)
-            else:
-                mu[..., n], _lmbda, _df = model.posterior_predictive_studentt(x, aleatoric_only)
-                var[..., n] = np.linalg.inv(_lmbda) * _df / (_df - 2)
+        log_pis = np.log(self.gating.posterior.mean())
+        features = np.hstack((quadratic_features(x), x))
+
+        def log_weights(n, k):
+            delta = np.einsum('nd,nd->n', features[n], qweights[k]) + q0[k]
+            return log_pis[k] - 0.5 * basis.dim * np.log(2. * np.pi)\
+                   + 0.5 * logdets[k] - 0.5 * delta
+
+        qi, ci, weights = _query_gating_index(index, x, log_weights)
+        return sc.sparse.csr_matrix((weights, (qi, ci)), shape=(len(x), self.size))
+
+    def meanfield_predictive_moments(self, x, dist='gaussian',
+                                     aleatoric_only=False, labels=None):
+        # moments of the components in labels, all by default
+        if self.bank is not None:
+            # all components in one contraction
+            return self.bank[1].posterior_predictive_moments(x, dist, aleatoric_only, labels)
+
+        labels = range(self.size) if labels is None else labels
+        mu, var = np.zeros((len(x), self.drow, len(labels))),\
+                  np.zeros((len(x), self.drow, self.drow, len(labels)))
+
+        for n, k in enumerate(labels):
+            mu[..., n], var[..., n] = self.models[k].posterior_predictive_moments(x, dist, aleatoric_only)
 
         return mu, var
 
-    def meanfiled_log_predictive_likelihood(self, y, x, dist='gaussian'):
-        lpd = np.zeros((len(x), self.size))
+    def meanfiled_log_predictive_likelihood(self, y, x, dist='gaussian', labels=None):
+        if self.bank is not None:
+            return self.bank[1].log_posterior_predictive(y, x, dist, labels)
 
-        for n, model in enumerate(self.models):
-            lpd[:, n] = model.log_posterior_predictive_gaussian(y, x)\
-                if dist == 'gaussian' else model.log_posterior_predictive_studentt(y, x)
+        labels = range(self.size) if labels is None else labels
+        lpd = np.zeros((len(x), len(labels)))
+
+        for n, k in enumerate(labels):
+            lpd[:, n] = self.models[k].log_posterior_predictive_gaussian(y, x)\
+                if dist == 'gaussian' else self.models[k].log_posterior_predictive_studentt(y, x)
 
         return lpd
 
@@ -527,7 +864,8 @@ class BayesianMixtureOfLinearGaussians(Conditional):
         mu = np.einsum('nkl,nl->nk', mus, weights)
         # Variance of a mixture = sum of weighted variances + ...
         # ... + sum of weighted squared means - squared sum of weighted means
-        var = np.einsum('nkhl,nl->nkh', vars + np.einsum('nkl,nhl->nkhl', mus, mus), weights)\
+        var = np.einsum('nkhl,nl->nkh', vars, weights)\
+              + (mus * weights[:, None, :]) @ np.swapaxes(mus, 1, 2)\
               - np.einsum('nk,nh->nkh', mu, mu)
         return mu, var
 
@@ -540,12 +878,8 @@ class BayesianMixtureOfLinearGaussians(Conditional):
 
         for n, (basis, model) in enumerate(zip(self.basis, self.models)):
             x = basis.posterior.gaussian.mu
-            if dist == 'gaussian':
-                mus[n, :], _lmbda = model.posterior_predictive_gaussian(x, True)
-                vars[n, ...] = np.linalg.inv(_lmbda)
-            else:
-                mus[n, :], _lmbda, _df = model.posterior_predictive_studentt(x, True)
-                vars[n, ...] = np.linalg.inv(_lmbda) * _df / (_df - 2)
+            _mu, _var = model.posterior_predictive_moments(x, dist, True)
+            mus[n, :], vars[n, ...] = _mu[0], _var[0]
 
         mu = np.einsum('nk,n->k', mus, weights)
         var = np.einsum('nkh,n->kh', vars + np.einsum('nk,nh->nkh', mus, mus), weights)\
@@ -553,11 +887,54 @@ class BayesianMixtureOfLinearGaussians(Conditional):
 
         return inverse_transform_variance(var, self.target_transform)
 
+    def _meanfield_prediction(self, input, target=None,
+                              prediction='average', dist='gaussian',
+                              topk=None, threshold=None, index=None):
+        # prediction of a single block of (transformed) queries, the
+        # gating is either sparse through the index, truncated or dense
+        weights = None
+        if index is not None:
+            weights = self._meanfield_indexed_gating(input, index)
+        else:
+            log_weights = self.meanfield_log_predictive_gating(input, dist)
+            if topk is not None or threshold is not None:
+                weights = truncate_responsibilities(np.exp(log_weights), topk, threshold)
+
+        # components without weight for all queries
+        # of the block are skipped, see truncate_responsibilities
+        labels = None
+        if weights is not None:
+            labels = np.unique(weights.indices)
+            with np.errstate(divide='ignore'):
+                log_weights = np.log(weights[:, labels].toarray())
+
+        weights = np.exp(log_weights)
+        mus, vars = self.meanfield_predictive_moments(input, dist, labels=labels)
+
+        if prediction == 'mode':
+            k = np.argmax(log_weights, axis=1)
+            idx = (range(len(k)), ..., k)
+            mu, var = mus[idx], vars[idx]
+        elif prediction == 'average':
+            mu, var = self._mixture_moments(mus, vars, weights)
+        else:
+            raise NotImplementedError
+
+        nlpd = None
+        if target is not None:
+            lpd = self.meanfiled_log_predictive_likelihood(target, input, labels=labels)
+            nlpd = -1.0 * logsumexp(lpd + log_weights, axis=1)
+
+        return mu, var, nlpd
+
     def meanfield_prediction(self, x, y=None,
                              prediction='average',
                              dist='gaussian',
                              incremental=False,
-                             variance='diagonal'):
+                             variance='diagonal',
+                             budget=2**28,
+                             topk=None, threshold=None,
+                             tol=None):
 
         x = np.reshape(x, (-1, self.dcol))
 
@@ -571,25 +948,30 @@ class BayesianMixtureOfLinearGaussians(Conditional):
         input = transform(x, trans=self.input_transform)
         target = None if y is None else transform(y, trans=self.target_transform)
 
-        weights = self.meanfield_predictive_gating(input, dist)
-        mus, vars = self.meanfield_predictive_moments(input, dist)
-
-        if prediction == 'mode':
-            k = np.argmax(weights, axis=1)
-            idx = (range(len(k)), ..., k)
-            mu, var = mus[idx], vars[idx]
-        elif prediction == 'average':
-            labels = range(self.size)
-            mu, var = self._mixture_moments(mus[..., labels],
-                                            vars[..., labels], weights)
-        else:
-            raise NotImplementedError
-
-        nlpd = None
-        if compute_nlpd:
-            lpd = self.meanfiled_log_predictive_likelihood(target, input)
-            lw = np.log(weights + eps)
-            nlpd = -1.0 * logsumexp(lpd + lw, axis=1)
+        # queries are streamed in blocks, such that the per-component
+        # gating, means and covariances of a block fit into the budget (bytes)
+        K, d = self.size, self.drow
+        chunksize = max(1, int(budget // (8 * K * (3 + 2 * d + 2 * d * d))))
+
+        # with tol, a kd-tree index prunes components whose normalized
+        # gating weight cannot exceed tol, in place of topk and threshold.
+        # Only gaussian predictives of a component bank have the required
+        # fixed gaussian bounds, student-t gating stays dense
+        index = None
+        if tol is not None and dist == 'gaussian' and self.bank is not None:
+            index = self._meanfield_gating_index(tol)
+
+        mu, var, nlpd = [], [], []
+        for i in range(0, len(input), chunksize):
+            _mu, _var, _nlpd = self._meanfield_prediction(input[i:i + chunksize],
+                                                          None if target is None else target[i:i + chunksize],
+                                                          prediction, dist, topk, threshold, index)
+            mu.append(_mu)
+            var.append(_var)
+            nlpd.append(_nlpd)
+
+        mu, var = np.concatenate(mu), np.concatenate(var)
+        nlpd = np.concatenate(nlpd) if compute_nlpd else None
 
         mu, var = inverse_transform(mu, var, trans=self.target_transform)
 
@@ -610,16 +992,28 @@ class BayesianMixtureOfLinearGaussians(Conditional):
                 return mu, var, np.sqrt(diag)
 
 
-class CompressedMixtureOfLinearGaussians:
+class CompressedMixtureOfLinearGaussians(BufferMixin):
     # This class compresses the above mixture
     # for speed at prediction/deployment time
 
+    # version of the on-disk format, see save and load
+    format_version = 1
+
+    # arrays built by _compile, stored along on save
+    _compiled = ('_basis_quad', '_basis_lin', '_basis_const',
+                 '_basis_lmbda_mins', '_basis_log_weights_max',
+                 '_models_Ms', '_models_sigmas', '_models_quad')
+
     def __init__(self, mixture):
+        from mimo.util.data import affine_transform, inverse_affine_transform
+
         self.mixture = mixture
 
         self.input_transform = self.mixture.input_transform
         self.target_transform = self.mixture.target_transform
 
+        self.affine = self.mixture.models[0].likelihood.affine
+
         self.gating = {'weights': self.mixture.gating.posterior.mean()}
 
         _basis_mus = np.vstack([b.posterior_predictive_gaussian()[0]
@@ -633,7 +1027,149 @@ class CompressedMixtureOfLinearGaussians:
                       'logdet_lmbdas': _basis_logdet_lmbdas}
 
         _models_mus = np.stack([m.posterior.matnorm.M for m in self.mixture.models], axis=0)
-        self.models = {'Ms': _models_mus}
+        # predictive covariance is sigma * (1 + x^T K^-1 x), see
+        # LinearGaussianWithMatrixNormalWishart.posterior_predictive_gaussian
+        _models_sigmas = np.stack([m.posterior.wishart.psi_inv
+                                   / (m.posterior.wishart.nu - m.likelihood.drow + 1)
+                                   for m in self.mixture.models], axis=0)
+        _models_Kinvs = np.stack([m.posterior.matnorm.K_chol_inv @ m.posterior.matnorm.K_chol_inv.T
+                                  for m in self.mixture.models], axis=0)
+        self.models = {'Ms': _models_mus,
+                       'sigmas': _models_sigmas,
+                       'Kinvs': _models_Kinvs}
+
+        # transforms as affine maps, W x + b into and V z + c out of the whitened space
+        self._input_affine = affine_transform(self.input_transform, self.dim)
+        self._target_affine = inverse_affine_transform(self.target_transform, self.drow)
+
+        self._compile()
+
+        # work arrays, reused across batches of the same size
+        self._buffers = {}
+
+        # optional spatial index over the basis, see build_index
+        self._index = None
+
+        # stacked posteriors of loaded mixtures, see load
+        self.posteriors = {}
+
+    def _compile(self):
+        # The parameters above live in the whitened space. The affine
+        # input and target transforms are folded into flattened quadratic
+        # forms over raw inputs, such that the basis log-densities, means and
+        # predictive covariance factors are single matrix products
+        W, b = self._input_affine
+        V, c = self._target_affine
+
+        # basis densities of whitened z = W x + b, expanded in x
+        lmbdas, mus = self.basis['lmbdas'], self.basis['mus'] - b
+        lmbda_mus = np.einsum('kdh,kh->kd', lmbdas, mus)
+        self._basis_quad = - 0.5 * quadratic_weights(np.einsum('hd,khl,lm->kdm', W, lmbdas, W))
+        self._basis_lin = lmbda_mus @ W
+        self._basis_const = - 0.5 * np.einsum('kd,kd->k', mus, lmbda_mus)\
+                            + 0.5 * self.basis['logdet_lmbdas']\
+                            - 0.5 * self.dim * np.log(2. * np.pi)\
+                            + np.log(self.gating['weights'])
+
+        # Mahalanobis bounds of the log weights in whitened space
+        #   log w_k(z) <= u_k - 0.5 * lmbda_min_k * |z - mu_k|^2
+        # with u_k the log weight attained at the mean mu_k
+        self._basis_lmbda_mins = np.linalg.eigvalsh(lmbdas)[:, 0]
+        self._basis_log_weights_max = np.log(self.gating['weights'])\
+                                      + 0.5 * self.basis['logdet_lmbdas']\
+                                      - 0.5 * self.dim * np.log(2. * np.pi)
+
+        # regression on augmented raw inputs [x, 1], mapped to raw outputs
+        A = np.vstack((W, np.zeros((1, W.shape[1]))))
+        A = np.hstack((A, np.append(b, 1.)[:, None]))
+        A = A if self.affine else A[:-1]
+
+        self._models_Ms = np.einsum('dh,khl,lm->kdm', V, self.models['Ms'], A)
+        self._models_Ms[..., -1] += c
+        self._models_sigmas = np.einsum('dh,khl,ml->kdm', V, self.models['sigmas'], V)
+        self._models_quad = quadratic_weights(np.einsum('hd,khl,lm->kdm', A, self.models['Kinvs'], A))
+
+    def save(self, path):
+        # versioned directory of flat arrays, see load. Stores the
+        # compressed and compiled parameters, the affine transforms
+        # and, if available, the stacked posteriors of the mixture
+        arrays = {'gating_weights': self.gating['weights'],
+                  'input_mat': self._input_affine[0],
+                  'input_vec': self._input_affine[1],
+                  'target_mat': self._target_affine[0],
+                  'target_vec': self._target_affine[1]}
+
+        arrays.update({'basis_' + k: v for k, v in self.basis.items()})
+        arrays.update({'models_' + k: v for k, v in self.models.items()})
+        arrays.update({'compiled' + k: getattr(self, k) for k in self._compiled})
+
+        if self.mixture is not None and self.mixture.stackable:
+            gating = self.mixture.gating.posterior
+            if isinstance(gating, StickBreaking):
+                arrays.update({'posterior_gating_gammas': gating.gammas,
+                               'posterior_gating_deltas': gating.deltas})
+            else:
+                arrays.update({'posterior_gating_alphas': gating.alphas})
+
+            basis, models = self.mixture.bank
+            arrays.update({'posterior_basis_' + k: v for k, v
+                           in zip(('mus', 'kappas', 'psis', 'nus'), basis.params)})
+            arrays.update({'posterior_models_' + k: v for k, v
+                           in zip(('Ms', 'Ks', 'psis', 'nus'), models.params)})
+
+        header = {'format': type(self).__name__,
+                  'version': self.format_version,
+                  'affine': bool(self.affine)}
+
+        save_arrays(path, arrays, header)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        # loads a saved mixture without its distribution objects or
+        # transforms, the arrays are memory-mapped read-only by default,
+        # such that serving processes share one copy and skip compilation
+        header, arrays = load_arrays(path, mmap_mode)
+        if header['format'] != cls.__name__ or header['version'] > cls.format_version:
+            raise ValueError(f"unsupported mixture format, found {header['format']} v{header['version']}, "
+                             f"supports {cls.__name__} v{cls.format_version}")
+
+        self = cls.__new__(cls)
+        self.mixture = None
+
+        self.input_transform = None
+        self.target_transform = None
+
+        self.affine = header['affine']
+
+        self.gating = {'weights': arrays['gating_weights']}
+        self.basis = {k: arrays['basis_' + k] for k in ('mus', 'lmbdas', 'logdet_lmbdas')}
+        self.models = {k: arrays['models_' + k] for k in ('Ms', 'sigmas', 'Kinvs')}
+
+        self._input_affine = arrays['input_mat'], arrays['input_vec']
+        self._target_affine = arrays['target_mat'], arrays['target_vec']
+
+        for k in self._compiled:
+            setattr(self, k, arrays['compiled' + k])
+
+        # stacked posteriors of the mixture, empty if it was not saved along
+        self.posteriors = {k[len('posterior_'):]: v for k, v in arrays.items()
+                           if k.startswith('posterior_')}
+
+        self._buffers = {}
+        self._index = None
+        return self
+
+    @property
+    def size(self):
+        return len(self.gating['weights'])
+
+    @property
+    def dim(self):
+        return self.basis['mus'].shape[-1]
+
+    @property
+    def drow(self):
+        return self.models['Ms'].shape[1]
 
     def log_basis_predictive(self, x):
         from mimo.util.stats import multivariate_gaussian_loglik as mvn_logpdf
@@ -642,22 +1178,220 @@ class CompressedMixtureOfLinearGaussians:
                           self.basis['logdet_lmbdas'])
 
     def predictive_gating(self, x):
-        log_basis_predictive = self.log_basis_predictive(x)
-        effective_weights = self.gating['weights'] * np.exp(log_basis_predictive) + eps
-        effective_weights = effective_weights / np.sum(effective_weights)
-        return effective_weights
+        # normalized in log-space, see meanfield_log_predictive_gating
+        log_weights = np.log(self.gating['weights']) + self.log_basis_predictive(x)
+        return np.exp(log_weights - logsumexp(log_weights))
 
     def predictive_output(self, x):
-        x = np.hstack((x, 1.))  # assumes affine input
+        x = np.hstack((x, 1.)) if self.affine else x
         return np.einsum('nkh,h->nk', self.models['Ms'], x)
 
     def prediction(self, x):
-        from mimo.util.data import transform, inverse_transform_mean
+        return self.predict_batch(np.atleast_2d(x))[0]
+
+    def build_index(self, tol=1e-6, nb_groups=8, leafsize=16, nb_neighbors=4):
+        # kd-trees over the whitened basis means, see _gating_index.
+        # With an index, predictions only evaluate components whose
+        # normalized gating weight can exceed tol
+        self._index = _gating_index(self.basis['mus'], self._basis_log_weights_max,
+                                    self._basis_lmbda_mins, tol, nb_groups, leafsize, nb_neighbors)
+        return self
+
+    def clear_index(self):
+        self._index = None
+        return self
+
+    def _log_weights(self, x, idx=None):
+        # unnormalized log gating weights of raw queries, for all components
+        # or for (query, component) pairs (x[n], idx[n]) if idx is given
+        if idx is None:
+            return quadratic_features(x) @ self._basis_quad.T\
+                   + x @ self._basis_lin.T + self._basis_const
+        return np.einsum('nd,nd->n', quadratic_features(x), self._basis_quad[idx])\
+               + np.einsum('nd,nd->n', x, self._basis_lin[idx]) + self._basis_const[idx]
+
+    def active_components(self, x):
+        # sparse gating of raw queries through the index, returns the
+        # (query, component) pairs sorted by query and their normalized weights
+        x = np.reshape(x, (-1, self._basis_lin.shape[-1]))
+
+        W, b = self._input_affine
+        return _query_gating_index(self._index, x @ W.T + b,
+                                   lambda n, k: self._log_weights(x[n], k))
+
+    def _predict_indexed(self, x, variance=False):
+        x = np.reshape(x, (-1, self._basis_lin.shape[-1]))
+        N = len(x)
+
+        qi, ci, weights = self.active_components(x)
+        starts = np.searchsorted(qi, np.arange(N))
+
+        x = np.hstack((x, np.ones((N, 1))))[qi]
+        mus = np.einsum('ndh,nh->nd', self._models_Ms[ci], x)
+        mu = np.add.reduceat(weights[:, None] * mus, starts)
+
+        if not variance:
+            return mu
+
+        c = weights * (1. + np.einsum('nd,nd->n', quadratic_features(x), self._models_quad[ci]))
+        var = np.add.reduceat(c[:, None, None] * self._models_sigmas[ci]
+                              + np.einsum('n,nd,nh->ndh', weights, mus, mus), starts)\
+              - np.einsum('nd,nh->ndh', mu, mu)
+
+        return mu, var
+
+    def predict_batch(self, x, variance=False):
+        # predictions for a (N, d) array of raw queries in one set of
+        # contractions, returns means and optionally covariances
+        if self._index is not None:
+            return self._predict_indexed(x, variance)
+
+        x = np.reshape(x, (-1, self._basis_lin.shape[-1]))
+        N, K = len(x), self.size
+
+        # weighted basis densities, see predictive_gating
+        weights = self._buffer('weights', (N, K))
+        np.matmul(quadratic_features(x), self._basis_quad.T, out=weights)
+        weights += x @ self._basis_lin.T
+        weights += self._basis_const
+        weights, _ = normalize_log_scores(weights)
 
-        x = np.squeeze(transform(np.atleast_2d(x), self.input_transform))
+        x = np.hstack((x, np.ones((N, 1))))
 
-        weights = self.predictive_gating(x)
-        mus = self.predictive_output(x)
+        mus = self._buffer('mus', (N, K, self.drow))
+        np.einsum('kdh,nh->nkd', self._models_Ms, x, out=mus)
+        mu = np.einsum('nk,nkd->nd', weights, mus)
+
+        if not variance:
+            return mu
+
+        # mixture of the component predictive covariances
+        c = self._buffer('c', (N, K))
+        np.matmul(quadratic_features(x), self._models_quad.T, out=c)
+        c += 1.
+        c *= weights
+
+        var = np.einsum('nk,kdh->ndh', c, self._models_sigmas)\
+              + np.einsum('nk,nkd,nkh->ndh', weights, mus, mus)\
+              - np.einsum('nd,nh->ndh', mu, mu)
+
+        return mu, var
+
+
+class TrajectoryPredictor:
+    # Stateful prediction of a compressed mixture along smooth
+    # trajectories. Consecutive queries activate almost the same
+    # components, so the active set of the last full scan is reused
+    # as long as the gating mass outside of it is bounded below tol,
+    # relative to the mass inside. The bound combines the Mahalanobis
+    # bounds of the mixture with the triangle inequality around the
+    # whitened input z0 of the last scan
+    #   |z - mu_k| >= |z0 - mu_k| - |z - z0|
+    # Active sets are chosen with a margin radius around z0, such that
+    # steps which stay within the radius rarely trigger a rescan
+
+    def __init__(self, mixture, tol=1e-6, radius=0.5):
+        self.mixture = mixture
 
-        output = np.einsum('nk,n->k', mus, weights)
-        return inverse_transform_mean(output, trans=self.target_transform)
+        self.tol = tol
+        self.radius = radius
+
+        self.reset()
+
+    def reset(self):
+        self.center = None
+        self.active = None
+
+        self.nb_steps = 0
+        self.nb_scans = 0
+        return self
+
+    def _scan(self, x, z):
+        # full evaluation of the gating, returns the
+        # exact log weights of the new active set
+        mixture = self.mixture
+
+        log_weights = mixture._log_weights(x[None, :])[0]
+        dists = np.linalg.norm(z - mixture.basis['mus'], axis=1)
+
+        # drop the components with the smallest bounds within the radius,
+        # as long as their summed mass stays below tol of the largest weight
+        slack = np.maximum(dists - self.radius, 0.)
+        bounds = mixture._basis_log_weights_max\
+                 - 0.5 * mixture._basis_lmbda_mins * np.square(slack)
+
+        order = np.argsort(bounds)
+        rest = np.logaddexp.accumulate(bounds[order])
+        nb_rest = np.searchsorted(rest, np.max(log_weights) + np.log(self.tol))
+
+        active = np.ones((self.mixture.size, ), dtype=bool)
+        active[order[:nb_rest]] = False
+
+        self.center = z
+        self.active = np.flatnonzero(active)
+
+        # bounds of the remaining components, relative to the center
+        self._rest_dists = dists[~active]
+        self._rest_log_weights_max = mixture._basis_log_weights_max[~active]
+        self._rest_lmbda_mins = mixture._basis_lmbda_mins[~active]
+
+        # compiled forms of the active components, see CompressedMixtureOfLinearGaussians
+        idx = self.active
+        self._basis_quad, self._basis_lin, self._basis_const =\
+            mixture._basis_quad[idx], mixture._basis_lin[idx], mixture._basis_const[idx]
+        self._models_Ms, self._models_sigmas, self._models_quad =\
+            mixture._models_Ms[idx], mixture._models_sigmas[idx], mixture._models_quad[idx]
+
+        self.nb_scans += 1
+        return log_weights[idx]
+
+    def _rest(self, z, lognorm):
+        # upper bound of the gating mass outside of the active set,
+        # relative to the mass exp(lognorm) inside of it
+        slack = np.maximum(self._rest_dists - np.linalg.norm(z - self.center), 0.)
+        return np.sum(np.exp(self._rest_log_weights_max - lognorm
+                             - 0.5 * self._rest_lmbda_mins * np.square(slack)))
+
+    @staticmethod
+    def _normalize(log_weights):
+        # returns the normalized weights and the log normalizer, the
+        # arrays are small, such that this is cheaper than logsumexp
+        lognorm = np.max(log_weights)
+        weights = np.exp(log_weights - lognorm)
+        norm = np.sum(weights)
+        return weights / norm, lognorm + np.log(norm)
+
+    def predict(self, x, variance=False):
+        # prediction of a single raw query, returns the
+        # mean and optionally the covariance in raw space
+        x = np.ravel(x)
+
+        W, b = self.mixture._input_affine
+        z = W @ x + b
+
+        weights = None
+        if self.center is not None:
+            log_weights = self._basis_quad @ quadratic_features(x)\
+                          + self._basis_lin @ x + self._basis_const
+            weights, lognorm = self._normalize(log_weights)
+            if self._rest(z, lognorm) > self.tol:
+                weights = None
+
+        if weights is None:
+            weights, _ = self._normalize(self._scan(x, z))
+
+        self.nb_steps += 1
+
+        x = np.append(x, 1.)
+        mus = self._models_Ms @ x
+        mu = weights @ mus
+
+        if not variance:
+            return mu
+
+        c = weights * (1. + self._models_quad @ quadratic_features(x))
+        var = np.einsum('k,kdh->dh', c, self._models_sigmas)\
+              + np.einsum('k,kd,kh->dh', weights, mus, mus)\
+              - np.outer(mu, mu)
+
+        return mu, var
@@ -2,7 +2,6 @@ import copy
 
 import numpy as np
 from scipy import special as special
-from scipy.special import logsumexp
 
 from mimo.abstraction import Distribution
 from mimo.mixtures.full import MixtureOfGaussians
@@ -11,7 +10,9 @@ from mimo.distributions.bayesian import CategoricalWithDirichlet
 from mimo.distributions.bayesian import CategoricalWithStickBreaking
 
 from mimo.util.decorate import pass_obs_arg, pass_obs_and_labels_arg
-from mimo.util.stats import sample_discrete_from_log
+from mimo.util.stats import sample_labels_from_log
+from mimo.util.stats import normalize_log_scores
+from mimo.util.data import nanmask
 from mimo.util.text import progprint_xrange
 
 from sklearn.decomposition import PCA
@@ -83,6 +84,8 @@ class BayesianMixtureOfTiedGaussians(Distribution):
 
         self.gaussians = self.ensemble.likelihood.components
 
+        # obs only holds the rows without nans,
+        # labels index these compacted rows, see add_data
         self.obs = []
         self.labels = []
 
@@ -117,6 +120,10 @@ class BayesianMixtureOfTiedGaussians(Distribution):
 
         obs = obs if isinstance(obs, list) else [obs]
 
+        # scan for missing values once and keep compacted copies
+        masks = [nanmask(_obs) for _obs in obs]
+        obs = [_obs[_mask] for _obs, _mask in zip(obs, masks)]
+
         if whiten:
             self.whitend = True
 
@@ -135,7 +142,7 @@ class BayesianMixtureOfTiedGaussians(Distribution):
             for _obs in obs:
                 self.obs.append(self.transform.transform(_obs))
         else:
-            self.obs = obs
+            self.obs.extend(obs)
 
         if labels_from_prior:
             for _obs in self.obs:
@@ -172,8 +179,8 @@ class BayesianMixtureOfTiedGaussians(Distribution):
         if isinstance(obs, list):
             return sum(self.log_likelihood(_obs) for _obs in obs)
         else:
-            scores = self.log_scores(obs)
-            return np.sum(logsumexp(scores[~np.isnan(obs).any(axis=1)], axis=1))
+            lognorms = normalize_log_scores(self.log_scores(obs))[1]
+            return np.sum(lognorms[~np.isnan(obs).any(axis=1)])
 
     def mean(self):
         raise NotImplementedError
@@ -187,24 +194,24 @@ class BayesianMixtureOfTiedGaussians(Distribution):
     def entropy(self):
         raise NotImplementedError
 
-    def log_scores(self, obs):
+    def log_scores(self, obs, clean=False):
         N, K = obs.shape[0], self.size
 
         # update, see Eq. 10.67 in Bishop
         component_scores = np.empty((N, K))
         for idx, g in enumerate(self.gaussians):
-            component_scores[:, idx] = g.log_likelihood(obs)
-        component_scores = np.nan_to_num(component_scores, copy=False)
+            component_scores[:, idx] = g.log_likelihood(obs, clean=clean)
+
+        # clean data has no missing values to be zeroed
+        if not clean:
+            component_scores = np.nan_to_num(component_scores, copy=False)
 
         gating_scores = self.gating.likelihood.log_likelihood(np.arange(K))
-        score = gating_scores + component_scores
-        return score
+        component_scores += gating_scores
+        return component_scores
 
-    def scores(self, obs):
-        logr = self.log_scores(obs)
-        score = np.exp(logr - np.max(logr, axis=1, keepdims=True))
-        score /= np.sum(score, axis=1, keepdims=True)
-        return score
+    def scores(self, obs, clean=False):
+        return normalize_log_scores(self.log_scores(obs, clean))[0]
 
     # Expectation-Maximization
     @pass_obs_arg
@@ -222,10 +229,11 @@ class BayesianMixtureOfTiedGaussians(Distribution):
                   position=pos, disable=not progprint) as pbar:
             for i in range(maxiter):
                 # Expectation step
-                scores = [self.scores(_obs) for _obs in obs]
+                scores = [self.scores(_obs, clean=True) for _obs in obs]
 
                 # Maximization step
-                self.ensemble.max_aposteriori(obs, scores)
+                stats = self.ensemble.likelihood.weighted_statistics(obs, scores, clean=True)
+                self.ensemble.max_aposteriori(obs, scores, stats=stats)
                 self.gating.max_aposteriori(None, scores)
 
                 pbar.update(1)
@@ -233,7 +241,7 @@ class BayesianMixtureOfTiedGaussians(Distribution):
     # Gibbs sampling
     @pass_obs_and_labels_arg
     def resample(self, obs=None, labels=None,
-                 maxiter=1, progprint=True):
+                 maxiter=1, progprint=True, rng=None):
 
         current = mp.current_process()
         if len(current._identity) > 0:
@@ -246,7 +254,7 @@ class BayesianMixtureOfTiedGaussians(Distribution):
             for _ in range(maxiter):
                 self._resample_ensemble(obs, labels)
                 self._resample_gating(labels)
-                labels = self._resample_labels(obs)
+                labels = self._resample_labels(obs, rng)
 
                 if self.has_data():
                     self.labels = labels
@@ -254,22 +262,24 @@ class BayesianMixtureOfTiedGaussians(Distribution):
                 pbar.update(1)
 
     def _resample_ensemble(self, obs, labels):
-        self.ensemble.resample(data=obs, labels=labels)
+        stats = self.ensemble.likelihood.statistics(obs, labels, clean=True)
+        self.ensemble.resample(data=obs, labels=labels, stats=stats)
 
     def _resample_gating(self, labels):
         self.gating.resample([_label for _label in labels])
 
-    def _resample_labels(self, obs):
+    def _resample_labels(self, obs, rng=None):
         labels = []
         for _obs in obs:
-            score = self.log_scores(_obs)
-            labels.append(sample_discrete_from_log(score, axis=1))
+            score = self.log_scores(_obs, clean=True)
+            labels.append(sample_labels_from_log(score, rng))
         return labels
 
     # Mean Field
-    def expected_scores(self, obs):
+    def expected_scores(self, obs, clean=False):
         component_scores = self.ensemble.posterior.expected_log_likelihood(obs)
-        component_scores = np.nan_to_num(component_scores, copy=False)
+        if not clean:
+            component_scores = np.nan_to_num(component_scores, copy=False)
 
         if isinstance(self.gating, CategoricalWithDirichlet):
             gating_scores = self.gating.posterior.expected_statistics()
@@ -279,12 +289,8 @@ class BayesianMixtureOfTiedGaussians(Distribution):
         else:
             raise NotImplementedError
 
-        logr = gating_scores + component_scores
-
-        r = np.exp(logr - np.max(logr, axis=1, keepdims=True))
-        r /= np.sum(r, axis=1, keepdims=True)
-
-        return r
+        component_scores += gating_scores
+        return normalize_log_scores(component_scores)[0]
 
     def meanfield_coordinate_descent(self, tol=1e-2, maxiter=250, progprint=True):
         elbo = []
@@ -322,7 +328,7 @@ class BayesianMixtureOfTiedGaussians(Distribution):
     def _meanfield_update_labels(self, obs):
         scores, labels = [], []
         for _obs in obs:
-            scores.append(self.expected_scores(_obs))
+            scores.append(self.expected_scores(_obs, clean=True))
             labels.append(np.argmax(scores[-1], axis=1))
         return scores, labels
 
@@ -334,7 +340,9 @@ class BayesianMixtureOfTiedGaussians(Distribution):
         self.gating.meanfield_update(None, scores)
 
     def _meanfield_update_ensemble(self, obs, scores):
-        self.ensemble.meanfield_update(obs, scores)
+        # obs is free of nans, the statistics skip the scans
+        stats = self.ensemble.likelihood.weighted_statistics(obs, scores, clean=True)
+        self.ensemble.meanfield_update(obs, scores, stats=stats)
 
     def _variational_lowerbound_labels(self, scores):
         vlb = 0.
@@ -347,9 +355,7 @@ class BayesianMixtureOfTiedGaussians(Distribution):
             E_log_stick, E_log_rest = self.gating.posterior.expected_log_likelihood()
             vlb += np.sum(scores * E_log_stick + cumscores * E_log_rest)
 
-        errs = np.seterr(invalid='ignore', divide='ignore')
-        vlb -= np.nansum(scores * np.log(scores))  # treats nans as zeros
-        np.seterr(**errs)
+        vlb += np.sum(special.entr(scores))
 
         return vlb
 
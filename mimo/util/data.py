@@ -1,15 +1,66 @@
 import numpy as np
+import numpy.random as npr
+
 from sklearn.decomposition import PCA
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 
-from itertools import islice
-import random
 
+def batches(batchsize, datasize, replace=False, rng=None):
+    # one shuffled epoch of minibatches covering the data,
+    # indices are sorted within a batch for contiguous gathers
+    rng = npr if rng is None else rng
+    if replace:
+        idx = rng.choice(datasize, size=datasize, replace=True)
+    else:
+        idx = rng.permutation(datasize)
+
+    for i in range(0, datasize, batchsize):
+        yield np.sort(idx[i:i + batchsize])
+
+
+def minibatches(batchsize, datasizes, weights=None, replace=False, rng=None):
+    # one epoch of minibatches over a list of datasets, yields
+    # the dataset index, the batch indices and the inclusion
+    # probability of a row, used to rescale batch statistics
+    rng = npr if rng is None else rng
+    datasizes = np.asarray(datasizes)
+
+    def _stream(size):
+        while True:
+            yield from batches(batchsize, size, replace, rng)
+
+    nb_batches = np.ceil(datasizes / batchsize).astype(int)
+    if weights is None:
+        # visit every batch of every dataset exactly once
+        weights = datasizes / np.sum(datasizes)
+        order = rng.permutation(np.repeat(np.arange(len(datasizes)), nb_batches))
+    else:
+        # datasets are drawn according to their weights
+        weights = np.asarray(weights) / np.sum(weights)
+        order = rng.choice(len(datasizes), size=np.sum(nb_batches), p=weights)
+
+    streams = [_stream(size) for size in datasizes]
+    for n in map(int, order):
+        idx = next(streams[n])
+        yield n, idx, float(len(idx) * weights[n] / datasizes[n])
+
+
+class BufferMixin:
+    # named work arrays, reused across calls. Holders keep a
+    # _buffers dict, which is dropped on pickling and copying
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffers'] = {}
+        return state
 
-def batches(batchsize, datasize):
-    idx_all = random.sample(range(datasize), batchsize)
-    idx_iter = iter(idx_all)
-    yield from iter(lambda: list(islice(idx_iter, batchsize)), [])
+    def _buffer(self, name, shape):
+        # buffers only grow, smaller requests get the leading rows,
+        # such that short final batches do not reallocate
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape[0] < shape[0] or buf.shape[1:] != shape[1:]:
+            buf = self._buffers[name] = np.empty(shape)
+        return buf[:shape[0]]
 
 
 def transform(mu, trans=None):
@@ -30,17 +81,84 @@ def inverse_transform_variance(var, trans):
     if trans is None:
         return var
     else:
-        mat = None
-        if isinstance(trans, PCA):
-            mat = np.sqrt(trans.explained_variance_[:, None]) * trans.components_
-        elif isinstance(trans, StandardScaler):
-            mat = np.diag(np.sqrt(trans.var_))
-        elif isinstance(trans, MinMaxScaler):
-            mat = np.diag(trans.scale_)
-
+        mat, _ = inverse_affine_transform(trans)
         return np.einsum('kh,...hj,ji->...ki', mat, var, mat.T)
 
 
+def affine_transform(trans, dim=None):
+    # returns (mat, vec) such that
+    # trans.transform(x) = x @ mat.T + vec
+    if trans is None:
+        return np.eye(dim), np.zeros((dim, ))
+    elif isinstance(trans, PCA):
+        mat = trans.components_
+        if trans.whiten:
+            mat = mat / np.sqrt(trans.explained_variance_[:, None])
+        return mat, - mat @ trans.mean_
+    elif isinstance(trans, StandardScaler):
+        dim = trans.n_features_in_
+        mean = trans.mean_ if trans.with_mean else np.zeros((dim, ))
+        scale = trans.scale_ if trans.with_std else np.ones((dim, ))
+        return np.diag(1. / scale), - mean / scale
+    elif isinstance(trans, MinMaxScaler):
+        return np.diag(trans.scale_), trans.min_
+    else:
+        raise NotImplementedError
+
+
+def inverse_affine_transform(trans, dim=None):
+    # returns (mat, vec) such that
+    # trans.inverse_transform(x) = x @ mat.T + vec
+    if trans is None:
+        return np.eye(dim), np.zeros((dim, ))
+    elif isinstance(trans, PCA):
+        mat = trans.components_.T
+        if trans.whiten:
+            mat = mat * np.sqrt(trans.explained_variance_)
+        return mat, trans.mean_
+    elif isinstance(trans, StandardScaler):
+        dim = trans.n_features_in_
+        mean = trans.mean_ if trans.with_mean else np.zeros((dim, ))
+        scale = trans.scale_ if trans.with_std else np.ones((dim, ))
+        return np.diag(scale), mean
+    elif isinstance(trans, MinMaxScaler):
+        return np.diag(1. / trans.scale_), - trans.min_ / trans.scale_
+    else:
+        raise NotImplementedError
+
+
+def save_arrays(path, arrays, header):
+    # directory of flat .npy files and a json header. Unlike .npz
+    # archives, single .npy files can be memory-mapped on load
+    import os
+    import json
+
+    os.makedirs(path, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(os.path.join(path, name + '.npy'),
+                np.ascontiguousarray(arr), allow_pickle=False)
+
+    # header goes last, such that partial writes fail to load
+    header = dict(header, arrays=sorted(arrays))
+    with open(os.path.join(path, 'header.json'), 'w') as f:
+        json.dump(header, f, indent=4)
+
+
+def load_arrays(path, mmap_mode='r'):
+    # returns the header and the arrays of save_arrays. Read-only maps
+    # are shared by all processes that load the same files
+    import os
+    import json
+
+    with open(os.path.join(path, 'header.json'), 'r') as f:
+        header = json.load(f)
+
+    arrays = {name: np.load(os.path.join(path, name + '.npy'),
+                            mmap_mode=mmap_mode, allow_pickle=False)
+              for name in header['arrays']}
+    return header, arrays
+
+
 def inverse_transform(mu, var, trans=None):
     _mu = inverse_transform_mean(mu, trans)
     _var = inverse_transform_variance(var, trans)
@@ -75,6 +193,30 @@ def atleast2d(data):
     return data
 
 
+def nanmask(*args):
+    # rows without missing values across all arrays
+    return np.logical_and.reduce([~np.isnan(atleast2d(_arg)).any(axis=1)
+                                  for _arg in args])
+
+
+def dropnans(*args):
+    # drops the rows with missing values from aligned arrays,
+    # arrays without missing values are returned as they are
+    mask = nanmask(*args)
+    if np.all(mask):
+        return args
+    return tuple(_arg[mask] for _arg in args)
+
+
+def groupby(labels, size, *args):
+    # sorts the rows of all arrays by label in one pass,
+    # returns per array a list of contiguous blocks (views)
+    # such that blocks[k] holds all rows with label k
+    perm = np.argsort(labels, kind='stable')
+    bounds = np.cumsum(np.bincount(labels, minlength=size))[:-1]
+    return [np.split(_arg[perm], bounds) for _arg in args]
+
+
 def gi(data):
     out = (np.isnan(atleast2d(data)).sum(1) == 0).ravel()
     return out if len(out) != 0 else None
@@ -1,3 +1,12 @@
+import functools
+
+from mimo.util.data import dropnans
+
+
+# Stored data is free of nans, see add_data of the mixtures.
+# Data passed by the caller is compacted to the rows without
+# nans instead, such that labels and scores index those rows
+
 def pass_obs_arg(f):
     def wrapper(self, obs=None, **kwargs):
         if obs is None:
@@ -5,6 +14,7 @@ def pass_obs_arg(f):
             obs = [_obs for _obs in self.obs]
         else:
             obs = obs if isinstance(obs, list) else [obs]
+            obs = [dropnans(_obs)[0] for _obs in obs]
 
         return f(self, obs, **kwargs)
     return wrapper
@@ -21,6 +31,9 @@ def pass_obs_and_labels_arg(f):
             labels = [self.gating.likelihood.rvs(len(_obs)) for _obs in obs]\
                 if labels is None else labels
 
+            data = [dropnans(_obs, _label) for _obs, _label in zip(obs, labels)]
+            obs, labels = [_d[0] for _d in data], [_d[1] for _d in data]
+
         return f(self, obs, labels, **kwargs)
     return wrapper
 
@@ -35,6 +48,9 @@ def pass_target_and_input_arg(f):
             y = y if isinstance(y, list) else [y]
             x = x if isinstance(x, list) else [x]
 
+            data = [dropnans(_y, _x) for _y, _x in zip(y, x)]
+            y, x = [_d[0] for _d in data], [_d[1] for _d in data]
+
         return f(self, y, x, **kwargs)
     return wrapper
 
@@ -52,5 +68,21 @@ def pass_target_input_and_labels_arg(f):
             z = [self.gating.likelihood.rvs(len(_y)) for _y in y]\
                 if z is None else z
 
+            data = [dropnans(_y, _x, _z) for _y, _x, _z in zip(y, x, z)]
+            y, x, z = [_d[0] for _d in data], [_d[1] for _d in data], [_d[2] for _d in data]
+
         return f(self, y, x, z, **kwargs)
     return wrapper
+
+
+def cached_by_version(f):
+    # memoise derived quantities of a distribution,
+    # recomputed once its version has been bumped
+    @functools.wraps(f)
+    def wrapper(self, *args):
+        cache = self.__dict__.setdefault('_cache', {})
+        key = (f.__name__, ) + args
+        if key not in cache or cache[key][0] != self.version:
+            cache[key] = (self.version, f(self, *args))
+        return cache[key][1]
+    return wrapper
@@ -1,6 +1,8 @@
 import numpy as np
 from scipy.linalg import lapack as lapack
 
+from functools import lru_cache
+
 
 def ispd(B):
     try:
@@ -46,9 +48,50 @@ def invpd(A, return_chol=False):
         return Ainv
 
 
+def invpds(A):
+    # stacked version of invpd
+    L = np.linalg.cholesky(A)
+    Linv = np.linalg.solve(L, np.broadcast_to(np.eye(A.shape[-1]), A.shape))
+    return np.swapaxes(Linv, -1, -2) @ Linv
+
+
 def blockarray(*args, **kwargs):
     return np.array(np.bmat(*args, **kwargs), copy=False)
 
 
 def symmetrize(A):
     return (A + A.T) / 2.
+
+
+@lru_cache(maxsize=None)
+def _triu_indices(dim):
+    # shared by the packings below, which run once per query on
+    # the prediction paths, read-only such that they can be cached
+    iu = np.triu_indices(dim)
+    for _i in iu:
+        _i.flags.writeable = False
+    return iu
+
+
+def quadratic_features(x):
+    # upper-triangular outer products, such that
+    # quadratic_features(x) @ quadratic_weights(A).T == x^T A x
+    iu = _triu_indices(x.shape[-1])
+    return x[..., iu[0]] * x[..., iu[1]]
+
+
+def quadratic_weights(A):
+    # accepts stacked symmetric matrices
+    iu = _triu_indices(A.shape[-1])
+    scale = np.where(iu[0] == iu[1], 1., 2.)
+    return A[..., iu[0], iu[1]] * scale
+
+
+def triu_to_symmetric(v, dim):
+    # inverse of the upper-triangular packing
+    # in quadratic_features, accepts stacked vectors
+    iu = _triu_indices(dim)
+    A = np.zeros(v.shape[:-1] + (dim, dim))
+    A[..., iu[0], iu[1]] = v
+    A[..., iu[1], iu[0]] = v
+    return A
@@ -2,6 +2,7 @@ import numpy as np
 from numpy import random as npr
 
 import scipy as sc
+import scipy.sparse
 from scipy.special import logsumexp
 
 
@@ -21,6 +22,71 @@ def sample_discrete_from_log(p_log, return_lognorms=False, axis=0, dtype=np.int3
         return samples
 
 
+def sample_labels_from_log(scores, rng=None, blocksize=None, dtype=np.int32):
+    # samples one label per row of an (N, K) array of unnormalized
+    # log probabilities by inverse cdf, works in place and
+    # overwrites the scores with their cumulative sums
+    rng = npr if rng is None else rng
+    N, K = scores.shape
+
+    # blocks of rows of about 256kB stay in cache
+    blocksize = max(1, 32768 // K) if blocksize is None else blocksize
+
+    labels = np.empty((N, ), dtype=dtype)
+    for i in range(0, N, blocksize):
+        block = scores[i:i + blocksize]
+        block -= np.max(block, axis=1, keepdims=True)
+        np.exp(block, out=block)
+        np.cumsum(block, axis=1, out=block)
+
+        u = rng.random(len(block)) * block[:, -1]
+        labels[i:i + blocksize] = np.count_nonzero(u[:, None] > block, axis=1)
+    return labels
+
+
+def normalize_log_scores(logr):
+    # in place softmax over the rows of (N, K) log scores,
+    # returns the responsibilities, held in the same buffer,
+    # and the per-row log-normalizers
+    lognorms = np.max(logr, axis=1)
+    logr -= lognorms[:, None]
+    np.exp(logr, out=logr)
+
+    norms = np.sum(logr, axis=1)
+    logr /= norms[:, None]
+    lognorms += np.log(norms)
+    return logr, lognorms
+
+
+def truncate_responsibilities(r, topk=None, threshold=None):
+    # sparse (csr) responsibilities keeping only the topk entries
+    # and/or those above threshold per row, renormalized to one.
+    # The row maximum is always kept. Dropped mass is at most
+    # (K - topk) * r_k-th or K * threshold per row, which biases the
+    # statistics towards the dominant components, while the cost of
+    # statistics and bounds scales with the kept entries, not N * K.
+    N, K = r.shape
+    topk = K if topk is None else min(topk, K)
+
+    if topk < K:
+        idx = np.argpartition(-r, topk - 1, axis=1)[:, :topk]
+    else:
+        idx = np.broadcast_to(np.arange(K), (N, K))
+    vals = np.take_along_axis(r, idx, axis=1)
+
+    if threshold is not None:
+        keep = vals >= np.minimum(threshold, np.max(vals, axis=1, keepdims=True))
+        vals = np.where(keep, vals, 0.)
+
+    vals /= np.sum(vals, axis=1, keepdims=True)
+
+    indptr = np.arange(0, N * topk + 1, topk)
+    res = sc.sparse.csr_matrix((vals.ravel(), idx.ravel(), indptr), shape=(N, K))
+    res.eliminate_zeros()
+    res.sort_indices()
+    return res
+
+
 def multivariate_gaussian_loglik(xs, mu, lmbda, logdet_lmbda=None):
     # Accepts vectorized parameters
     d = mu.shape[-1]
@@ -0,0 +1,94 @@
+import pickle
+
+import numpy as np
+import numpy.random as npr
+
+import pytest
+
+from mimo.distributions import NormalWishart, MatrixNormalWishart
+from mimo.distributions import GaussianWithNormalWishart
+from mimo.distributions import LinearGaussianWithMatrixNormalWishart
+from mimo.distributions import StickBreaking, CategoricalWithStickBreaking
+
+from mimo.mixtures import BayesianMixtureOfLinearGaussians
+from mimo.mixtures.linear import CompressedMixtureOfLinearGaussians
+
+
+@pytest.fixture(scope='module')
+def mixture():
+    npr.seed(0)
+    x = npr.uniform(-3., 3., (400, 2))
+    y = np.hstack((np.sin(x[:, :1]), np.cos(x[:, 1:]))) + 0.05 * npr.randn(400, 2)
+
+    K = 20
+    basis = [GaussianWithNormalWishart(NormalWishart(mu=np.zeros(2), kappa=1e-2,
+                                                     psi=np.eye(2), nu=3))
+             for _ in range(K)]
+    models = [LinearGaussianWithMatrixNormalWishart(
+              MatrixNormalWishart(M=np.zeros((2, 3)), K=1e-2 * np.eye(3), psi=np.eye(2), nu=3))
+              for _ in range(K)]
+    gating = CategoricalWithStickBreaking(StickBreaking(K=K, gammas=np.ones(K),
+                                                       deltas=5. * np.ones(K)))
+
+    mixture = BayesianMixtureOfLinearGaussians(gating=gating, basis=basis,
+                                               models=models, nb_workers=1)
+    mixture.add_data(y, x, whiten=True)
+    mixture.resample(maxiter=10, progprint=False)
+    mixture.meanfield_coordinate_descent(maxiter=10, progprint=False)
+    return mixture
+
+
+def test_compressed_prediction(mixture):
+    x = npr.uniform(-3., 3., (50, 2))
+    compressed = CompressedMixtureOfLinearGaussians(mixture)
+
+    mu, var = compressed.predict_batch(x, variance=True)
+    _mu, _var, _ = mixture.meanfield_prediction(x, variance='full')
+    assert np.allclose(mu, _mu) and np.allclose(var, _var)
+
+    # one query at a time
+    assert np.allclose(np.vstack([compressed.prediction(_x) for _x in x]), mu)
+
+
+def test_compressed_index(mixture):
+    x = npr.uniform(-3., 3., (50, 2))
+    compressed = CompressedMixtureOfLinearGaussians(mixture)
+
+    mu, var = compressed.predict_batch(x, variance=True)
+    _mu, _var = compressed.build_index(tol=1e-8).predict_batch(x, variance=True)
+    assert np.allclose(mu, _mu, atol=1e-6) and np.allclose(var, _var, atol=1e-6)
+
+    # dropped pairs carry at most tol of the normalized weight
+    qi, ci, weights = compressed.active_components(x)
+    assert len(qi) < len(x) * compressed.size
+    dense = compressed.clear_index()._log_weights(x)
+    dense = np.exp(dense - np.max(dense, axis=1, keepdims=True))
+    dense /= np.sum(dense, axis=1, keepdims=True)
+    mask = np.ones(dense.shape, dtype=bool)
+    mask[qi, ci] = False
+    assert np.all(dense[mask] < 1e-8)
+
+
+def test_compressed_save_load(mixture, tmp_path):
+    x = npr.uniform(-3., 3., (50, 2))
+    compressed = CompressedMixtureOfLinearGaussians(mixture)
+    compressed.save(str(tmp_path / 'mixture'))
+
+    loaded = CompressedMixtureOfLinearGaussians.load(str(tmp_path / 'mixture'))
+    for _x, _y in zip(compressed.predict_batch(x, variance=True),
+                      loaded.predict_batch(x, variance=True)):
+        assert np.allclose(_x, _y)
+
+    assert not loaded._basis_quad.flags.writeable
+    assert np.allclose(loaded.posteriors['basis_mus'],
+                       np.stack([b.posterior.mu for b in mixture.basis]))
+
+    # loaded mixtures pickle without their maps
+    loaded = pickle.loads(pickle.dumps(loaded))
+    assert np.allclose(loaded.prediction(x[0]), compressed.prediction(x[0]))
+
+    with open(str(tmp_path / 'mixture' / 'header.json'), 'r+') as f:
+        header = f.read().replace('"version": 1', '"version": 99')
+        f.seek(0), f.write(header), f.truncate()
+    with pytest.raises(ValueError):
+        CompressedMixtureOfLinearGaussians.load(str(tmp_path / 'mixture'))
@@ -0,0 +1,192 @@
+import copy
+
+import numpy as np
+import numpy.random as npr
+
+from scipy.special import logsumexp
+
+from mimo.distributions import NormalGamma, NormalWishart, MatrixNormalWishart, Gamma
+from mimo.distributions import GaussianWithNormalGamma, GaussianWithNormalWishart
+from mimo.distributions import LinearGaussianWithMatrixNormalWishart
+from mimo.distributions import LinearGaussianWithMatrixNormalWishartAndAutomaticRelevance
+from mimo.distributions import Dirichlet, CategoricalWithDirichlet
+
+from mimo.mixtures import BayesianMixtureOfGaussians
+from mimo.mixtures import BayesianMixtureOfLinearGaussians
+
+
+def _reference_prediction(mixture, x, y):
+    # per-component predictive gaussians, inverted query by query
+    log_weights = np.stack([b.log_posterior_predictive_gaussian(x)
+                            for b in mixture.basis], axis=1)
+    log_weights += np.log(mixture.gating.posterior.mean())
+    log_weights -= logsumexp(log_weights, axis=1, keepdims=True)
+    weights = np.exp(log_weights)
+
+    mus, vars, lpd = [], [], []
+    for m in mixture.models:
+        _mus, _lmbdas = m.posterior_predictive_gaussian(x)
+        mus.append(_mus)
+        vars.append(np.linalg.inv(_lmbdas))
+        lpd.append(m.log_posterior_predictive_gaussian(y, x))
+    mus, vars, lpd = np.stack(mus, axis=2), np.stack(vars, axis=3), np.stack(lpd, axis=1)
+
+    mu = np.einsum('nkl,nl->nk', mus, weights)
+    var = np.einsum('nkhl,nl->nkh', vars, weights)\
+          + np.einsum('nkl,nhl,nl->nkh', mus, mus, weights)\
+          - np.einsum('nk,nh->nkh', mu, mu)
+    nlpd = - logsumexp(lpd + log_weights, axis=1)
+    return mu, var, nlpd
+
+
+def _data(N=200):
+    x = npr.uniform(-2., 2., (N, 2))
+    y = np.hstack((np.sin(x[:, :1]), np.cos(x[:, 1:]))) + 0.05 * npr.randn(N, 2)
+    return x, y
+
+
+def _mixture(K=6, affine=True):
+    dcol = 3 if affine else 2
+    basis = [GaussianWithNormalWishart(NormalWishart(mu=npr.randn(2), kappa=1e-2,
+                                                     psi=np.eye(2), nu=3))
+             for _ in range(K)]
+    models = [LinearGaussianWithMatrixNormalWishart(
+              MatrixNormalWishart(M=np.zeros((2, dcol)), K=1e-2 * np.eye(dcol), psi=np.eye(2), nu=3),
+              affine=affine) for _ in range(K)]
+    gating = CategoricalWithDirichlet(Dirichlet(K=K, alphas=np.ones(K)))
+    return BayesianMixtureOfLinearGaussians(gating=gating, basis=basis,
+                                            models=models, nb_workers=1)
+
+
+class _Basis(GaussianWithNormalWishart):
+    # same updates, but not stackable
+    pass
+
+
+def _unstacked(mixture):
+    # a copy that takes the per-component reference paths
+    mixture = copy.deepcopy(mixture)
+    components = mixture.basis if hasattr(mixture, 'basis') else mixture.components
+    for c in components:
+        c.__class__ = _Basis
+    assert mixture.bank is None
+    return mixture
+
+
+def _same_posteriors(dists, _dists):
+    return all(np.allclose(p, _p) for d, _d in zip(dists, _dists)
+               for p, _p in zip(d.posterior.params, _d.posterior.params))
+
+
+def test_bank_updates_match_components():
+    npr.seed(1)
+    x, y = _data()
+
+    mixture = _mixture()
+    mixture.add_data(y, x)
+    mixture.resample(maxiter=2, progprint=False)
+    assert mixture.bank is not None
+
+    reference = _unstacked(mixture)
+    scores, _ = mixture._meanfield_update_labels(mixture.target, mixture.input)
+    for m in (mixture, reference):
+        m._resample_components(m.target, m.input, m.labels)
+        m._meanfield_update_components(m.target, m.input, scores)
+        m._meanfield_sgdstep_components(m.target, m.input, scores, 0.5, 0.3)
+
+    assert _same_posteriors(mixture.basis, reference.basis)
+    assert _same_posteriors(mixture.models, reference.models)
+
+
+def test_mixture_of_gaussians_bank_updates_match_components():
+    npr.seed(2)
+    x, _ = _data()
+
+    components = [GaussianWithNormalWishart(NormalWishart(mu=npr.randn(2), kappa=1e-2,
+                                                          psi=np.eye(2), nu=3))
+                  for _ in range(5)]
+    gating = CategoricalWithDirichlet(Dirichlet(K=5, alphas=np.ones(5)))
+    mixture = BayesianMixtureOfGaussians(gating=gating, components=components)
+    mixture.add_data(x)
+    assert mixture.bank is not None
+
+    reference = _unstacked(mixture)
+    scores, _ = mixture._meanfield_update_labels(mixture.obs)
+    for m in (mixture, reference):
+        m._resample_components(m.obs, m.labels)
+        m._meanfield_update_components(m.obs, scores)
+        m._meanfield_sgdstep_components(m.obs, scores, 0.5, 0.3)
+
+    assert _same_posteriors(mixture.components, reference.components)
+
+
+def test_chunked_meanfield_prediction():
+    npr.seed(3)
+    x, y = _data()
+
+    mixture = _mixture()
+    mixture.add_data(y, x, whiten=True)
+    mixture.meanfield_coordinate_descent(maxiter=3, progprint=False)
+
+    mu, var, std, nlpd = mixture.meanfield_prediction(x[:50], y[:50], variance='full')
+
+    # blocks of a few queries, against the per-component reference
+    _mu, _var, _, _nlpd = mixture.meanfield_prediction(x[:50], y[:50], variance='full',
+                                                       budget=8 * 6 * 15 * 4)
+    assert np.allclose(mu, _mu) and np.allclose(var, _var) and np.allclose(nlpd, _nlpd)
+
+    from mimo.util.data import transform, inverse_transform
+    _mu, _var, _nlpd = _reference_prediction(mixture, transform(x[:50], mixture.input_transform),
+                                             transform(y[:50], mixture.target_transform))
+    _mu, _var = inverse_transform(_mu, _var, mixture.target_transform)
+    assert np.allclose(mu, _mu) and np.allclose(var, _var)
+
+
+def test_indexed_meanfield_prediction():
+    npr.seed(4)
+    x, y = _data()
+
+    mixture = _mixture(K=12)
+    mixture.add_data(y, x, whiten=True)
+    mixture.resample(maxiter=10, progprint=False)
+    mixture.meanfield_coordinate_descent(maxiter=10, progprint=False)
+
+    mu, var, _, nlpd = mixture.meanfield_prediction(x[:50], y[:50], variance='full')
+    _mu, _var, _, _nlpd = mixture.meanfield_prediction(x[:50], y[:50], variance='full', tol=1e-8)
+    assert np.allclose(mu, _mu, atol=1e-6) and np.allclose(var, _var, atol=1e-6)
+    assert np.allclose(nlpd, _nlpd, atol=1e-6)
+
+
+def _ard_mixture(K=6, affine=True):
+    dcol = 3 if affine else 2
+    basis = [GaussianWithNormalGamma(NormalGamma(mu=npr.randn(2), kappas=1e-2 * np.ones(2),
+                                                 alphas=np.ones(2), betas=0.05 * np.ones(2)))
+             for _ in range(K)]
+    models = [LinearGaussianWithMatrixNormalWishartAndAutomaticRelevance(
+              MatrixNormalWishart(M=np.zeros((2, dcol)), K=np.eye(dcol), psi=np.eye(2), nu=3),
+              Gamma(alphas=2. * np.ones(dcol), betas=1e-2 * np.ones(dcol)), affine=affine)
+              for _ in range(K)]
+    gating = CategoricalWithDirichlet(Dirichlet(K=K, alphas=np.ones(K)))
+    return BayesianMixtureOfLinearGaussians(gating=gating, basis=basis,
+                                            models=models, nb_workers=1)
+
+
+def test_ard_meanfield_prediction():
+    npr.seed(0)
+    x, y = _data()
+
+    mixture = _ard_mixture()
+    mixture.add_data(y, x)
+    mixture.resample(maxiter=2, progprint=False)
+    mixture.meanfield_coordinate_descent(maxiter=2, progprint=False)
+
+    mu, var, std, nlpd = mixture.meanfield_prediction(x[:50], y[:50], variance='full')
+    _mu, _var, _nlpd = _reference_prediction(mixture, x[:50], y[:50])
+
+    assert np.allclose(mu, _mu)
+    assert np.allclose(var, _var)
+    assert np.allclose(nlpd, _nlpd)
+
+    aleatoric = mixture.meanfield_predictive_aleatoric()
+    assert aleatoric.shape == (2, 2)
+    assert np.all(np.linalg.eigvalsh(aleatoric) > 0.)
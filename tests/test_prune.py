@@ -0,0 +1,63 @@
+import numpy as np
+
+from mimo.distributions import Dirichlet, StickBreaking
+from mimo.distributions import CategoricalWithDirichlet
+from mimo.distributions import CategoricalWithStickBreaking
+
+
+def test_dirichlet_prune_shared_prior_posterior():
+    gating = CategoricalWithDirichlet(Dirichlet(K=12, alphas=np.arange(1., 13.)))
+    gating.prior = gating.posterior
+
+    keep = np.array([0, 3, 5, 11])
+    gating.prune(keep)
+
+    assert gating.prior is gating.posterior
+    assert np.allclose(gating.posterior.alphas, keep + 1.)
+    assert gating.likelihood.K == len(keep)
+
+
+def test_dirichlet_prune_separate_prior_posterior():
+    gating = CategoricalWithDirichlet(Dirichlet(K=12, alphas=np.ones(12)))
+    gating.posterior.alphas = np.arange(1., 13.)
+
+    keep = np.array([1, 2, 11])
+    gating.prune(keep)
+
+    assert np.allclose(gating.prior.alphas, np.ones(3))
+    assert np.allclose(gating.posterior.alphas, keep + 1.)
+
+
+def test_stickbreaking_prune_shared_prior_posterior():
+    gating = CategoricalWithStickBreaking(StickBreaking(K=12, gammas=np.arange(1., 13.),
+                                                        deltas=np.arange(13., 25.)))
+    gating.prior = gating.posterior
+
+    weights = gating.posterior.mean()
+    scales = gating.posterior.gammas + gating.posterior.deltas
+
+    keep = np.array([0, 3, 5, 11])
+    gating.prune(keep)
+
+    # the sticks are renormalized over the kept components
+    assert gating.prior is gating.posterior
+    assert np.allclose(gating.posterior.mean(), weights[keep] / np.sum(weights[keep]))
+    assert np.allclose(gating.posterior.gammas + gating.posterior.deltas, scales[keep])
+    assert np.all(gating.posterior.deltas > 0.)
+    assert gating.likelihood.K == len(keep)
+
+
+def test_stickbreaking_prune_separate_prior_posterior():
+    gating = CategoricalWithStickBreaking(StickBreaking(K=6, gammas=np.ones(6),
+                                                        deltas=5. * np.ones(6)))
+    counts = np.array([4., 0., 7., 1., 0., 2.])
+    gating.posterior.gammas = gating.prior.gammas + counts
+    gating.posterior.deltas = gating.prior.deltas + np.hstack((np.cumsum(counts[::-1])[-2::-1], 0))
+
+    keep = np.array([0, 2, 5])
+    gating.prune(keep)
+
+    # the posterior is rebuilt from the counts of the kept components
+    assert np.allclose(gating.prior.gammas, np.ones(3))
+    assert np.allclose(gating.posterior.gammas, 1. + counts[keep])
+    assert np.allclose(gating.posterior.deltas, 5. + np.array([9., 2., 0.]))
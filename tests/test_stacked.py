@@ -0,0 +1,137 @@
+import numpy as np
+import numpy.random as npr
+
+from mimo.abstraction import Statistics as Stats
+
+from mimo.distributions import NormalWishart, MatrixNormalWishart
+from mimo.distributions import GaussianWithNormalWishart
+from mimo.distributions import LinearGaussianWithMatrixNormalWishart
+from mimo.distributions import StackedNormalWisharts, StackedMatrixNormalWisharts
+
+
+def _pd(dim):
+    A = npr.randn(dim, dim)
+    return A @ A.T + dim * np.eye(dim)
+
+
+def _normal_wisharts(K, dim=2):
+    return [NormalWishart(mu=npr.randn(dim), kappa=npr.uniform(0.5, 5.),
+                          psi=_pd(dim) / 10., nu=dim + 1. + npr.uniform(1., 10.))
+            for _ in range(K)]
+
+
+def _matrix_normal_wisharts(K, drow=2, dcol=3):
+    return [MatrixNormalWishart(M=npr.randn(drow, dcol), K=_pd(dcol),
+                                psi=_pd(drow) / 10., nu=drow + 1. + npr.uniform(1., 10.))
+            for _ in range(K)]
+
+
+def _allclose(stats, _stats):
+    return all(np.allclose(s, _s) for s, _s in zip(stats, _stats))
+
+
+def test_normal_wishart_bank():
+    npr.seed(0)
+    dists = _normal_wisharts(5)
+    bank = StackedNormalWisharts(dists)
+
+    x = npr.randn(30, 2)
+    components = [GaussianWithNormalWishart(d) for d in dists]
+    for c, d in zip(components, dists):
+        c.posterior = d
+
+    assert np.allclose(bank.expected_log_likelihood(x),
+                       np.stack([d.expected_log_likelihood(x) for d in dists], axis=1))
+    assert np.allclose(bank.log_posterior_predictive(x, 'gaussian'),
+                       np.stack([c.log_posterior_predictive_gaussian(x) for c in components], axis=1))
+    assert np.allclose(bank.log_posterior_predictive(x, 'studentt'),
+                       np.stack([c.log_posterior_predictive_studentt(x) for c in components], axis=1))
+
+    weights = npr.rand(30, 5)
+    for k, stats in enumerate(bank.weighted_statistics([x, x[:10]], [weights, weights[:10]])):
+        _stats = components[k].likelihood.weighted_statistics([x, x[:10]],
+                                                              [weights[:, k], weights[:10, k]])
+        assert _allclose(stats, _stats)
+
+
+def test_matrix_normal_wishart_bank():
+    npr.seed(1)
+    dists = _matrix_normal_wisharts(4)
+    bank = StackedMatrixNormalWisharts(dists, affine=True)
+
+    x, y = npr.randn(30, 2), npr.randn(30, 2)
+    models = [LinearGaussianWithMatrixNormalWishart(d, affine=True) for d in dists]
+    for m, d in zip(models, dists):
+        m.posterior = d
+
+    assert np.allclose(bank.expected_log_likelihood(y, x),
+                       np.stack([d.expected_log_likelihood(y, x, True) for d in dists], axis=1))
+    assert np.allclose(bank.log_posterior_predictive(y, x, 'gaussian'),
+                       np.stack([m.log_posterior_predictive_gaussian(y, x) for m in models], axis=1))
+
+    mus, vars = bank.posterior_predictive_moments(x)
+    for k, m in enumerate(models):
+        _mus, _lmbdas = m.posterior_predictive_gaussian(x)
+        assert np.allclose(mus[..., k], _mus)
+        assert np.allclose(vars[..., k], np.linalg.inv(_lmbdas))
+
+    weights = npr.rand(30, 4)
+    for k, stats in enumerate(bank.weighted_statistics(y, x, weights)):
+        assert _allclose(stats, models[k].likelihood.weighted_statistics(y, x, weights[:, k]))
+
+
+def test_bank_converts_pending_natural_parameters():
+    npr.seed(2)
+    dists = _normal_wisharts(3) + _matrix_normal_wisharts(3)
+    targets = _normal_wisharts(3) + _matrix_normal_wisharts(3)
+    for d, t in zip(dists, targets):
+        d.nat_param = t.nat_param
+
+    banks = StackedNormalWisharts(dists[:3]), StackedMatrixNormalWisharts(dists[3:])
+    assert not any(d.pending for d in dists)
+    for d, t in zip(dists, targets):
+        assert _allclose(d.params, t.params)
+    assert not any(bank.stale for bank in banks)
+
+    dists[0].mu = dists[0].mu + 1.
+    assert banks[0].stale
+    assert np.allclose(banks[0].refresh().mus[0], dists[0].mu)
+
+
+def test_batched_rvs_moments():
+    npr.seed(3)
+    nb_samples = 5000
+
+    dists = _normal_wisharts(3)
+    bank = StackedNormalWisharts(dists)
+    mus, lmbdas = map(np.stack, zip(*[bank.rvs() for _ in range(nb_samples)]))
+    for k, d in enumerate(dists):
+        assert np.allclose(lmbdas[:, k].mean(axis=0), d.nu * d.psi, rtol=0.1, atol=0.05)
+        assert np.allclose(mus[:, k].mean(axis=0), d.mu, atol=0.05)
+        # mu | lmbda ~ N(mu, (kappa * lmbda)^-1), marginally E[(kappa * lmbda)^-1]
+        assert np.allclose(np.cov(mus[:, k].T), np.linalg.inv(d.psi) / (d.kappa * (d.nu - 3.)),
+                           rtol=0.15, atol=0.02)
+
+    dists = _matrix_normal_wisharts(3)
+    bank = StackedMatrixNormalWisharts(dists)
+    As, lmbdas = map(np.stack, zip(*[bank.rvs() for _ in range(nb_samples)]))
+    for k, d in enumerate(dists):
+        assert np.allclose(lmbdas[:, k].mean(axis=0), d.nu * d.psi, rtol=0.1, atol=0.05)
+        assert np.allclose(As[:, k].mean(axis=0), d.matnorm.M, atol=0.05)
+
+
+def test_statistics_inplace_arithmetic():
+    npr.seed(4)
+    n = np.array(3.)
+    stats = Stats([npr.randn(2), n, _pd(2), n])
+    prior, posterior = Stats([npr.randn(2), 1., _pd(2), 2.]), Stats([npr.randn(2), 4., _pd(2), 5.])
+
+    reference = 0.3 * stats + 0.5 * prior + 0.2 * posterior
+    result = Stats([np.copy(s) for s in stats]).scale(0.3).axpy(0.5, prior).axpy(0.2, posterior)
+    assert _allclose(result, reference)
+
+    # shared entries are rebound instead of overwritten
+    reference = stats + prior
+    result = stats.accumulate(prior)
+    assert _allclose(result, reference)
+    assert np.allclose(n, 3.) and np.allclose(prior[1], 1.)